@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+
+PRICE_COLUMNS = [
+    'flat - weighted average rate',
+    'office - weighted average rate',
+    'others - weighted average rate',
+    'shop - weighted average rate'
+]
+
+
+def compute_price(df_area):
+    """Copy of ``df_area`` with a row-wise 'price': the mean of the PRICE_COLUMNS present."""
+    df_area = df_area.copy()
+
+    # Preferred price columns defined at module top
+    available = [c for c in PRICE_COLUMNS if c in df_area.columns]
+    if available:
+        try:
+            df_area.loc[:, 'price'] = df_area[available].mean(axis=1)
+            return df_area
+        except Exception:
+            # fall through to try alternatives
+            pass
+
+    # Fallback: try any numeric column that looks like a price
+    numeric_cols = df_area.select_dtypes(include=['number']).columns.tolist()
+    # Exclude Year and Demand
+    numeric_cols = [c for c in numeric_cols if c not in ('Year', 'Demand')]
+
+    if numeric_cols:
+        try:
+            df_area.loc[:, 'price'] = df_area[numeric_cols].iloc[:, 0]
+            return df_area
+        except Exception:
+            pass
+
+    # Last resort: create price as NaN column so downstream code doesn't KeyError
+    df_area.loc[:, 'price'] = pd.NA
+    return df_area
+
+
+# -----------------------------
+# Vectorized per-year aggregation
+# -----------------------------
+# Charts are built from one year-indexed frame per area (columns price and
+# demand, the groupby('Year') means). Comparisons align those frames on the
+# union of their years once and do every difference and growth rate as
+# whole-array operations over an (areas x years) matrix.
+
+def growth_chart(df_area):
+    """[{'year', 'price'}] for every row of the growth window, in row order."""
+    return pd.DataFrame({
+        'year': df_area['Year'].astype(int).to_numpy(),
+        'price': df_area['price'].astype(float).to_numpy(),
+    }).to_dict(orient='records')
+
+
+def align_years(yearlies):
+    """Align year-indexed frames on the union of their (integer) years.
+
+    Returns (years, price, demand) where price and demand have one row per
+    frame. A year an area has no data for counts as 0, while a year whose
+    mean is NaN stays NaN, matching how compare has always filled gaps.
+    """
+    frames = []
+    for yearly in yearlies:
+        yearly = yearly[['price', 'demand']].astype(float)
+        yearly = yearly[yearly.index.notna()]
+        yearly.index = yearly.index.astype(int)
+        frames.append(yearly[~yearly.index.duplicated(keep='last')])
+
+    years = np.unique(np.concatenate([f.index.to_numpy() for f in frames])) if frames else np.array([], dtype=int)
+    price = np.vstack([f['price'].reindex(years, fill_value=0).to_numpy() for f in frames]) if frames else np.empty((0, 0))
+    demand = np.vstack([f['demand'].reindex(years, fill_value=0).to_numpy() for f in frames]) if frames else np.empty((0, 0))
+    return years, price, demand
+
+
+def yoy_pct(values):
+    """Year-over-year % change along the last axis (NaN for the first year)."""
+    values = np.asarray(values, dtype=float)
+    prev = values[..., :-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = np.where(prev != 0, (values[..., 1:] - prev) / np.abs(prev) * 100, np.nan)
+    pad = np.full(values.shape[:-1] + (1,), np.nan)
+    return np.concatenate([pad, change], axis=-1)
+
+
+def cagr_pct(years, values):
+    """Compound annual growth % between the first and last positive value of each row."""
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    years = np.asarray(years, dtype=float)
+    if not values.size:
+        return np.full(values.shape[0], np.nan)
+    valid = np.isfinite(values) & (values > 0)
+    has = valid.any(axis=1)
+    first = np.argmax(valid, axis=1)
+    last = values.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    rows = np.arange(values.shape[0])
+    span = years[last] - years[first]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = (values[rows, last] / values[rows, first]) ** (1.0 / span) - 1
+    return np.where(has & (span > 0), rate * 100, np.nan)
+
+
+def _nan_to_none(values):
+    return [None if v != v else float(v) for v in values]
+
+
+def growth_summary(years, prices):
+    """YoY and CAGR for a single price series (the growth mode payload)."""
+    years = np.asarray(years, dtype=int)
+    prices = np.asarray(prices, dtype=float)
+    return {
+        'yoy': [
+            {'year': int(y), 'price_yoy_pct': v}
+            for y, v in zip(years, _nan_to_none(yoy_pct(prices)))
+        ],
+        'cagr_pct': _nan_to_none(cagr_pct(years, prices))[0] if len(years) else None,
+    }
+
+
+def compare_areas(areas, yearlies):
+    """Per-year differences between ``areas`` from their year-indexed frames.
+
+    The difference is the first area minus the mean of the others, which for
+    two areas is the familiar A - B. Two areas keep the original table keys
+    (price_<a>, price_<b>, price_diff, ...); more areas get one
+    price_diff_<area> / demand_diff_<area> column per non-baseline area.
+    """
+    years, price, demand = align_years(yearlies)
+    price_diff = price[0] - price[1:].mean(axis=0)
+    demand_diff = demand[0] - demand[1:].mean(axis=0)
+
+    chart = pd.DataFrame({'year': years, 'price': price_diff, 'demand': demand_diff}).to_dict(orient='records')
+
+    columns = {'Year': years}
+    if len(areas) == 2:
+        a1, a2 = areas
+        columns.update({
+            f'price_{a1}': price[0], f'price_{a2}': price[1], 'price_diff': price_diff,
+            f'demand_{a1}': demand[0], f'demand_{a2}': demand[1], 'demand_diff': demand_diff,
+        })
+    else:
+        columns.update({f'price_{a}': price[i] for i, a in enumerate(areas)})
+        columns.update({f'price_diff_{a}': price[0] - price[i] for i, a in enumerate(areas) if i})
+        columns.update({f'demand_{a}': demand[i] for i, a in enumerate(areas)})
+        columns.update({f'demand_diff_{a}': demand[0] - demand[i] for i, a in enumerate(areas) if i})
+    table = pd.DataFrame(columns).to_dict(orient='records')
+
+    price_yoy = yoy_pct(price)
+    price_cagr = cagr_pct(years, price)
+    demand_cagr = cagr_pct(years, demand)
+    growth = {
+        a: {
+            'price_yoy_pct': _nan_to_none(price_yoy[i]),
+            'price_cagr_pct': _nan_to_none(price_cagr[i:i + 1])[0],
+            'demand_cagr_pct': _nan_to_none(demand_cagr[i:i + 1])[0],
+        }
+        for i, a in enumerate(areas)
+    }
+    return {'years': years.tolist(), 'chart': chart, 'table': table, 'growth': growth}
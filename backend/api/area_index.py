@@ -0,0 +1,229 @@
+import bisect
+import difflib
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+
+from .area_vectors import RERANK, SUGGEST_CUTOFF, load_vectors
+
+# Similarity cutoffs of the two difflib tiers tried after the nearest-name
+# tier (difflib.get_close_matches, then the best plain SequenceMatcher ratio).
+CLOSE_MATCH_CUTOFF = 0.7
+BEST_MATCH_CUTOFF = 0.6
+# The difflib tiers only look at this many names, the best by n-gram
+# similarity, so they cost the same however many names there are
+DIFFLIB_CANDIDATES = RERANK
+
+
+def clean_areas(areas):
+    """Cleaned (lower-cased, punctuation-free) names of an Area series, as an object array."""
+    clean = areas.astype(str).str.lower().str.replace(r'[^a-z0-9\s]', '', regex=True).str.strip()
+    return clean.to_numpy(dtype=object)
+
+
+def _grams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _length_window(length, cutoff):
+    """Candidate lengths whose best possible ratio against ``length`` reaches ``cutoff``.
+
+    ratio = 2*M / (la + lb) with M <= min(la, lb), so the other string must
+    satisfy cutoff*length / (2-cutoff) <= lb <= (2-cutoff)*length / cutoff.
+    """
+    lo = int(np.ceil(cutoff * length / (2 - cutoff) - 1e-9))
+    hi = int(np.floor((2 - cutoff) * length / cutoff + 1e-9))
+    return lo, hi
+
+
+class AreaIndex:
+    """Lookup structures over the cleaned ``Area`` names of one frame.
+
+    Built once per dataset. Resolution tries exact, substring and prefix
+    matches on the cleaned names, then the nearest name by character n-gram
+    TF-IDF similarity (see ``area_vectors``), which also copes with
+    transliterated and alternate spellings, and last the two difflib tiers
+    for typos it misses (transposed or dropped letters), run over the
+    nearest names' shortlist rather than every name. Pass the dataset's
+    ``snapshot_dir`` to load the vectors from there (or save them there).
+    """
+
+    def __init__(self, df, snapshot_dir=None):
+        if 'Area' in df.columns:
+            areas = df['Area'].astype(str)
+            self.clean = clean_areas(areas)
+        else:
+            areas = pd.Series([], dtype=object)
+            self.clean = np.empty(0, dtype=object)
+
+        codes, uniques = pd.factorize(self.clean, sort=False)
+        # unique names in order of first appearance, like Series.unique()
+        self.names = list(uniques)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(self.names) + 1))
+        self.positions = {
+            name: order[bounds[i]:bounds[i + 1]] for i, name in enumerate(self.names)
+        }
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        # the Area value as written in the data, for suggestions
+        areas = areas.to_numpy(dtype=object)
+        self.labels = [areas[self.positions[name][0]] for name in self.names]
+
+        # sorted names for prefix lookups (bisect stands in for a trie)
+        self._sorted = sorted(self.names)
+
+        # 1..3-gram postings: short queries are answered directly, longer
+        # ones by intersecting their trigram postings
+        self._postings = defaultdict(set)
+        for i, name in enumerate(self.names):
+            for n in (1, 2, 3):
+                for g in _grams(name, n):
+                    self._postings[g].add(i)
+
+        self._counts = [Counter(name) for name in self.names]
+
+        self.vectors = load_vectors(self.names, snapshot_dir)
+
+    def append(self, areas):
+        """Index rows appended to the frame, given their Area values in order.
+
+        Existing names get the new positions, unseen ones are added to every
+        lookup structure. Readers are not blocked: row names are extended
+        before any position refers to them, and positions are swapped in
+        whole, so a reader sees either the old or the new rows of a name.
+        Returns the names that were new.
+        """
+        areas = pd.Series(areas, dtype=object).astype(str)
+        clean = clean_areas(areas)
+        start = len(self.clean)
+        self.clean = np.concatenate([self.clean, clean])
+
+        codes, uniques = pd.factorize(clean, sort=False)
+        added = []
+        labels = areas.to_numpy(dtype=object)
+        for code, name in enumerate(uniques):
+            rows = start + np.flatnonzero(codes == code)
+            if name in self.positions:
+                self.positions[name] = np.concatenate([self.positions[name], rows])
+                continue
+            i = len(self.names)
+            self.labels.append(labels[rows[0] - start])
+            self.names.append(name)
+            self.ids[name] = i
+            self.positions[name] = rows
+            for n in (1, 2, 3):
+                for g in _grams(name, n):
+                    self._postings[g].add(i)
+            self._counts.append(Counter(name))
+            added.append(name)
+
+        if added:
+            self._sorted = sorted(self._sorted + added)
+            self.vectors = self.vectors.extend(added)
+        return added
+
+    # -----------------------------
+    # Tiers
+    # -----------------------------
+    def exact(self, q):
+        return [q] if q in self.positions else []
+
+    def contains(self, q):
+        if not q:
+            return list(self.names)
+        if len(q) <= 3:
+            ids = self._postings.get(q, set())
+        else:
+            grams = sorted(_grams(q, 3), key=lambda g: len(self._postings.get(g, ())))
+            ids = set(self._postings.get(grams[0], ()))
+            for g in grams[1:]:
+                if not ids:
+                    break
+                ids &= self._postings.get(g, set())
+        return [self.names[i] for i in sorted(ids) if q in self.names[i]]
+
+    def prefix(self, q):
+        start = bisect.bisect_left(self._sorted, q)
+        out = []
+        for name in self._sorted[start:]:
+            if not name.startswith(q):
+                break
+            out.append(name)
+        return sorted(out, key=self.ids.__getitem__)
+
+    def nearest(self, q):
+        """Best name by n-gram TF-IDF similarity, if it clears the match cutoff."""
+        return self.vectors.match(q)
+
+    def _candidates(self, q, cutoff):
+        """Ids of the DIFFLIB_CANDIDATES nearest names whose length can reach ``cutoff``, nearest first."""
+        lo, hi = _length_window(len(q), cutoff)
+        return [
+            self.ids[name] for name, _ in self.vectors.nearest(q, DIFFLIB_CANDIDATES)
+            if lo <= len(name) <= hi
+        ]
+
+    def _upper_bound(self, q, qcount, i):
+        # difflib's quick_ratio: matching characters regardless of order
+        matches = sum((qcount & self._counts[i]).values())
+        return 2.0 * matches / (len(q) + len(self.names[i])) if (len(q) + len(self.names[i])) else 1.0
+
+    def close_match(self, q):
+        """``difflib.get_close_matches(q, names, n=1, cutoff=0.7)`` over the nearest names."""
+        qcount = Counter(q)
+        s = difflib.SequenceMatcher()
+        s.set_seq2(q)
+        best = None
+        for i in self._candidates(q, CLOSE_MATCH_CUTOFF):
+            bound = self._upper_bound(q, qcount, i)
+            if bound < CLOSE_MATCH_CUTOFF or (best is not None and bound < best[0]):
+                continue
+            s.set_seq1(self.names[i])
+            score = s.ratio()
+            if score >= CLOSE_MATCH_CUTOFF and (best is None or (score, self.names[i]) > best):
+                best = (score, self.names[i])
+        return [best[1]] if best else []
+
+    def best_match(self, q):
+        """The first-best ``SequenceMatcher(None, q, name)`` ratio (>= 0.6) over the nearest names."""
+        qcount = Counter(q)
+        s = difflib.SequenceMatcher()
+        s.set_seq1(q)
+        best = None
+        for i in self._candidates(q, BEST_MATCH_CUTOFF):
+            bound = self._upper_bound(q, qcount, i)
+            if bound < BEST_MATCH_CUTOFF or (best is not None and bound < best[0]):
+                continue
+            s.set_seq2(self.names[i])
+            score = s.ratio()
+            # ties go to the name seen first in the data
+            if score >= BEST_MATCH_CUTOFF and (best is None or (score, -i) > best):
+                best = (score, -i)
+        return [self.names[-best[1]]] if best else []
+
+    def match(self, area_query):
+        """Return the cleaned names ``area_query`` resolves to (empty if none)."""
+        q = str(area_query).strip().lower()
+        # the difflib tiers catch transposed and dropped letters the n-grams miss
+        for tier in (self.exact, self.contains, self.prefix, self.nearest, self.close_match, self.best_match):
+            names = tier(q)
+            if names:
+                return names
+        return []
+
+    def suggest(self, area_query, k=5):
+        """Ranked {'area', 'score'} suggestions for a query that matched nothing."""
+        return [
+            {'area': self.labels[self.ids[name]], 'score': round(score, 3)}
+            for name, score in self.vectors.nearest(area_query, k, SUGGEST_CUTOFF)
+        ]
+
+    def rows(self, names):
+        """Sorted row positions for the given cleaned names."""
+        if not names:
+            return np.empty(0, dtype=np.intp)
+        if len(names) == 1:
+            return self.positions[names[0]]
+        return np.sort(np.concatenate([self.positions[n] for n in names]))
+
@@ -0,0 +1,315 @@
+"""Character n-gram TF-IDF vectors over area names.
+
+Names are folded (Devanagari transliterated, accents stripped, common
+alternate spellings of Marathi place names collapsed: w/v, aspirates,
+doubled letters...) and cut into padded character 2- and 3-grams, which
+are hashed into ``DIMS`` buckets and weighted by TF-IDF. The vectors are
+L2-normalized, so a query's cosine similarity to the names is a sparse
+matrix-vector product.
+
+The sparse matrix lives in plain NumPy arrays (no SciPy), persisted
+memory-mappable next to the dataset snapshot. A lookup reads the columns
+of the query's rarest n-grams to pick candidates and scores only those
+rows exactly, so its cost is bounded however many names there are.
+"""
+import hashlib
+import json
+import logging
+import re
+import unicodedata
+import zlib
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from .snapshot import publish_dir
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+DIMS = 1 << 16
+NGRAMS = (2, 3)
+
+# A query resolves to the best name at or above MATCH_CUTOFF; names scoring
+# at least SUGGEST_CUTOFF are offered as suggestions when nothing does.
+MATCH_CUTOFF = 0.45
+SUGGEST_CUTOFF = 0.2
+
+# Lookup work per query: postings read to find candidates, and how many of
+# them are scored exactly (see AreaVectors._candidates)
+CANDIDATE_POSTINGS = 4096
+RERANK = 64
+
+
+# -----------------------------
+# Folding
+# -----------------------------
+_VOWELS = {
+    'अ': 'a', 'आ': 'a', 'इ': 'i', 'ई': 'i', 'उ': 'u', 'ऊ': 'u', 'ऋ': 'ri',
+    'ए': 'e', 'ऐ': 'ai', 'ओ': 'o', 'औ': 'au',
+}
+_VOWEL_SIGNS = {
+    'ा': 'a', 'ि': 'i', 'ी': 'i', 'ु': 'u', 'ू': 'u', 'ृ': 'ri',
+    'े': 'e', 'ै': 'ai', 'ो': 'o', 'ौ': 'au',
+}
+_MODIFIERS = {'ं': 'n', 'ँ': 'n', 'ः': 'h'}
+_CONSONANTS = dict(zip(
+    'कखगघङचछजझञटठडढणतथदधनपफबभमयरलवशषसहळ',
+    ['k', 'kh', 'g', 'gh', 'n', 'ch', 'chh', 'j', 'jh', 'n', 't', 'th', 'd', 'dh', 'n',
+     't', 'th', 'd', 'dh', 'n', 'p', 'ph', 'b', 'bh', 'm', 'y', 'r', 'l', 'v',
+     'sh', 'sh', 's', 'h', 'l'],
+))
+_VIRAMA = '्'
+_NUKTA = '़'
+
+# Applied in order to the transliterated, lower-cased ASCII name
+_FOLDS = [
+    (re.compile(r'ee'), 'i'),
+    (re.compile(r'oo'), 'u'),
+    (re.compile(r'w'), 'v'),
+    (re.compile(r'ph'), 'f'),
+    (re.compile(r'z'), 'j'),
+    (re.compile(r'([kgcjtdbs])h'), r'\1'),
+    (re.compile(r'([a-z])\1+'), r'\1'),
+]
+
+
+def _transliterate(text):
+    """Romanize Devanagari; Marathi drops the inherent vowel at the end of a word."""
+    out = []
+    for i, ch in enumerate(text):
+        if ch in _CONSONANTS:
+            out.append(_CONSONANTS[ch])
+            nxt = text[i + 1] if i + 1 < len(text) else ''
+            if nxt == _NUKTA:
+                nxt = text[i + 2] if i + 2 < len(text) else ''
+            if nxt not in _VOWEL_SIGNS and nxt != _VIRAMA and (nxt in _CONSONANTS or nxt in _MODIFIERS):
+                out.append('a')
+        elif ch in _VOWELS:
+            out.append(_VOWELS[ch])
+        elif ch in _VOWEL_SIGNS:
+            out.append(_VOWEL_SIGNS[ch])
+        elif ch in _MODIFIERS:
+            out.append(_MODIFIERS[ch])
+        elif ch not in (_VIRAMA, _NUKTA):
+            out.append(ch)
+    return ''.join(out)
+
+
+def fold(text):
+    """Spelling-insensitive form of an area name: 'Wakad', 'Vakad' and 'वाकड' all fold to 'vakad'."""
+    text = _transliterate(unicodedata.normalize('NFC', str(text)))
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    text = re.sub(r'[^a-z0-9]+', ' ', text).strip()
+    for pattern, repl in _FOLDS:
+        text = pattern.sub(repl, text)
+    return text
+
+
+def _buckets(text):
+    """Hash bucket of every n-gram of the folded, space-padded ``text``."""
+    padded = f' {fold(text)} '
+    return [
+        zlib.crc32(padded[i:i + n].encode()) % DIMS
+        for n in NGRAMS for i in range(len(padded) - n + 1)
+    ]
+
+
+def _term_weights(buckets):
+    """(bucket ids, sublinear term frequencies) of one name."""
+    counts = Counter(buckets)
+    ids = np.fromiter(sorted(counts), dtype=np.int64, count=len(counts))
+    return ids, 1.0 + np.log(np.fromiter((counts[i] for i in ids.tolist()), dtype=np.float64, count=len(ids)))
+
+
+def names_digest(names):
+    return hashlib.sha1('\n'.join(names).encode('utf-8')).hexdigest()
+
+
+# -----------------------------
+# Index
+# -----------------------------
+class AreaVectors:
+    """TF-IDF n-gram vectors for ``names``, answering nearest-name queries.
+
+    The matrix is kept twice: by bucket (``indptr``/``rows``/``weights``,
+    CSC) to find the names sharing a query's n-grams, and by name
+    (``row_indptr``/``cols``/``vals``, CSR) to score those candidates.
+    """
+
+    def __init__(self, names, indptr, rows, weights, row_indptr, cols, vals, idf):
+        self.names = list(names)
+        self.indptr = indptr
+        self.rows = rows
+        self.weights = weights
+        self.row_indptr = row_indptr
+        self.cols = cols
+        self.vals = vals
+        self.idf = idf
+
+    @classmethod
+    def build(cls, names):
+        terms = [_term_weights(_buckets(name)) for name in names]
+        n = len(terms)
+        lengths = np.array([len(t[0]) for t in terms], dtype=np.int64)
+        cols = np.concatenate([t[0] for t in terms]) if n else np.empty(0, dtype=np.int64)
+        tf = np.concatenate([t[1] for t in terms]) if n else np.empty(0)
+        rows = np.repeat(np.arange(n, dtype=np.int32), lengths)
+
+        df = np.bincount(cols, minlength=DIMS)
+        idf = (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+        vals = tf * idf[cols]
+        norms = np.sqrt(np.bincount(rows, weights=vals ** 2, minlength=n))
+        vals = (vals / np.where(norms, norms, 1.0)[rows]).astype(np.float32)
+        row_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(lengths, out=row_indptr[1:])
+
+        # column-major copy: every name holding bucket d sits in rows[indptr[d]:indptr[d+1]]
+        order = np.argsort(cols, kind='stable')
+        indptr = np.zeros(DIMS + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+        return cls(names, indptr, rows[order], vals[order], row_indptr,
+                   cols.astype(np.int32), vals, idf)
+
+    def extend(self, names):
+        """A copy that also holds ``names``, weighted with the current IDF.
+
+        Used when areas are added to a live dataset: the IDF is not
+        re-estimated, so existing vectors keep their weights, and only the
+        bucket-major arrays are re-sorted.
+        """
+        if not names:
+            return self
+        terms = [_term_weights(_buckets(name)) for name in names]
+        n = len(self.names)
+        lengths = np.array([len(t[0]) for t in terms], dtype=np.int64)
+        cols = np.concatenate([t[0] for t in terms])
+        vals = np.concatenate([t[1] for t in terms]) * self.idf[cols]
+        rows = np.repeat(np.arange(n, n + len(names), dtype=np.int32), lengths)
+        norms = np.sqrt(np.bincount(rows - n, weights=vals ** 2))
+        vals = (vals / np.where(norms, norms, 1.0)[rows - n]).astype(np.float32)
+
+        all_cols = np.concatenate([self.cols, cols.astype(np.int32)])
+        all_vals = np.concatenate([self.vals, vals])
+        row_indptr = np.concatenate([self.row_indptr, self.row_indptr[-1] + np.cumsum(lengths)])
+        all_rows = np.repeat(np.arange(n + len(names), dtype=np.int32), np.diff(row_indptr))
+        order = np.argsort(all_cols, kind='stable')
+        indptr = np.zeros(DIMS + 1, dtype=np.int64)
+        np.cumsum(np.bincount(all_cols, minlength=DIMS), out=indptr[1:])
+        return AreaVectors(self.names + list(names), indptr, all_rows[order], all_vals[order],
+                           row_indptr, all_cols, all_vals, self.idf)
+
+    def _query(self, query):
+        """(bucket ids, unit weights) of the query vector; empty when it has no known n-gram."""
+        ids, tf = _term_weights(_buckets(query))
+        q = tf * self.idf[ids]
+        norm = np.sqrt(np.dot(q, q))
+        keep = self.indptr[ids + 1] > self.indptr[ids]
+        return ids[keep], (q[keep] / norm if norm else q[keep])
+
+    def _candidates(self, ids, q):
+        """The names most likely to score highest, for exact rescoring.
+
+        Columns are read rarest first while they fit in CANDIDATE_POSTINGS
+        entries; the partial scores they give pick the best RERANK names.
+        When every column fits (small datasets) the choice is exact.
+        """
+        order = np.argsort(self.indptr[ids + 1] - self.indptr[ids], kind='stable')
+        lengths = (self.indptr[ids + 1] - self.indptr[ids])[order]
+        taken = max(1, int(np.searchsorted(np.cumsum(lengths), CANDIDATE_POSTINGS, side='right')))
+        cols = [slice(self.indptr[d], self.indptr[d + 1]) for d in ids[order[:taken]]]
+        rows = np.concatenate([self.rows[c] for c in cols])
+        weights = np.concatenate([self.weights[c] * w for c, w in zip(cols, q[order[:taken]])])
+        partial = np.bincount(rows, weights=weights, minlength=len(self.names))
+        rows.sort()
+        # distinct rows; a plain sort beats np.unique at this size
+        candidates = rows[np.concatenate(([True], rows[1:] != rows[:-1]))]
+        if len(candidates) > RERANK:
+            candidates = np.sort(candidates[np.argpartition(-partial[candidates], RERANK - 1)[:RERANK]])
+        return candidates
+
+    def _score(self, candidates, ids, q):
+        """Exact cosine of each candidate: its CSR row times the query vector."""
+        dense = np.zeros(DIMS, dtype=np.float32)
+        dense[ids] = q
+        starts = self.row_indptr[candidates]
+        lengths = self.row_indptr[candidates + 1] - starts
+        heads = np.cumsum(lengths) - lengths
+        entries = np.repeat(starts - heads, lengths) + np.arange(lengths.sum())
+        return np.add.reduceat(self.vals[entries] * dense[self.cols[entries]], heads)
+
+    def nearest(self, query, k=5, cutoff=0.0):
+        """Up to ``k`` (name, score) pairs scoring at least ``cutoff``, best first."""
+        ids, q = self._query(query)
+        if not len(ids):
+            return []
+        candidates = self._candidates(ids, q)
+        if not len(candidates):
+            return []
+        scores = self._score(candidates, ids, q)
+        keep = scores >= cutoff
+        candidates, scores = candidates[keep], scores[keep]
+        if len(candidates) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            candidates, scores = candidates[top], scores[top]
+        # ties go to the name seen first in the data
+        ranked = sorted(zip(candidates.tolist(), scores.tolist()), key=lambda c: (-c[1], c[0]))
+        return [(self.names[i], score) for i, score in ranked]
+
+    def match(self, query, cutoff=MATCH_CUTOFF):
+        best = self.nearest(query, k=1, cutoff=cutoff)
+        return [best[0][0]] if best else []
+
+    def __len__(self):
+        return len(self.names)
+
+
+# -----------------------------
+# Persistence
+# -----------------------------
+# Stored as an 'area_vectors' directory inside the dataset snapshot.
+ARRAYS = ('indptr', 'rows', 'weights', 'row_indptr', 'cols', 'vals', 'idf')
+
+
+def write_vectors(vectors, snapshot_dir):
+    def write(tmp):
+        for name in ARRAYS:
+            np.save(tmp / f'{name}.npy', getattr(vectors, name))
+        meta = {'format': FORMAT_VERSION, 'dims': DIMS, 'ngrams': list(NGRAMS),
+                'names': names_digest(vectors.names)}
+        (tmp / 'meta.json').write_text(json.dumps(meta))
+
+    return publish_dir(Path(snapshot_dir) / 'area_vectors', write)
+
+
+def read_vectors(names, snapshot_dir):
+    """The persisted vectors for ``names``, or None when absent or built differently."""
+    path = Path(snapshot_dir) / 'area_vectors'
+    try:
+        meta = json.loads((path / 'meta.json').read_text())
+    except (OSError, ValueError):
+        return None
+    expected = {'format': FORMAT_VERSION, 'dims': DIMS, 'ngrams': list(NGRAMS), 'names': names_digest(names)}
+    if meta != expected:
+        return None
+    try:
+        arrays = [np.asarray(np.load(path / f'{name}.npy', mmap_mode='r')) for name in ARRAYS]
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable area vectors {path}: {e}")
+        return None
+    return AreaVectors(names, *arrays)
+
+
+def load_vectors(names, snapshot_dir=None):
+    """Vectors for ``names``, read from ``snapshot_dir`` or built (and saved there)."""
+    if snapshot_dir is None or not Path(snapshot_dir).is_dir():
+        return AreaVectors.build(names)
+    vectors = read_vectors(names, snapshot_dir)
+    if vectors is None:
+        vectors = AreaVectors.build(names)
+        try:
+            write_vectors(vectors, snapshot_dir)
+        except Exception as e:
+            logger.warning(f"Could not write area vectors to {snapshot_dir}: {e}")
+    return vectors
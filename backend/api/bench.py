@@ -0,0 +1,167 @@
+"""Building blocks for ``manage.py benchmark``.
+
+Synthetic workbooks are the bundled sample tiled ``scale`` times with
+jittered numbers; ``StubOpenAI`` answers chat completions locally after a
+fixed delay so runs measure our own code, not the network.
+"""
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from . import openai_utils
+from .dataset import BASE, SAMPLE_PATH
+from .prompts import estimate_tokens
+from .summary_cache import summary_cache
+
+BENCH_DIR = BASE / '.benchmarks'
+
+# Rows of one tiled copy share an area name with nine others, so both the
+# number of areas and the rows per area grow with the scale.
+COPIES_PER_AREA = 10
+
+
+# -----------------------------
+# Synthetic workbooks
+# -----------------------------
+def synthetic_frame(scale, seed=0):
+    """The raw sample sheet repeated ``scale`` times, numeric columns jittered by ~5%."""
+    raw = pd.read_excel(SAMPLE_PATH)
+    if scale <= 1:
+        return raw
+
+    rng = np.random.default_rng(seed)
+    frame = pd.concat([raw] * scale, ignore_index=True)
+    copy = np.repeat(np.arange(scale), len(raw)) // COPIES_PER_AREA
+    area = frame['final location'].astype(str)
+    frame['final location'] = area.where(copy == 0, area + ' ' + copy.astype(str))
+
+    for name in frame.columns:
+        if name == 'year' or not pd.api.types.is_float_dtype(frame[name]):
+            continue
+        frame[name] = frame[name] * rng.normal(1.0, 0.05, len(frame))
+    return frame
+
+
+def synthetic_workbook(scale, root=None):
+    """Path of the ×``scale`` workbook, generated on first use. Scale 1 is the sample itself."""
+    if scale <= 1:
+        return SAMPLE_PATH
+    root = Path(root or BENCH_DIR / 'data')
+    path = root / f'sample_x{scale}.xlsx'
+    if not path.exists():
+        root.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp.xlsx')
+        synthetic_frame(scale).to_excel(tmp, index=False)
+        tmp.replace(path)
+    return path
+
+
+# -----------------------------
+# Stand-in OpenAI client
+# -----------------------------
+class StubOpenAI:
+    """Answers ``chat.completions.create`` like the OpenAI client, after ``latency`` seconds."""
+
+    def __init__(self, latency=0.2):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model=None, messages=(), stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+        prompt = messages[-1]['content'] if messages else ''
+        text = f"Stub summary of a {len(prompt)}-character prompt."
+        if stream:
+            return self._stream(text)
+        time.sleep(self.latency)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+            usage=SimpleNamespace(prompt_tokens=estimate_tokens(prompt), completion_tokens=estimate_tokens(text)),
+        )
+
+    def _stream(self, text):
+        words = text.split(' ')
+        for i, word in enumerate(words):
+            time.sleep(self.latency / len(words))
+            delta = word if i == len(words) - 1 else word + ' '
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+
+class AsyncStubOpenAI(StubOpenAI):
+    """StubOpenAI for the async code paths; waits with asyncio.sleep."""
+
+    async def _create(self, model=None, messages=(), stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+        prompt = messages[-1]['content'] if messages else ''
+        text = f"Stub summary of a {len(prompt)}-character prompt."
+        if stream:
+            return self._stream(text)
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+            usage=SimpleNamespace(prompt_tokens=estimate_tokens(prompt), completion_tokens=estimate_tokens(text)),
+        )
+
+    async def _stream(self, text):
+        words = text.split(' ')
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.latency / len(words))
+            delta = word if i == len(words) - 1 else word + ' '
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+
+@contextmanager
+def stub_llm(latency=0.2, summary_cache_enabled=False):
+    """Swap in stubs for the sync and async OpenAI clients; the summary cache is bypassed by default.
+
+    Yields the sync stub; the async one is ``openai_utils.aclient``.
+    """
+    stub = StubOpenAI(latency)
+    saved = openai_utils.client, openai_utils.aclient, summary_cache.path
+    openai_utils.client = stub
+    openai_utils.aclient = AsyncStubOpenAI(latency)
+    if not summary_cache_enabled:
+        summary_cache.path = None
+    try:
+        yield stub
+    finally:
+        openai_utils.client, openai_utils.aclient, summary_cache.path = saved
+
+
+# -----------------------------
+# Statistics
+# -----------------------------
+def percentiles(samples_ms):
+    """p50/p95/p99/mean/max of a list of millisecond timings."""
+    if not samples_ms:
+        return {}
+    values = np.asarray(samples_ms, dtype=float)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'p50': round(float(p50), 3),
+        'p95': round(float(p95), 3),
+        'p99': round(float(p99), 3),
+        'mean': round(float(values.mean()), 3),
+        'max': round(float(values.max()), 3),
+    }
+
+
+def parse_server_timing(header):
+    """{stage: milliseconds} from a Server-Timing header value."""
+    stages = {}
+    for entry in (header or '').split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip() == 'dur' and name:
+                stages[name] = stages.get(name, 0.0) + float(value)
+    return stages
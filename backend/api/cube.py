@@ -0,0 +1,296 @@
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .aggregates import PRICE_COLUMNS, cagr_pct, compute_price
+from .area_vectors import names_digest
+from .snapshot import publish_dir
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+# -----------------------------
+# Area x Year cube
+# -----------------------------
+# For every measure (price, demand and each rate column) the cube holds the
+# sum and the count of non-null row values per (area, year), as dense
+# (areas x years) arrays whose rows follow the dataset's area index. Means
+# over any set of areas are exact (a query may match several), single-area
+# charts are a slice, and cross-area rankings are whole-array operations.
+
+# 'flat - weighted average rate' -> 'flat'
+RATE_MEASURES = {column: column.split(' - ')[0] for column in PRICE_COLUMNS}
+
+STATS = ('latest', 'first', 'mean', 'change', 'cagr')
+
+
+class InvalidMetric(ValueError):
+    """An unknown ``<measure>_<stat>`` metric name."""
+
+
+def _row_values(df):
+    """{measure: float array} of per-row values; price follows compute_price."""
+    price = compute_price(df)['price']
+    values = {'price': pd.to_numeric(price, errors='coerce')}
+    if 'Demand' in df.columns:
+        values['demand'] = pd.to_numeric(df['Demand'], errors='coerce')
+    else:
+        values['demand'] = pd.Series(np.nan, index=df.index)
+    for column, measure in RATE_MEASURES.items():
+        if column in df.columns:
+            values[measure] = pd.to_numeric(df[column], errors='coerce')
+    return {measure: v.to_numpy(dtype=float, na_value=np.nan) for measure, v in values.items()}
+
+
+def _years(df):
+    return pd.to_numeric(df['Year'], errors='coerce').to_numpy()
+
+
+class AreaCube:
+    """Per-(area, year) sums and counts for one dataset; treat as read-only.
+
+    ``names`` are the cleaned area names (rows), ``years`` the sorted years
+    (columns, in the frame's Year dtype), ``rows`` the number of rows per
+    cell and ``sums``/``counts`` one array per measure.
+    """
+
+    def __init__(self, names, labels, years, rows, sums, counts):
+        self.names = list(names)
+        self.labels = list(labels)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.years = years
+        self.rows = rows
+        self.sums = sums
+        self.counts = counts
+
+    @classmethod
+    def build(cls, frame, index):
+        """Aggregate the whole ``frame``; rows follow ``index.names``."""
+        years = _years(frame)
+        years = np.unique(years[~np.isnan(years)]).astype(frame['Year'].dtype)
+        shape = (len(index.names), len(years))
+        values = _row_values(frame)
+        cube = cls(index.names, index.labels, years, np.zeros(shape, dtype=np.int64),
+                   {m: np.zeros(shape) for m in values}, {m: np.zeros(shape, dtype=np.int64) for m in values})
+        codes = np.empty(len(frame), dtype=np.int64)
+        for name, positions in index.positions.items():
+            codes[positions] = index.ids[name]
+        cube._accumulate(codes, _years(frame), values)
+        return cube
+
+    def _accumulate(self, codes, years, values):
+        """Add rows (cube row ``codes``, ``years``, measure ``values``) into the arrays in place."""
+        valid = ~np.isnan(years)
+        cells = codes[valid] * len(self.years) + np.searchsorted(self.years, years[valid])
+        size = self.rows.size
+        self.rows += np.bincount(cells, minlength=size).reshape(self.rows.shape)
+        for measure, v in values.items():
+            v = v[valid]
+            present = ~np.isnan(v)
+            self.sums[measure] += np.bincount(cells[present], weights=v[present], minlength=size).reshape(self.rows.shape)
+            self.counts[measure] += np.bincount(cells[present], minlength=size).reshape(self.rows.shape)
+
+    def updated(self, frame, index, names):
+        """A copy with the areas ``names`` re-aggregated from ``frame``.
+
+        Areas and years the cube has not seen are added; every other cell
+        is carried over, so the work is proportional to the touched rows.
+        """
+        positions = np.concatenate([index.positions[name] for name in names])
+        df = frame.iloc[positions]
+        new_years = _years(df)
+        years = np.union1d(self.years, new_years[~np.isnan(new_years)]).astype(frame['Year'].dtype)
+        shape = (len(index.names), len(years))
+        columns = np.searchsorted(years, self.years)
+        old = len(self.names)
+
+        def grow(array):
+            out = np.zeros(shape, dtype=array.dtype)
+            out[:old, columns] = array
+            return out
+
+        values = _row_values(df)
+        cube = AreaCube(index.names, index.labels, years, grow(self.rows),
+                        {m: grow(a) for m, a in self.sums.items()},
+                        {m: grow(a) for m, a in self.counts.items()})
+        ids = [index.ids[name] for name in names]
+        for array in [cube.rows, *cube.sums.values(), *cube.counts.values()]:
+            array[ids] = 0
+        codes = np.empty(len(df), dtype=np.int64)
+        start = 0
+        for name in names:
+            n = len(index.positions[name])
+            codes[start:start + n] = index.ids[name]
+            start += n
+        cube._accumulate(codes, new_years, {m: values[m] for m in cube.sums})
+        return cube
+
+    # -----------------------------
+    # Slices
+    # -----------------------------
+    def means(self, measure, ids=None, columns=slice(None)):
+        """Mean per cell (NaN where there is no value) for rows ``ids`` (all by default)."""
+        sums, counts = self.sums[measure], self.counts[measure]
+        if ids is not None:
+            sums, counts = sums[ids], counts[ids]
+        sums, counts = sums[:, columns], counts[:, columns]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+    def yearly(self, names):
+        """Mean price and demand per year over the rows of ``names``.
+
+        Same frame as ``df.groupby('Year').agg({'price': 'mean', 'demand':
+        'mean'})`` over those rows; None when a name is not in the cube.
+        """
+        ids = [self.ids.get(name) for name in names]
+        if not ids or None in ids:
+            return None
+        present = self.rows[ids].sum(axis=0) > 0
+        data = {}
+        for measure in ('price', 'demand'):
+            sums = self.sums[measure][ids].sum(axis=0)[present]
+            counts = self.counts[measure][ids].sum(axis=0)[present]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                data[measure] = np.where(counts > 0, sums / counts, np.nan)
+        return pd.DataFrame(data, index=pd.Index(self.years[present], name='Year'))
+
+    # -----------------------------
+    # Cross-area metrics
+    # -----------------------------
+    def window(self, years=None):
+        """Column selector for the last ``years`` years of the cube (all when None)."""
+        if years is None or not len(self.years):
+            return np.ones(len(self.years), dtype=bool)
+        return self.years >= self.years.max() - int(years) + 1
+
+    def metric(self, name, window):
+        """``<measure>_<stat>`` for every area over the ``window`` columns.
+
+        Stats: latest/first (value of the last/first year with data),
+        mean (of the yearly means), change (% from first to latest) and
+        cagr (compound annual growth %).
+        """
+        measure, _, stat = name.rpartition('_')
+        if measure not in self.sums or stat not in STATS:
+            raise InvalidMetric(f"Unknown metric {name!r}")
+        values = self.means(measure, columns=window)
+        years = self.years[window]
+        if stat == 'cagr':
+            return cagr_pct(years, values)
+        if stat == 'mean':
+            with np.errstate(invalid='ignore'):
+                counts = np.isfinite(values).sum(axis=1)
+                return np.where(counts > 0, np.nansum(values, axis=1) / np.maximum(counts, 1), np.nan)
+
+        valid = np.isfinite(values)
+        has = valid.any(axis=1)
+        rows = np.arange(values.shape[0])
+        first = values[rows, np.argmax(valid, axis=1)] if values.size else np.full(len(rows), np.nan)
+        latest = values[rows, values.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)] if values.size else first
+        if stat == 'first':
+            return np.where(has, first, np.nan)
+        if stat == 'latest':
+            return np.where(has, latest, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(has & (first != 0), (latest - first) / np.abs(first) * 100, np.nan)
+
+    def rank(self, by='price_cagr', years=None, ascending=False, limit=10, filters=()):
+        """Areas ordered by metric ``by`` among those passing ``filters``.
+
+        ``filters`` are (metric, 'min' | 'max', bound) triples, inclusive.
+        Areas without a value for ``by`` (or a filtered metric) are left
+        out; ties keep the order areas first appear in the data.
+        """
+        window = self.window(years)
+        score = self.metric(by, window)
+        keep = np.isfinite(score)
+        shown = {by: score}
+        for metric, op, bound in filters:
+            values = shown.get(metric)
+            if values is None:
+                values = shown[metric] = self.metric(metric, window)
+            with np.errstate(invalid='ignore'):
+                keep &= (values >= bound) if op == 'min' else (values <= bound)
+
+        ids = np.flatnonzero(keep)
+        key = score[ids] if ascending else -score[ids]
+        ids = ids[np.argsort(key, kind='stable')][:limit]
+
+        span = self.years[window]
+        return {
+            'years': [span.min().item(), span.max().item()] if len(span) else [],
+            'total': int(keep.sum()),
+            'results': [
+                {'area': self.labels[i], **{m: round(float(v[i]), 4) for m, v in shown.items()}}
+                for i in ids
+            ],
+        }
+
+    def measures(self):
+        return list(self.sums)
+
+    def __repr__(self):
+        return f"<AreaCube {len(self.names)} areas x {len(self.years)} years>"
+
+
+# -----------------------------
+# Persistence
+# -----------------------------
+# Stored as a 'cube' directory inside the dataset snapshot, next to the area
+# vectors. Arrays are memory-mapped on load, so every worker process reading
+# the same snapshot shares one copy through the page cache; updates never
+# write into them (``updated`` builds new arrays).
+
+def write_cube(cube, snapshot_dir, rows):
+    """Save ``cube``, built from a frame of ``rows`` rows, under ``snapshot_dir``."""
+    def write(tmp):
+        np.save(tmp / 'years.npy', cube.years)
+        np.save(tmp / 'rows.npy', cube.rows)
+        for measure in cube.sums:
+            np.save(tmp / f'{measure}.sums.npy', cube.sums[measure])
+            np.save(tmp / f'{measure}.counts.npy', cube.counts[measure])
+        meta = {'format': FORMAT_VERSION, 'rows': rows, 'names': names_digest(cube.names),
+                'measures': list(cube.sums)}
+        (tmp / 'meta.json').write_text(json.dumps(meta))
+
+    return publish_dir(Path(snapshot_dir) / 'cube', write)
+
+
+def read_cube(index, snapshot_dir, rows):
+    """The persisted cube for ``index`` over ``rows`` rows, or None when absent or stale."""
+    path = Path(snapshot_dir) / 'cube'
+    try:
+        meta = json.loads((path / 'meta.json').read_text())
+    except (OSError, ValueError):
+        return None
+    if (meta.get('format'), meta.get('rows'), meta.get('names')) != (FORMAT_VERSION, rows, names_digest(index.names)):
+        return None
+    try:
+        def load(name):
+            return np.asarray(np.load(path / f'{name}.npy', mmap_mode='r'))
+        sums = {m: load(f'{m}.sums') for m in meta['measures']}
+        counts = {m: load(f'{m}.counts') for m in meta['measures']}
+        return AreaCube(index.names, index.labels, load('years'), load('rows'), sums, counts)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable cube {path}: {e}")
+        return None
+
+
+def load_cube(frame, index, snapshot_dir=None):
+    """Cube for ``frame``, read from ``snapshot_dir`` or built (and saved there)."""
+    if snapshot_dir is None or not Path(snapshot_dir).is_dir():
+        return AreaCube.build(frame, index)
+    cube = read_cube(index, snapshot_dir, len(frame))
+    if cube is None:
+        cube = AreaCube.build(frame, index)
+        try:
+            write_cube(cube, snapshot_dir, len(frame))
+        except Exception as e:
+            logger.warning(f"Could not write cube to {snapshot_dir}: {e}")
+    return cube
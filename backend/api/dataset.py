@@ -0,0 +1,488 @@
+import hashlib
+import itertools
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .area_index import AreaIndex, clean_areas
+from .area_vectors import write_vectors
+from .cube import load_cube, write_cube
+from .snapshot import (
+    build_lock, publish, published_entry, published_version, read_snapshot, snapshot_path, write_snapshot
+)
+
+logger = logging.getLogger(__name__)
+
+BASE = Path(__file__).resolve().parent.parent
+SAMPLE_PATH = BASE / 'sample_data' / 'Sample_data.xlsx'
+
+COLUMN_RENAMES = {
+    "final location": "Area",
+    "year": "Year",
+    "total sold - igr": "Demand"
+}
+
+
+# -----------------------------
+# Loading / normalization
+# -----------------------------
+def normalize_frame(df):
+    """Apply the column renames and Area/Year cleanup every analysis expects."""
+    df.rename(columns=COLUMN_RENAMES, inplace=True)
+
+    # Normalize area and year columns to avoid mismatches
+    if 'Area' in df.columns:
+        df['Area'] = df['Area'].astype(str).str.strip()
+
+    if 'Year' in df.columns:
+        # try to coerce to int where possible
+        df['Year'] = pd.to_numeric(df['Year'], errors='coerce')
+
+    return df
+
+
+def read_workbook(source):
+    """Parse an Excel workbook (path or file object) into a normalized frame."""
+    return normalize_frame(pd.read_excel(source))
+
+
+def load_frame(source, digest):
+    """Return the normalized frame for a workbook, from its snapshot when one exists.
+
+    On a miss the workbook is parsed and a snapshot is written for next time.
+    """
+    frame = read_snapshot(digest)
+    if frame is not None:
+        return frame
+    frame = read_workbook(source)
+    try:
+        write_snapshot(frame, digest)
+    except Exception as e:
+        logger.warning(f"Could not write snapshot {digest[:12]}: {e}")
+    return frame
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Return the sha256 hex digest of a file on disk."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# -----------------------------
+# Upserted rows
+# -----------------------------
+def _incoming_rows(rows):
+    """Normalized frame of upserted ``rows`` and a same-shaped mask of the values each row carries.
+
+    Raises ValueError when a column is given under two names (e.g.
+    'final location' and 'Area').
+    """
+    if isinstance(rows, pd.DataFrame):
+        frame = rows.reset_index(drop=True)
+        present = pd.DataFrame(True, index=frame.index, columns=frame.columns)
+    else:
+        rows = list(rows)
+        frame = pd.DataFrame(rows)
+        present = pd.DataFrame([[key in row for key in frame.columns] for row in rows],
+                               columns=frame.columns, dtype=bool)
+    columns = frame.columns.map(lambda c: COLUMN_RENAMES.get(c, c))
+    twice = columns[columns.duplicated()].unique()
+    if len(twice):
+        raise ValueError(f"Column(s) given twice: {', '.join(map(str, twice))}")
+    frame = normalize_frame(frame)
+    present.columns = frame.columns
+    return frame, present
+
+
+def _coerce(values, dtype, column):
+    """Upserted ``values`` for a column of ``dtype``; numeric columns only take numbers."""
+    if dtype.kind not in 'biuf':
+        return values.astype(object)
+    numbers = pd.to_numeric(values, errors='coerce')
+    bad = numbers.isna() & values.notna()
+    if bad.any():
+        raise ValueError(f"{column} takes numbers, got {values[bad].iloc[0]!r}")
+    return numbers
+
+
+def _merge_duplicates(incoming, present):
+    """One row per (Area, Year): later rows win on the columns they carry."""
+    values, carried = incoming.to_numpy(dtype=object), present.to_numpy()
+    rows, masks, seen = [], [], {}
+    for i, key in enumerate(zip(incoming['Area'], incoming['Year'])):
+        j = seen.setdefault(key, len(rows))
+        if j == len(rows):
+            rows.append(values[i].copy())
+            masks.append(carried[i].copy())
+        else:
+            rows[j][carried[i]] = values[i][carried[i]]
+            masks[j] |= carried[i]
+    merged = pd.DataFrame(rows, columns=incoming.columns).astype(incoming.dtypes.to_dict())
+    return merged, pd.DataFrame(masks, columns=incoming.columns)
+
+
+def _widen(column, values):
+    """(copy of ``column``, ``values``) in dtypes that let the values be written without loss.
+
+    Integer columns stay integers unless a value has a fraction; a missing
+    value makes them nullable (Int64) rather than float, so the other rows
+    keep serializing as they did.
+    """
+    if column.dtype.kind in 'biu' and values.dtype.kind == 'f':
+        missing = np.isnan(values)
+        if (values[~missing] != np.round(values[~missing])).any():
+            return column.astype(float), values
+        if missing.any():
+            return column.astype('Int64'), pd.array(values, dtype='Int64')
+        values = values.astype(getattr(column.dtype, 'numpy_dtype', column.dtype))
+    return column.copy(), values
+
+
+def _append(frame, rows):
+    """``frame`` with ``rows`` (a subset of its columns) appended, integer columns kept integers."""
+    rows = rows.reindex(columns=frame.columns)
+    for column in frame.columns:
+        if frame[column].dtype.kind in 'biu':
+            # reindex filled the columns the rows left out with NaN
+            frame[column], rows[column] = _widen(frame[column], rows[column].to_numpy(dtype=float, na_value=np.nan))
+    return pd.concat([frame, rows], ignore_index=True)
+
+
+def _upserted_version(version, incoming, present):
+    """Content id of ``version`` with ``incoming`` upserted; the same rows on the same data give the same id."""
+    rows = [
+        {column: value for column, value, carried in zip(incoming.columns, values, mask) if carried}
+        for values, mask in zip(incoming.to_numpy(dtype=object).tolist(), present.to_numpy().tolist())
+    ]
+    data = json.dumps([version, rows], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class StaleDataset(Exception):
+    """The dataset was upserted while another process had published a newer version of it."""
+
+
+_revisions = itertools.count(1)
+
+
+class Dataset:
+    """A parsed, normalized workbook plus the identity it was loaded from.
+
+    ``version`` is the content hash of the source, so two datasets with the
+    same version hold the same data; an upsert moves the dataset to a new
+    version. ``origin`` is the version it was created with. Treat ``frame``
+    as read-only: it is shared by every request served by this worker.
+    """
+
+    def __init__(self, frame, version, path=None, mtime=None, size=None):
+        self.frame = frame
+        self.version = self.origin = version
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        # a new revision for every upsert; revisions[name] is the last one that
+        # touched that area. Numbers are process-wide, so a dataset re-created
+        # from its snapshot never reuses the revisions of the one it replaced.
+        self.revision = self.base_revision = next(_revisions)
+        self.revisions = {}
+        self._area_index = None
+        self._cube = None
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+
+    @property
+    def area_index(self):
+        """Area lookup index, built on first use and kept for the dataset's lifetime.
+
+        Its name vectors are stored with the dataset's snapshot, when it has one.
+        """
+        if self._area_index is None:
+            with self._lock:
+                if self._area_index is None:
+                    self._area_index = AreaIndex(self.frame, snapshot_path(self.version))
+        return self._area_index
+
+    @property
+    def cube(self):
+        """Area x Year cube, built on first use; None without Area and Year columns.
+
+        Like the name vectors it is stored with the dataset's snapshot, and
+        memory-mapped from there by every process that opens the dataset.
+        """
+        if self._cube is None and {'Area', 'Year'} <= set(self.frame.columns):
+            index = self.area_index
+            # serialized with upserts, which keep an existing cube up to date
+            with self._update_lock:
+                if self._cube is None:
+                    self._cube = load_cube(self.frame, index, snapshot_path(self.version))
+        return self._cube
+
+    def area_revision(self, names):
+        """Revision of the data behind the cleaned area ``names``."""
+        revisions = self.revisions
+        return max((revisions.get(name, self.base_revision) for name in names), default=self.base_revision)
+
+    @property
+    def updated(self):
+        """True once rows were upserted, i.e. the frame no longer matches its origin."""
+        return self.revision != self.base_revision
+
+    def upsert(self, rows):
+        """Insert or update rows keyed by (Area, Year); returns a report dict.
+
+        ``rows`` is a DataFrame (or a list of dicts) with workbook or
+        normalized column names. A row whose Area and Year already exist
+        overwrites the columns it carries (a dict's keys, or every column of
+        a DataFrame); other rows are appended. Values must suit the column:
+        numeric columns take numbers only. The area index is extended in
+        place and only the touched areas get a new revision, so everything
+        cached for the other areas stays valid. Raises ValueError for rows
+        the frame cannot take.
+
+        The result is a new version with its own snapshot; the snapshot of
+        the old one is left as it was. A workbook's dataset publishes the
+        new version, so every worker switches to it. Raises StaleDataset
+        when another process published a newer version first: upsert into
+        the dataset ``get_dataset`` returns then.
+        """
+        incoming, present = _incoming_rows(rows)
+        if incoming.empty:
+            raise ValueError("No rows given")
+        missing = [c for c in ('Area', 'Year') if c not in incoming.columns]
+        if missing:
+            raise ValueError(f"Rows need {' and '.join(missing)}")
+        unknown = [str(c) for c in incoming.columns if c not in self.frame.columns]
+        if unknown:
+            raise ValueError(f"Unknown column(s): {', '.join(unknown)}")
+        if incoming['Year'].isna().any() or incoming['Area'].isin(['', 'nan', 'None']).any():
+            raise ValueError("Every row needs an Area and a numeric Year")
+        for column in incoming.columns.drop(['Area', 'Year']):
+            incoming[column] = _coerce(incoming[column], self.frame[column].dtype, column)
+        if incoming.duplicated(['Area', 'Year']).any():
+            incoming, present = _merge_duplicates(incoming, present)
+
+        with self._publishing(), self._update_lock:
+            # derived from the version these rows are applied to, read under the lock
+            version = _upserted_version(self.version, incoming, present)
+            frame = self.frame
+            index = self.area_index
+            clean = clean_areas(incoming['Area'])
+
+            # rows already present: look only at the rows of the same area
+            areas, years = frame['Area'].to_numpy(), frame['Year'].to_numpy()
+            targets, sources = [], []
+            for i, (area, year, name) in enumerate(zip(incoming['Area'], incoming['Year'], clean)):
+                positions = index.positions.get(name)
+                if positions is None:
+                    continue
+                hits = positions[(areas[positions] == area) & (years[positions] == year)]
+                targets.extend(hits)
+                sources.extend([i] * len(hits))
+            updated = set(sources)
+            appended = incoming.drop(index=list(updated))
+
+            if targets:
+                # copy-on-write: requests in flight keep reading the old columns
+                frame = frame.copy(deep=False)
+                targets, sources = np.asarray(targets), np.asarray(sources)
+                for column in incoming.columns.drop(['Area', 'Year']):
+                    # only the rows that carry the column overwrite it
+                    carried = present[column].to_numpy()[sources]
+                    if not carried.any():
+                        continue
+                    column_values, values = _widen(frame[column], incoming[column].to_numpy()[sources][carried])
+                    column_values.iloc[targets[carried]] = values
+                    frame[column] = column_values
+            if len(appended):
+                frame = _append(frame.copy(deep=False), appended)
+            # written before anything changes in memory, so a failed write leaves the dataset as it was
+            target = write_snapshot(frame, version)
+
+            # frame, index, cube, then revisions: a reader that sees a new
+            # revision or new positions also sees the rows they refer to
+            self.frame = frame
+            if len(appended):
+                index.append(appended['Area'])
+            touched = sorted(set(clean))
+            if self._cube is not None:
+                self._cube = self._cube.updated(frame, index, touched)
+            self.revision = next(_revisions)
+            self.revisions = {**self.revisions, **{name: self.revision for name in touched}}
+            self.version = version
+
+            if target is not None:
+                self._save_lookups(target)
+                if self.path is not None:
+                    publish(self.path, version, self.mtime, self.size, upserted=True)
+
+        report = {
+            'inserted': len(appended),
+            'updated': len(updated),
+            'areas': sorted(set(incoming['Area'])),
+            'revision': self.revision,
+        }
+        for callback in _update_listeners:
+            try:
+                callback(self, touched)
+            except Exception as e:
+                logger.warning(f"Dataset update hook {callback!r} failed: {e}")
+        return report
+
+    @contextmanager
+    def _publishing(self):
+        """Hold the locks an upsert of a workbook's dataset publishes under."""
+        if self.path is None:
+            yield
+            return
+        # the registry lock first, like get_dataset: it must not swap in the
+        # new version from CURRENT while this dataset is becoming it
+        with _lock, build_lock():
+            published = published_version(self.path, self.mtime, self.size)
+            if published not in (None, self.version):
+                raise StaleDataset(f"Dataset {self.version[:12]} was replaced by {published[:12]}")
+            yield
+
+    def _save_lookups(self, target):
+        """Store the extended name vectors and the updated cube with the snapshot ``target``."""
+        try:
+            write_vectors(self.area_index.vectors, target)
+            if self._cube is not None:
+                write_cube(self._cube, target, len(self.frame))
+        except Exception as e:
+            # other processes build them from the snapshot instead
+            logger.warning(f"Could not store lookups with snapshot {self.version[:12]}: {e}")
+
+    def __repr__(self):
+        return f"<Dataset {self.version[:12]} rows={len(self.frame)}>"
+
+
+# -----------------------------
+# Process-wide registry
+# -----------------------------
+_lock = threading.Lock()
+_datasets = {}
+_reload_listeners = []
+_update_listeners = []
+
+
+def on_reload(callback):
+    """Register ``callback(old, new)`` to run whenever a cached dataset is replaced."""
+    _reload_listeners.append(callback)
+    return callback
+
+
+def on_update(callback):
+    """Register ``callback(dataset, names)`` to run after rows of the cleaned area ``names`` changed."""
+    _update_listeners.append(callback)
+    return callback
+
+
+def _build(path, stamp, replacing=False):
+    """Hash ``path`` and publish its snapshot, unless another process just did.
+
+    Returns (version, dataset), the dataset being None when the version was
+    published by someone else. Runs under the cross-process build lock, so
+    a changed workbook is parsed once, not once per worker. ``replacing``
+    publishes the workbook's own version even over a published one.
+    """
+    with build_lock():
+        version = published_version(path, *stamp)
+        if version is not None and not replacing:
+            return version, None
+        version = file_digest(path)
+        dataset = Dataset(load_frame(path, version), version, path, *stamp)
+        # stores the area vectors and the cube in the snapshot for the others
+        dataset.cube
+        publish(path, version, *stamp)
+        return version, dataset
+
+
+def _attach(path, entry, stamp):
+    """The dataset of the version published in CURRENT ``entry``, read from its snapshot."""
+    version = entry['version']
+    if 'base' not in entry:
+        # the workbook's own version: a missing snapshot is rebuilt from it
+        return Dataset(load_frame(path, version), version, path, *stamp)
+    frame = read_snapshot(version)
+    if frame is not None:
+        return Dataset(frame, version, path, *stamp)
+    # the upserted rows exist only in that snapshot; parsing the workbook
+    # under their version would serve the data without them
+    logger.error(f"Snapshot of upserted version {version[:12]} of {path} is missing; "
+                 f"republishing the workbook without its upserts")
+    return _build(path, stamp, replacing=True)[1]
+
+
+def get_dataset(path=SAMPLE_PATH):
+    """Return the cached dataset for ``path``, reloading it if the file changed.
+
+    The file is stat'ed on every call. Which version it holds comes from
+    the published snapshot pointer when that is up to date with the file;
+    otherwise the file is hashed (and parsed, when no snapshot exists) by
+    one process, which publishes the result for all the others. A version
+    other than the cached one swaps the dataset in, without a restart.
+    """
+    path = Path(path)
+    st = path.stat()
+    stamp = (st.st_mtime_ns, st.st_size)
+    current = _datasets.get(path)
+    if current is not None and _fresh(current, path, stamp):
+        return current
+
+    with _lock:
+        current = _datasets.get(path)
+        st = path.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+        if current is not None and _fresh(current, path, stamp):
+            return current
+
+        entry = published_entry(path, *stamp)
+        dataset = None
+        if entry is None:
+            version, dataset = _build(path, stamp)
+            entry = published_entry(path, *stamp) or {'version': version}
+        if current is not None and current.version == entry['version']:
+            # touched but unchanged: keep the parsed frame
+            current.mtime, current.size = stamp
+            return current
+
+        if dataset is None:
+            # attach to the published snapshot (its numeric columns are shared with the other workers)
+            dataset = _attach(path, entry, stamp)
+        _datasets[path] = dataset
+        logger.info("Loaded dataset %s from %s (%d rows)", dataset.version[:12], path, len(dataset.frame))
+
+    if current is not None:
+        for callback in _reload_listeners:
+            try:
+                callback(current, dataset)
+            except Exception as e:
+                logger.warning(f"Dataset reload hook {callback!r} failed: {e}")
+    return dataset
+
+
+def _fresh(dataset, path, stamp):
+    """True if ``dataset`` still is what ``path`` (stat'ed as ``stamp``) holds."""
+    if (dataset.mtime, dataset.size) != stamp:
+        return False
+    version = published_version(path, *stamp)
+    return version is None or version == dataset.version
+
+
+def warm_up(path=SAMPLE_PATH):
+    """Load the dataset and its cube ahead of traffic (called from the WSGI entry point)."""
+    try:
+        dataset = get_dataset(path)
+        dataset.cube
+        return dataset
+    except Exception as e:
+        logger.warning(f"Dataset warm-up failed for {path}: {e}")
+        return None
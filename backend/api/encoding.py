@@ -0,0 +1,94 @@
+import json
+import uuid
+
+import numpy as np
+import pandas as pd
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+from . import metrics
+
+ORIENTS = ('records', 'split', 'columns')
+
+
+class JSONFrame:
+    """A DataFrame embedded in a response, encoded straight from its columns.
+
+    ``encode`` goes through pandas' C JSON writer (NaN/None become null,
+    NumPy scalars need no boxing) and caches the text per orientation, so a
+    cached payload is only serialized once. ``records`` gives the familiar
+    list-of-dicts view for code that still needs Python objects.
+    """
+
+    def __init__(self, frame):
+        self.frame = frame
+        self._encoded = {}
+        self._records = None
+
+    def encode(self, orient='records'):
+        text = self._encoded.get(orient)
+        if text is None:
+            if orient == 'split':
+                text = self.frame.to_json(orient='split', index=False, double_precision=15)
+            elif orient == 'columns':
+                # {column: [values...]}
+                text = '{' + ','.join(
+                    json.dumps(str(name)) + ':' + self.frame[name].to_json(orient='values', double_precision=15)
+                    for name in self.frame.columns
+                ) + '}'
+            else:
+                text = self.frame.to_json(orient='records', double_precision=15)
+            self._encoded[orient] = text
+        return text
+
+    def records(self):
+        if self._records is None:
+            frame = self.frame.astype(object).where(self.frame.notna(), None)
+            self._records = frame.to_dict(orient='records')
+        return self._records
+
+    def __len__(self):
+        return len(self.frame)
+
+
+class _Encoder(DjangoJSONEncoder):
+    def default(self, o):
+        if isinstance(o, np.integer):
+            return int(o)
+        if isinstance(o, np.floating):
+            return float(o)
+        if isinstance(o, np.ndarray):
+            return o.tolist()
+        if isinstance(o, pd.Timestamp):
+            return o.isoformat()
+        return super().default(o)
+
+
+def dumps(data, orient='records'):
+    """Serialize ``data`` to JSON text, splicing in pre-encoded JSONFrames."""
+    frames = {}
+    token = uuid.uuid4().hex
+
+    def default(o):
+        if isinstance(o, JSONFrame):
+            key = f'@@{token}:{len(frames)}@@'
+            frames[key] = o.encode(orient)
+            return key
+        if isinstance(o, pd.DataFrame):
+            return default(JSONFrame(o))
+        return _Encoder().default(o)
+
+    text = json.dumps(data, default=default)
+    for key, encoded in frames.items():
+        text = text.replace(f'"{key}"', encoded, 1)
+    return text
+
+
+class FrameJSONResponse(HttpResponse):
+    """JsonResponse counterpart that understands JSONFrame/DataFrame values."""
+
+    def __init__(self, data, orient='records', **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        with metrics.span('serialize'):
+            content = dumps(data, orient=orient)
+        super().__init__(content=content, **kwargs)
@@ -0,0 +1,116 @@
+"""A local stand-in for the OpenAI chat completions endpoint.
+
+Point ``OPENAI_BASE_URL`` at it (``http://127.0.0.1:<port>/v1``) to exercise
+the real HTTP client, pooling, retries and the circuit breaker without
+network access. Latency and the share of failed requests are adjustable
+while it runs.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """Answers POST /v1/chat/completions after ``latency`` seconds.
+
+    A fraction ``error_rate`` of requests fails with ``error_status`` (a 429
+    carries ``Retry-After: 0``). ``requests`` counts every call received.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.2, error_rate=0.0, error_status=503):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        """Serve from a daemon thread; returns the base URL."""
+        threading.Thread(target=self.serve_forever, daemon=True, name='fake-openai').start()
+        return self.base_url
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            payload = {}
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send(404, json.dumps({'error': {'message': 'Not found', 'type': 'invalid_request_error'}}))
+            return
+
+        server = self.server
+        server.count()
+        time.sleep(server.latency)
+
+        if server.error_rate and random.random() < server.error_rate:
+            status = server.error_status
+            headers = {'Retry-After': '0'} if status == 429 else None
+            body = {'error': {'message': f'Fake upstream error {status}', 'type': 'server_error'}}
+            self._send(status, json.dumps(body), headers=headers)
+            return
+
+        messages = payload.get('messages') or [{}]
+        prompt = str(messages[-1].get('content', ''))
+        text = f"Fake summary of a {len(prompt)}-character prompt."
+        model = payload.get('model', 'fake')
+        common = {'id': f'chatcmpl-{uuid.uuid4().hex[:12]}', 'created': int(time.time()), 'model': model}
+
+        if payload.get('stream'):
+            events = []
+            for word in text.split(' '):
+                chunk = {**common, 'object': 'chat.completion.chunk', 'choices': [
+                    {'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}
+                ]}
+                events.append(f'data: {json.dumps(chunk)}\n\n')
+            events.append('data: [DONE]\n\n')
+            self._send(200, ''.join(events), content_type='text/event-stream')
+            return
+
+        body = {
+            **common,
+            'object': 'chat.completion',
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': text},
+                'finish_reason': 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': len(prompt) // 4,
+                'completion_tokens': len(text) // 4,
+                'total_tokens': len(prompt) // 4 + len(text) // 4,
+            },
+        }
+        self._send(200, json.dumps(body))
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# -----------------------------
+# ETags and conditional GET
+# -----------------------------
+# Views derive a strong ETag from what their response depends on (dataset
+# version, area revisions, normalized query) before doing any work, so an
+# If-None-Match hit is answered with a 304 for the cost of building the tag.
+# With RESPONSE_CACHE set, whole 200 responses are also kept in Django's
+# 'responses' cache under their tag.
+
+# Part of every tag: bump it when the body of a tagged response changes
+# shape, so tags (and cached responses) of the old code stop matching.
+RESPONSE_VERSION = 1
+
+
+def etag(*parts):
+    """A quoted strong ETag for the JSON-serializable ``parts``."""
+    data = json.dumps([RESPONSE_VERSION, parts], sort_keys=True, default=str)
+    digest = hashlib.sha256(data.encode('utf-8')).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def _headers(response, tag):
+    response['ETag'] = tag
+    cache_control = getattr(settings, 'HTTP_CACHE_CONTROL', '')
+    if cache_control:
+        response['Cache-Control'] = cache_control
+    return response
+
+
+def _cache():
+    if not getattr(settings, 'RESPONSE_CACHE', ''):
+        return None
+    try:
+        return caches['responses']
+    except InvalidCacheBackendError:
+        return None
+
+
+def lookup(request, tag, cached=True):
+    """The response to send without running the view: a 304 or (with ``cached``) a cached copy."""
+    response = get_conditional_response(request, etag=tag)
+    if response is not None:
+        metrics.inc('http_not_modified_total')
+        return _headers(response, tag)
+
+    cache = _cache() if cached else None
+    if cache is None:
+        return None
+    try:
+        entry = cache.get(tag)
+    except Exception as e:
+        logger.warning(f"Response cache read failed: {e}")
+        entry = None
+    metrics.inc('response_cache_requests_total', outcome='hit' if entry else 'miss')
+    if entry is None:
+        return None
+    content_type, content = entry
+    return _headers(HttpResponse(content, content_type=content_type), tag)
+
+
+def finish(response, tag, cached=True):
+    """Tag a successful ``response`` (and with ``cached``, keep a copy of it); returns it."""
+    if tag is None or response.status_code != 200:
+        return response
+    _headers(response, tag)
+    cache = _cache() if cached else None
+    if cache is not None and not isinstance(response, StreamingHttpResponse):
+        try:
+            cache.set(tag, (response['Content-Type'], response.content),
+                      getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+        except Exception as e:
+            logger.warning(f"Response cache write failed: {e}")
+    return response
@@ -0,0 +1,216 @@
+"""Resilience helpers wrapped around the upstream LLM calls.
+
+``call_with_retries`` retries 429/5xx/connection failures with jittered
+exponential backoff inside one overall deadline, ``CircuitBreaker`` stops
+calling an upstream that keeps failing, and ``SingleFlight`` lets
+concurrent identical requests share one upstream call.
+"""
+import asyncio
+import random
+import threading
+import time
+
+from . import metrics
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream the breaker considers degraded."""
+
+
+# -----------------------------
+# Retries
+# -----------------------------
+def is_retryable(exc):
+    # imported here: the SDK is loaded with the first client, not with this module
+    import httpx
+    import openai
+
+    status = getattr(exc, 'status_code', None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(exc, (openai.APIConnectionError, httpx.TransportError, TimeoutError))
+
+
+def _retry_after(exc):
+    response = getattr(exc, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def retry_delay(exc, attempt, backoff=0.25, backoff_cap=4.0):
+    """Seconds to wait before retry number ``attempt + 1``, or None if ``exc`` is final.
+
+    Full jitter: uniform in [0, min(cap, backoff * 2**attempt)], but never
+    less than a Retry-After the server asked for.
+    """
+    if not is_retryable(exc):
+        return None
+    delay = random.uniform(0, min(backoff_cap, backoff * 2 ** attempt))
+    return max(delay, _retry_after(exc) or 0)
+
+
+def call_with_retries(fn, deadline, retries=2, backoff=0.25, backoff_cap=4.0):
+    """Call ``fn(timeout)`` until it succeeds, retrying transient failures.
+
+    ``deadline`` is a ``time.monotonic()`` instant covering every attempt;
+    each attempt gets the time that is left, and a retry whose backoff
+    would overrun the deadline is not made.
+    """
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("LLM deadline exceeded")
+        try:
+            return fn(remaining)
+        except Exception as e:
+            delay = retry_delay(e, attempt, backoff, backoff_cap)
+            if attempt >= retries or delay is None or time.monotonic() + delay >= deadline:
+                raise
+        attempt += 1
+        metrics.inc('llm_retries_total')
+        time.sleep(delay)
+
+
+async def acall_with_retries(fn, deadline, retries=2, backoff=0.25, backoff_cap=4.0):
+    """Coroutine version of call_with_retries; ``fn(timeout)`` returns an awaitable."""
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("LLM deadline exceeded")
+        try:
+            return await fn(remaining)
+        except Exception as e:
+            delay = retry_delay(e, attempt, backoff, backoff_cap)
+            if attempt >= retries or delay is None or time.monotonic() + delay >= deadline:
+                raise
+        attempt += 1
+        metrics.inc('llm_retries_total')
+        await asyncio.sleep(delay)
+
+
+# -----------------------------
+# Circuit breaker
+# -----------------------------
+class CircuitBreaker:
+    """Opens after ``failures`` consecutive failed calls.
+
+    While open every ``allow()`` is refused; after ``reset_after`` seconds a
+    single trial call is let through (half-open), and its outcome closes
+    the circuit again or re-opens it for another period.
+    """
+
+    def __init__(self, failures=5, reset_after=30.0):
+        self.failures = failures
+        self.reset_after = reset_after
+        self._count = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_after:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if not self._trial and time.monotonic() - self._opened_at >= self.reset_after:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._count = 0
+            self._opened_at = None
+            self._trial = False
+
+    def release(self):
+        """End a call that has no outcome (an abandoned stream), so a new trial can be let through."""
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._count += 1
+            self._trial = False
+            if self._opened_at is not None or (self.failures and self._count >= self.failures):
+                self._opened_at = time.monotonic()
+
+
+# -----------------------------
+# Request coalescing
+# -----------------------------
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one.
+
+    ``do``/``ado`` return (result, shared): the first caller runs the work,
+    callers arriving while it is in flight wait for and share its result
+    (or its exception). Nothing is remembered once the call finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    async def ado(self, key, factory):
+        """Async version; ``factory()`` returns the coroutine to share (one event loop only)."""
+        task = self._tasks.get(key)
+        if task is not None:
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(factory())
+        self._tasks[key] = task
+
+        def forget(done):
+            self._tasks.pop(key, None)
+            if not done.cancelled():
+                done.exception()  # retrieved even if every waiter gave up
+
+        task.add_done_callback(forget)
+        # shielded so a caller that times out does not cancel the shared call
+        return await asyncio.shield(task), False
+
+    def __len__(self):
+        return len(self._calls) + len(self._tasks)
@@ -0,0 +1,271 @@
+import json
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from api import metrics
+from api.bench import BENCH_DIR, parse_server_timing, percentiles, stub_llm, synthetic_workbook
+from api.store import upload_store
+from api.views import _payload_cache
+
+SCENARIOS = ('single', 'growth', 'compare', 'compare_many')
+
+
+def _scenario_params(dataset, name):
+    areas = list(dataset.frame['Area'].dropna().unique())
+    first, second = areas[0], areas[1 % len(areas)]
+    params = {
+        'single': {'area': first},
+        'growth': {'area': first, 'years': '3'},
+        'compare': {'compare': f'{first},{second}'},
+        'compare_many': {'compare': ','.join(areas[:8])},
+    }[name]
+    return {'dataset': dataset.version, **params}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark /api/analyze/ on synthetic workbooks (N x the sample rows) with a stub "
+        "OpenAI client; reports latency percentiles, throughput and peak memory per stage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='10,100,1000',
+                            help='Comma-separated row multipliers of Sample_data.xlsx (1 = the sample)')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=1, help='Parallel clients')
+        parser.add_argument('--llm-latency', type=float, default=200.0, help='Stub OpenAI latency in ms')
+        parser.add_argument('--memory-iterations', type=int, default=3,
+                            help='Extra requests per scenario traced with tracemalloc (0 to skip)')
+        parser.add_argument('--warm', action='store_true',
+                            help='Keep the analyze payload cache between requests (cold by default)')
+        parser.add_argument('--save', nargs='?', const=str(BENCH_DIR / 'baseline.json'),
+                            help='Write results as JSON (default path: .benchmarks/baseline.json)')
+        parser.add_argument('--compare', help='Baseline JSON to compare the results against')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='p50/p95 slowdown (percent) reported as a regression')
+
+    def handle(self, *args, **options):
+        try:
+            scales = [int(s) for s in options['scales'].split(',') if s.strip()]
+        except ValueError:
+            raise CommandError("--scales must be comma-separated integers")
+        scenarios = [s.strip() for s in options['scenarios'].split(',') if s.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        self.options = options
+        self._local = threading.local()
+        self._pool = None
+        report = {
+            'meta': {
+                'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'python': sys.version.split()[0],
+                'pandas': pd.__version__,
+                'platform': platform.platform(),
+                'iterations': options['iterations'],
+                'concurrency': options['concurrency'],
+                'llm_latency_ms': options['llm_latency'],
+                'warm': options['warm'],
+            },
+            'datasets': {},
+            'results': {},
+        }
+
+        with stub_llm(options['llm_latency'] / 1000) as stub, override_settings(SERVER_TIMING=True):
+            for scale in scales:
+                dataset = self._ingest(scale, report)
+                for name in scenarios:
+                    key = f'x{scale}/{name}'
+                    params = _scenario_params(dataset, name)
+                    result = self._run(params)
+                    if options['memory_iterations'] > 0:
+                        result['peak_kib'] = self._trace_memory(params, options['memory_iterations'])
+                    report['results'][key] = result
+                    self._print_result(key, result)
+            report['meta']['llm_calls'] = stub.calls
+        if self._pool is not None:
+            self._pool.shutdown()
+
+        if options['save']:
+            path = Path(options['save'])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(report, indent=2))
+            self.stdout.write(self.style.SUCCESS(f"Saved results to {path}"))
+
+        if options['compare']:
+            self._compare(report, Path(options['compare']))
+
+    # -----------------------------
+    # Setup
+    # -----------------------------
+    def _ingest(self, scale, report):
+        started = time.perf_counter()
+        path = synthetic_workbook(scale)
+        generated = time.perf_counter() - started
+
+        started = time.perf_counter()
+        with open(path, 'rb') as fh:
+            dataset, _ = upload_store.ingest(fh)
+        loaded = time.perf_counter() - started
+
+        report['datasets'][f'x{scale}'] = {
+            'rows': len(dataset.frame),
+            'areas': int(dataset.frame['Area'].nunique()),
+            'generate_seconds': round(generated, 3),
+            'ingest_seconds': round(loaded, 3),
+        }
+        self.stdout.write(
+            f"x{scale}: {len(dataset.frame)} rows, ingested in {loaded:.2f}s ({path.name})"
+        )
+        return dataset
+
+    # -----------------------------
+    # Timed runs
+    # -----------------------------
+    def _client(self):
+        # one test client per thread, reused across scenarios
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client()
+        return client
+
+    def _request(self, client, params):
+        if not self.options['warm']:
+            _payload_cache.clear()
+        started = time.perf_counter()
+        response = client.get('/api/analyze/', params)
+        elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise CommandError(f"analyze returned {response.status_code} for {params}: {response.content[:200]!r}")
+        return elapsed, parse_server_timing(response.get('Server-Timing'))
+
+    def _run(self, params):
+        iterations = self.options['iterations']
+        concurrency = max(1, self.options['concurrency'])
+
+        def one(_):
+            return self._request(self._client(), params)
+
+        for i in range(self.options['warmup']):
+            one(i)
+
+        started = time.perf_counter()
+        if concurrency == 1:
+            samples = [one(i) for i in range(iterations)]
+        else:
+            if self._pool is None:
+                # kept for the whole run so each thread's client is built once
+                self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench')
+            samples = list(self._pool.map(one, range(iterations)))
+        wall = time.perf_counter() - started
+
+        stages = {}
+        for _, timings in samples:
+            for stage, ms in timings.items():
+                if stage != 'total':
+                    stages.setdefault(stage, []).append(ms)
+        return {
+            'requests': iterations,
+            'latency_ms': percentiles([ms for ms, _ in samples]),
+            'throughput_rps': round(iterations / wall, 2) if wall else None,
+            'stages_ms': {stage: percentiles(values) for stage, values in stages.items()},
+        }
+
+    def _trace_memory(self, params, iterations):
+        """Peak traced allocations (KiB) per request and per stage."""
+        peaks = {}
+        high = [0]
+        original = metrics.span
+
+        @contextmanager
+        def traced(stage):
+            high[0] = max(high[0], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            try:
+                with original(stage):
+                    yield
+            finally:
+                peak = tracemalloc.get_traced_memory()[1]
+                high[0] = max(high[0], peak)
+                peaks[stage] = max(peaks.get(stage, 0), peak - base)
+
+        client = self._client()
+        metrics.span = traced
+        tracemalloc.start()
+        try:
+            for _ in range(iterations):
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                high[0] = 0
+                self._request(client, params)
+                high[0] = max(high[0], tracemalloc.get_traced_memory()[1])
+                peaks['request'] = max(peaks.get('request', 0), high[0] - base)
+        finally:
+            tracemalloc.stop()
+            metrics.span = original
+        return {stage: round(value / 1024, 1) for stage, value in peaks.items()}
+
+    # -----------------------------
+    # Reporting
+    # -----------------------------
+    def _print_result(self, key, result):
+        lat = result['latency_ms']
+        self.stdout.write(
+            f"  {key:<24} p50={lat['p50']:.1f}ms p95={lat['p95']:.1f}ms p99={lat['p99']:.1f}ms "
+            f"{result['throughput_rps']} req/s"
+        )
+        for stage, stats in result['stages_ms'].items():
+            line = f"    {stage:<10} p50={stats['p50']:.2f}ms p95={stats['p95']:.2f}ms"
+            if stage in result.get('peak_kib', {}):
+                line += f" peak={result['peak_kib'][stage]:.0f}KiB"
+            self.stdout.write(line)
+        if 'request' in result.get('peak_kib', {}):
+            self.stdout.write(f"    {'request':<10} peak={result['peak_kib']['request']:.0f}KiB")
+
+    def _compare(self, report, path):
+        try:
+            baseline = json.loads(path.read_text())
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read baseline {path}: {e}")
+
+        threshold = self.options['threshold']
+        regressions = 0
+        self.stdout.write(f"\nCompared with {path} ({baseline.get('meta', {}).get('created', '?')}):")
+        for key, result in report['results'].items():
+            old = baseline.get('results', {}).get(key)
+            if old is None:
+                self.stdout.write(f"  {key:<24} (not in baseline)")
+                continue
+            parts = []
+            worst = 0.0
+            for pct in ('p50', 'p95'):
+                before, after = old['latency_ms'].get(pct), result['latency_ms'].get(pct)
+                if not before:
+                    continue
+                change = (after - before) / before * 100
+                worst = max(worst, change)
+                parts.append(f"{pct} {before:.1f}->{after:.1f}ms ({change:+.1f}%)")
+            line = f"  {key:<24} " + ', '.join(parts)
+            if worst > threshold:
+                regressions += 1
+                self.stdout.write(self.style.WARNING(line + '  REGRESSION'))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            self.stdout.write(self.style.WARNING(f"{regressions} scenario(s) slower than the {threshold}% threshold"))
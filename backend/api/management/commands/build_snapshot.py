@@ -0,0 +1,71 @@
+import shutil
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.dataset import SAMPLE_PATH, Dataset, file_digest, read_workbook
+from api.snapshot import build_lock, publish, published_entry, read_snapshot, snapshot_path, write_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert workbooks (default: the bundled Sample_data.xlsx) into columnar snapshots "
+        "and publish them, so running workers switch to them on their next request. "
+        "A workbook whose rows were upserted through /api/rows/ is not republished "
+        "(that would drop the upserts) unless --force is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='Excel files to convert')
+        parser.add_argument('--force', action='store_true', help='Rebuild snapshots that already exist and republish over upserted versions')
+
+    def handle(self, *args, **options):
+        paths = [Path(p) for p in options['paths']] or [SAMPLE_PATH]
+        refused = []
+        for path in paths:
+            if not path.exists():
+                raise CommandError(f"No such file: {path}")
+
+            with build_lock():
+                if not self._build(path, options['force']):
+                    refused.append(path.name)
+        if refused:
+            raise CommandError(f"Not republished (upserted): {', '.join(refused)}; use --force to drop the upserts")
+
+    def _build(self, path, force):
+        """Build and publish the snapshot of ``path``; False if publishing it would drop upserts."""
+        st = path.stat()
+        digest = file_digest(path)
+        target = snapshot_path(digest)
+        if target is None:
+            raise CommandError("DATASET_SNAPSHOT_DIR is not configured")
+        frame = None if force else read_snapshot(digest)
+        if frame is not None:
+            self.stdout.write(f"{path.name}: snapshot {digest[:12]} already exists")
+        else:
+            started = time.perf_counter()
+            frame = read_workbook(path)
+            if force and target.exists():
+                shutil.rmtree(target)
+            write_snapshot(frame, digest)
+            self.stdout.write(self.style.SUCCESS(
+                f"{path.name}: wrote {len(frame)} rows to {target} in {time.perf_counter() - started:.2f}s"
+            ))
+        # builds the area name vectors and the cube and stores them in the snapshot
+        # (a no-op for a snapshot that has them)
+        Dataset(frame, digest).cube
+
+        entry = published_entry(path, st.st_mtime_ns, st.st_size)
+        if entry is not None and entry['version'] != digest:
+            # the workbook is unchanged but rows were upserted into it since
+            if not force:
+                self.stderr.write(self.style.WARNING(
+                    f"{path.name}: CURRENT points at upserted version {entry['version'][:12]}; not republishing"
+                ))
+                return False
+            self.stderr.write(self.style.WARNING(
+                f"{path.name}: dropping upserted version {entry['version'][:12]} from CURRENT"
+            ))
+        publish(path, digest, st.st_mtime_ns, st.st_size)
+        return True
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from api.fake_openai import FakeOpenAIServer
+
+
+class Command(BaseCommand):
+    help = "Run a local fake of the OpenAI chat completions API (set OPENAI_BASE_URL to its URL)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=200.0, help='Response latency in ms')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail (0-1)')
+        parser.add_argument('--error-status', type=int, default=503, help='HTTP status of failed requests')
+
+    def handle(self, *args, **options):
+        server = FakeOpenAIServer(
+            (options['host'], options['port']),
+            latency=options['latency'] / 1000,
+            error_rate=options['error_rate'],
+            error_status=options['error_status'],
+        )
+        self.stdout.write(f"Fake OpenAI API on {server.base_url} (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served {server.requests} requests")
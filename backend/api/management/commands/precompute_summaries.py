@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.dataset import get_dataset
+from api.precompute import GROWTH_YEARS, precompute
+from api.store import upload_store
+
+
+class Command(BaseCommand):
+    help = "Precompute analysis and growth summaries for every area into the summary cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', help='ID of an uploaded dataset (default: the bundled sample)')
+        parser.add_argument('--concurrency', type=int, default=getattr(settings, 'PRECOMPUTE_CONCURRENCY', 4))
+        parser.add_argument('--rate', type=float, default=getattr(settings, 'PRECOMPUTE_RATE', 2.0),
+                            help='Max upstream requests per second (0 = unlimited)')
+        parser.add_argument('--years', default=','.join(str(n) for n in GROWTH_YEARS),
+                            help='Comma-separated growth windows to precompute')
+
+    def handle(self, *args, **options):
+        if options['dataset']:
+            dataset = upload_store.get(options['dataset'])
+            if dataset is None:
+                raise CommandError(f"Unknown dataset {options['dataset']}")
+        else:
+            dataset = get_dataset()
+
+        try:
+            years = [int(y) for y in options['years'].split(',') if y.strip()]
+        except ValueError:
+            raise CommandError("--years must be comma-separated integers")
+
+        def progress(done, total, report):
+            if done % 10 == 0 or done == total:
+                self.stdout.write(
+                    f"[{done}/{total}] new={report['computed']} cached={report['cached']} "
+                    f"failed={report['failed']}"
+                )
+
+        try:
+            report = precompute(dataset, concurrency=options['concurrency'], rate=options['rate'],
+                                growth_years=years, progress=progress)
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['areas']} areas, {report['jobs']} summaries: {report['computed']} computed, "
+            f"{report['cached']} already cached, {report['failed']} failed in {report['seconds']:.1f}s "
+            f"({report['per_second']} summaries/s)"
+        ))
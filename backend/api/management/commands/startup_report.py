@@ -0,0 +1,222 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.bench import BENCH_DIR
+
+# Modules whose import cost matters for a cold start
+HEAVY = ('pandas', 'numpy', 'openai', 'httpx', 'pydantic', 'openpyxl')
+
+# Runs in a fresh interpreter: imports the WSGI entry point (which warms up
+# the sample dataset) and sends the first requests straight to the WSGI
+# callable, then prints its timings as JSON.
+_CHILD = r'''
+import json, os, sys, time
+spawned = time.time()
+started = time.perf_counter()
+heavy, paths, stub = json.loads(sys.argv[1])
+
+def elapsed():
+    return round((time.perf_counter() - started) * 1000, 1)
+
+def loaded():
+    return [m for m in heavy if m in sys.modules]
+
+report = {'started_ms': spawned * 1000}
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+import django
+django.setup()
+report['django_setup_ms'] = elapsed()
+report['loaded_at_setup'] = loaded()
+from backend.wsgi import application
+report['wsgi_import_ms'] = elapsed()
+report['loaded_at_import'] = loaded()
+
+if stub:
+    from api.bench import stub_llm
+    stub_llm(0).__enter__()
+
+from wsgiref.util import setup_testing_defaults
+report['responses'] = []
+for path in paths:
+    path, _, query = path.partition('?')
+    environ = {'PATH_INFO': path, 'QUERY_STRING': query, 'HTTP_HOST': 'localhost'}
+    setup_testing_defaults(environ)
+    status = []
+    before = elapsed()
+    body = application(environ, lambda s, headers, exc_info=None: status.append(s))
+    b''.join(body)
+    getattr(body, 'close', lambda: None)()
+    report['responses'].append({'path': path + ('?' + query if query else ''), 'status': status[0],
+                                'ms': round(elapsed() - before, 1), 'done_ms': elapsed()})
+report['loaded_at_first_response'] = loaded()
+print(json.dumps(report))
+'''
+
+
+def parse_importtime(text):
+    """{top-level package: self time in microseconds} from ``python -X importtime`` output."""
+    totals = {}
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        try:
+            self_us, _, name = line[len('import time:'):].split('|')
+            self_us = int(self_us)
+        except ValueError:
+            continue  # the header line
+        package = name.strip().split('.')[0]
+        totals[package] = totals.get(package, 0) + self_us
+    return totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Report cold-start cost: an import-time breakdown per package and the time to the first "
+        "responses of a fresh process started from the WSGI entry point."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paths', default='/api/health/,/api/analyze/?area=Wakad',
+                            help='Comma-separated request paths sent in order by the fresh process')
+        parser.add_argument('--repeat', type=int, default=3, help='Fresh processes timed (medians are reported)')
+        parser.add_argument('--top', type=int, default=15, help='Packages listed in the import breakdown')
+        parser.add_argument('--cold', action='store_true',
+                            help='Start without dataset snapshots, so the workbook parse is included')
+        parser.add_argument('--llm', action='store_true',
+                            help='Use the configured OpenAI client (a zero-latency stub by default)')
+        parser.add_argument('--save', nargs='?', const=str(BENCH_DIR / 'startup.json'),
+                            help='Write the report as JSON (default path: .benchmarks/startup.json)')
+        parser.add_argument('--compare', help='Baseline JSON to compare the report against')
+        parser.add_argument('--threshold', type=float, default=20.0,
+                            help='Slowdown (percent) reported as a regression')
+
+    def handle(self, *args, **options):
+        paths = [p.strip() for p in options['paths'].split(',') if p.strip()]
+        if not paths:
+            raise CommandError("--paths must name at least one path")
+        self.options = options
+
+        argv = json.dumps([HEAVY, paths, not options['llm']])
+        imports = parse_importtime(self._spawn(['-X', 'importtime'], argv)[1])
+        runs = [self._spawn([], argv)[0] for _ in range(max(1, options['repeat']))]
+
+        report = {
+            'meta': {
+                'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'python': sys.version.split()[0],
+                'repeat': len(runs),
+                'cold': options['cold'],
+            },
+            'timings_ms': self._medians(runs, paths),
+            'loaded': {stage: runs[-1][f'loaded_at_{stage}'] for stage in ('setup', 'import', 'first_response')},
+            'imports_ms': {
+                package: round(us / 1000, 1)
+                for package, us in sorted(imports.items(), key=lambda item: -item[1])
+            },
+        }
+        self._print(report)
+
+        if options['save']:
+            path = Path(options['save'])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(report, indent=2))
+            self.stdout.write(self.style.SUCCESS(f"Saved report to {path}"))
+
+        if options['compare']:
+            self._compare(report, Path(options['compare']))
+
+    # -----------------------------
+    # Runs
+    # -----------------------------
+    def _spawn(self, flags, argv):
+        """Run the child script once; returns (its report, its stderr)."""
+        with tempfile.TemporaryDirectory(prefix='startup-') as scratch:
+            env = dict(os.environ)
+            if self.options['cold']:
+                # every run starts without snapshots, not just the first
+                env['DATASET_SNAPSHOT_DIR'] = scratch
+            spawned = time.time()
+            proc = subprocess.run(
+                [sys.executable, *flags, '-c', _CHILD, argv],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=300,
+            )
+        if proc.returncode != 0:
+            raise CommandError(f"Startup run failed:\n{proc.stderr[-2000:]}")
+        try:
+            report = json.loads(proc.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            raise CommandError(f"Unexpected output from the startup run: {proc.stdout[-500:]!r}")
+        report['interpreter_ms'] = round(report.pop('started_ms') - spawned * 1000, 1)
+        return report, proc.stderr
+
+    def _medians(self, runs, paths):
+        def median(values):
+            return round(statistics.median(values), 1)
+
+        timings = {
+            'interpreter': median([r['interpreter_ms'] for r in runs]),
+            'django_setup': median([r['django_setup_ms'] for r in runs]),
+            'wsgi_import': median([r['wsgi_import_ms'] for r in runs]),
+        }
+        for i, path in enumerate(paths):
+            timings[f'first {path}'] = median([r['responses'][i]['ms'] for r in runs])
+        # from spawning the process to the end of its first response
+        timings['time_to_first_response'] = median(
+            [r['interpreter_ms'] + r['responses'][0]['done_ms'] for r in runs]
+        )
+        statuses = {r['responses'][i]['status'] for r in runs for i in range(len(paths))}
+        bad = sorted(s for s in statuses if not s.startswith('2'))
+        if bad:
+            self.stdout.write(self.style.WARNING(f"Non-2xx responses during startup: {', '.join(bad)}"))
+        return timings
+
+    # -----------------------------
+    # Reporting
+    # -----------------------------
+    def _print(self, report):
+        self.stdout.write(f"Startup (median of {report['meta']['repeat']} fresh processes):")
+        for name, ms in report['timings_ms'].items():
+            self.stdout.write(f"  {name:<40} {ms:>8.1f}ms")
+        for stage, modules in report['loaded'].items():
+            self.stdout.write(f"  heavy modules loaded by {stage:<15} {', '.join(modules) or '-'}")
+        self.stdout.write(f"Import time by package (self time, top {self.options['top']}):")
+        for package, ms in list(report['imports_ms'].items())[:self.options['top']]:
+            self.stdout.write(f"  {package:<40} {ms:>8.1f}ms")
+
+    def _compare(self, report, path):
+        try:
+            baseline = json.loads(path.read_text())
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read baseline {path}: {e}")
+
+        threshold = self.options['threshold']
+        regressions = 0
+        self.stdout.write(f"\nCompared with {path} ({baseline.get('meta', {}).get('created', '?')}):")
+        for name, after in report['timings_ms'].items():
+            before = baseline.get('timings_ms', {}).get(name)
+            if not before:
+                self.stdout.write(f"  {name:<40} (not in baseline)")
+                continue
+            change = (after - before) / before * 100
+            line = f"  {name:<40} {before:.1f}->{after:.1f}ms ({change:+.1f}%)"
+            if change > threshold:
+                regressions += 1
+                self.stdout.write(self.style.WARNING(line + '  REGRESSION'))
+            else:
+                self.stdout.write(line)
+        new = set(report['loaded']['import']) - set(baseline.get('loaded', {}).get('import', []))
+        if new:
+            regressions += 1
+            self.stdout.write(self.style.WARNING(f"  now loaded at import: {', '.join(sorted(new))}  REGRESSION"))
+        if regressions:
+            self.stdout.write(self.style.WARNING(f"{regressions} regression(s) beyond the {threshold}% threshold"))
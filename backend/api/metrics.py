@@ -0,0 +1,161 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, shared by every histogram
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_help = {}
+_collectors = []
+
+# Spans recorded for the current request, for the Server-Timing header
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+
+# -----------------------------
+# Recording
+# -----------------------------
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def describe(name, text):
+    _help[name] = text
+
+
+def inc(name, value=1, **labels):
+    """Add ``value`` to a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record ``value`` (seconds) in a histogram."""
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                hist[0][i] += 1
+        hist[1] += value
+        hist[2] += 1
+
+
+@contextmanager
+def span(stage):
+    """Time a stage of the analyze pipeline.
+
+    The duration goes into the ``analyze_stage_seconds`` histogram and, while
+    a request is being timed, into that request's Server-Timing breakdown.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe('analyze_stage_seconds', elapsed, stage=stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def start_request():
+    """Begin collecting spans for the current request; returns the reset token."""
+    return _request_spans.set([])
+
+
+def finish_request(token):
+    """Stop collecting and return the recorded (stage, seconds) spans."""
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    return spans
+
+
+def server_timing(spans, total=None):
+    """Format spans as a Server-Timing header value, one entry per stage."""
+    totals = {}
+    for stage, elapsed in spans:
+        dur, count = totals.get(stage, (0.0, 0))
+        totals[stage] = (dur + elapsed, count + 1)
+    parts = []
+    for stage, (dur, count) in totals.items():
+        entry = f'{stage};dur={dur * 1000:.1f}'
+        if count > 1:
+            entry += f';desc="x{count}"'
+        parts.append(entry)
+    if total is not None:
+        parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def register_collector(fn):
+    """Register ``fn() -> [(name, type, {labels}, value)]`` to be sampled at scrape time."""
+    _collectors.append(fn)
+    return fn
+
+
+# -----------------------------
+# Prometheus text exposition
+# -----------------------------
+def _labels(pairs):
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return '{' + body + '}'
+
+
+def render():
+    """All metrics of this worker in Prometheus text format (0.0.4)."""
+    lines = []
+    typed = set()
+
+    def header(name, kind):
+        if name in typed:
+            return
+        typed.add(name)
+        if name in _help:
+            lines.append(f'# HELP {name} {_help[name]}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, ([*v[0]], v[1], v[2])) for k, v in _histograms.items())
+
+    for (name, labels), value in counters:
+        header(name, 'counter')
+        lines.append(f'{name}{_labels(labels)} {value}')
+
+    for (name, labels), (buckets, total, count) in histograms:
+        header(name, 'histogram')
+        for bound, n in zip(BUCKETS, buckets):
+            lines.append(f'{name}_bucket{_labels(labels + (("le", repr(bound)),))} {n}')
+        lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {count}')
+        lines.append(f'{name}_sum{_labels(labels)} {total}')
+        lines.append(f'{name}_count{_labels(labels)} {count}')
+
+    for collector in _collectors:
+        try:
+            samples = collector()
+        except Exception:
+            continue
+        for name, kind, labels, value in samples:
+            header(name, kind)
+            lines.append(f'{name}{_labels(tuple(sorted(labels.items())))} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+describe('analyze_stage_seconds', 'Time spent per analyze pipeline stage.')
+describe('api_request_seconds', 'Request latency per API view.')
+describe('llm_tokens_total', 'OpenAI tokens used, by kind.')
+describe('llm_requests_total', 'Summary requests by outcome.')
+describe('llm_retries_total', 'Upstream LLM calls retried after a transient error.')
+describe('http_not_modified_total', 'Conditional GETs answered with 304 Not Modified.')
+describe('response_cache_requests_total', 'Response cache lookups, by outcome.')
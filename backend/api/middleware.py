@@ -0,0 +1,52 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+
+class MetricsMiddleware:
+    """Times every request and, with SERVER_TIMING on, adds a Server-Timing header.
+
+    Stage spans recorded while the view runs (see ``metrics.span``) make up
+    the header's breakdown; streamed bodies are timed up to the first byte.
+    Works in both the WSGI and the ASGI handler.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            spans = metrics.finish_request(token)
+        return self._finish(request, response, spans, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            spans = metrics.finish_request(token)
+        return self._finish(request, response, spans, time.perf_counter() - started)
+
+    def _finish(self, request, response, spans, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        metrics.observe('api_request_seconds', elapsed, view=getattr(match, 'url_name', None) or 'unmatched')
+
+        if getattr(settings, 'SERVER_TIMING', False):
+            response['Server-Timing'] = metrics.server_timing(spans, total=elapsed)
+            response['Timing-Allow-Origin'] = '*'
+        return response
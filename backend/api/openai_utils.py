@@ -1,18 +1,136 @@
-import json
+import asyncio
+import contextvars
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from openai import OpenAI
+
+from . import metrics
+from .llm_gateway import CircuitBreaker, SingleFlight, acall_with_retries, call_with_retries
+from .prompts import compact_stats, estimate_tokens, fit_to_budget
+from .summary_cache import summary_cache
 
 logger = logging.getLogger(__name__)
 
+MODEL = getattr(settings, "OPENAI_MODEL", "gpt-4o-mini")
+BASE_URL = getattr(settings, "OPENAI_BASE_URL", None)  # e.g. a local fake server
+TIMEOUT = getattr(settings, "LLM_TIMEOUT", 20)  # deadline per summary, retries included
+PROMPT_TOKEN_BUDGET = getattr(settings, "LLM_PROMPT_TOKEN_BUDGET", 1500)
+
+RETRY = {
+    "retries": getattr(settings, "LLM_MAX_RETRIES", 2),
+    "backoff": getattr(settings, "LLM_RETRY_BACKOFF", 0.25),
+    "backoff_cap": getattr(settings, "LLM_RETRY_BACKOFF_MAX", 4.0),
+}
+
+
+def _http_limits(connections):
+    import httpx
+    return httpx.Limits(
+        max_connections=connections,
+        max_keepalive_connections=connections,
+        keepalive_expiry=getattr(settings, "LLM_KEEPALIVE_EXPIRY", 30.0),
+    )
+
+
+def _http_timeout():
+    import httpx
+    return httpx.Timeout(TIMEOUT, connect=getattr(settings, "LLM_CONNECT_TIMEOUT", 5.0))
+
+
 # -----------------------------
 # Initialize OpenAI Client
 # -----------------------------
-try:
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
-except Exception:
-    client = None
-    logger.warning("Failed to initialize OpenAI client. Check OPENAI_API_KEY.")
+# Both clients are created on first use. The openai SDK (with httpx and
+# pydantic) is most of this module's import time, and a cold worker should
+# not pay for it before it needs a summary. Retries are ours (see
+# llm_gateway), so the SDK's own are turned off.
+client = None
+_init_failed = False
+_init_lock = threading.Lock()
+
+
+def get_client():
+    """The shared OpenAI client, or None when it cannot be created (e.g. no OPENAI_API_KEY)."""
+    global client, _init_failed
+    if client is None and not _init_failed:
+        with _init_lock:
+            if client is None and not _init_failed:
+                try:
+                    if not settings.OPENAI_API_KEY:
+                        raise ValueError("OPENAI_API_KEY is not set")
+                    from openai import DefaultHttpxClient, OpenAI
+                    client = OpenAI(
+                        api_key=settings.OPENAI_API_KEY,
+                        base_url=BASE_URL,
+                        max_retries=0,
+                        timeout=_http_timeout(),
+                        http_client=DefaultHttpxClient(
+                            limits=_http_limits(getattr(settings, "LLM_POOL_CONNECTIONS", 20))
+                        ),
+                    )
+                except Exception:
+                    _init_failed = True
+                    logger.warning("Failed to initialize OpenAI client. Check OPENAI_API_KEY.")
+    return client
+
+
+def prewarm(background=True):
+    """Create the OpenAI client ahead of the first summary, in a daemon thread by default."""
+    if not background:
+        return get_client()
+    threading.Thread(target=get_client, daemon=True, name='openai-prewarm').start()
+    return None
+
+# Upstream health and in-flight prompts, shared by the sync and async paths
+breaker = CircuitBreaker(
+    failures=getattr(settings, "LLM_BREAKER_FAILURES", 5),
+    reset_after=getattr(settings, "LLM_BREAKER_RESET", 30.0),
+)
+_flights = SingleFlight()
+
+# Shared pool bounding how many summaries this worker requests at once
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "LLM_MAX_CONCURRENCY", 4),
+    thread_name_prefix="llm-summary",
+)
+
+# Async client for the ASGI views, created on first use inside the event loop
+ASYNC_MAX_CONCURRENCY = getattr(settings, "LLM_ASYNC_MAX_CONCURRENCY", 256)
+aclient = None
+_async_init_failed = False
+_async_slots = None
+
+
+def _async_client():
+    """The shared AsyncOpenAI client; one keep-alive connection pool per process."""
+    global aclient, _async_init_failed
+    if aclient is None and not _async_init_failed:
+        try:
+            if not settings.OPENAI_API_KEY:
+                raise ValueError("OPENAI_API_KEY is not set")
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+            aclient = AsyncOpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                base_url=BASE_URL,
+                max_retries=0,
+                timeout=_http_timeout(),
+                http_client=DefaultAsyncHttpxClient(limits=_http_limits(ASYNC_MAX_CONCURRENCY)),
+            )
+        except Exception:
+            _async_init_failed = True
+            logger.warning("Failed to initialize async OpenAI client. Check OPENAI_API_KEY.")
+    return aclient
+
+
+def _slots():
+    global _async_slots
+    if _async_slots is None:
+        _async_slots = asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+    return _async_slots
 
 
 # -----------------------------
@@ -21,8 +139,10 @@ except Exception:
 def _build_prompt(area, stats, mode="analysis"):
     """
     Build a clean, concise prompt for OpenAI summarization.
-    The model will return 4–5 clear sentences.
+    The stats are compacted to a per-year summary that fits the
+    LLM_PROMPT_TOKEN_BUDGET. The model will return 4–5 clear sentences.
     """
+    data, _ = fit_to_budget(compact_stats(stats), PROMPT_TOKEN_BUDGET)
     return f"""
 You are a real-estate expert. Based on the data below, write a clear,
 concise 4–5 sentence summary for home buyers and investors.
@@ -38,46 +158,379 @@ Mode: {mode}
 Area: {area}
 
 Data:
-{json.dumps(stats, indent=2)}
+{data}
 """
 
 
+def summary_key(area, stats, mode="analysis"):
+    """The summary cache key llm_summary uses for these arguments."""
+    return summary_cache.key(MODEL, mode, _build_prompt(area, stats, mode=mode))
+
+
+def _completion_args(prompt, timeout=None):
+    return dict(
+        model=MODEL,
+        messages=[
+            {"role": "system", "content": "You are a helpful real-estate analysis expert."},
+            {"role": "user", "content": prompt},
+        ],
+        max_tokens=200,
+        temperature=0.5,
+        timeout=timeout or TIMEOUT,
+    )
+
+
 # -----------------------------
 # Main LLM Summary Function
 # -----------------------------
-def llm_summary(area, stats, mode="analysis"):
+def llm_summary(area, stats, mode="analysis", client=None, timeout=None):
     """
     Call OpenAI to produce a short summary.
-    Returns fallback summary if the API fails.
+    Identical prompts are answered from the summary cache, and concurrent
+    identical prompts share one upstream call; pass ``client`` to use a
+    stand-in for the shared OpenAI client.
+    Returns fallback summary if the API fails or the circuit is open.
     """
     prompt = _build_prompt(area, stats, mode=mode)
+    llm = client if client is not None else get_client()
+
+    key = summary_cache.key(MODEL, mode, prompt)
+    cached = summary_cache.get(key)
+    if cached is not None:
+        metrics.inc('llm_requests_total', outcome='cache_hit')
+        return cached
 
     # If client failed to initialize
-    if client is None:
+    if llm is None:
         logger.warning("OpenAI client not available — using fallback summary.")
+        metrics.inc('llm_requests_total', outcome='fallback')
         return _fallback_summary(area, stats)
 
+    if not breaker.allow():
+        metrics.inc('llm_requests_total', outcome='circuit_open')
+        return _fallback_summary(area, stats)
+
+    prompt_tokens = estimate_tokens(prompt)
+    started = time.perf_counter()
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful real-estate analysis expert."},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=200,
-            temperature=0.5,
+        summary, shared = _flights.do(key, lambda: _complete(llm, key, prompt, mode, timeout))
+        metrics.inc('llm_requests_total', outcome='coalesced' if shared else 'ok')
+        logger.info(
+            "llm_summary area=%s mode=%s prompt_chars=%d prompt_tokens~%d latency=%.3fs",
+            area, mode, len(prompt), prompt_tokens, time.perf_counter() - started,
         )
+        return summary
+
+    except Exception as e:
+        logger.warning(
+            f"OpenAI request failed for area={area} (prompt_tokens~{prompt_tokens}, "
+            f"after {time.perf_counter() - started:.3f}s): {e}"
+        )
+        metrics.inc('llm_requests_total', outcome='error')
+        return _fallback_summary(area, stats)
+
+
+def _complete(llm, key, prompt, mode, timeout=None):
+    """One upstream request (with retries) whose outcome is reported to the breaker."""
+    deadline = time.monotonic() + (timeout or TIMEOUT)
+    try:
+        with metrics.span('llm'):
+            response = call_with_retries(
+                lambda remaining: llm.chat.completions.create(**_completion_args(prompt, remaining)),
+                deadline, **RETRY,
+            )
+    except Exception:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+
+    summary = response.choices[0].message.content.strip()
+    summary_cache.set(key, summary, model=MODEL, mode=mode)
+    _record_usage(response)
+    return summary
+
+
+def _record_usage(response):
+    usage = getattr(response, "usage", None)
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if isinstance(value, int):
+            metrics.inc("llm_tokens_total", value, kind=kind.split("_")[0])
+
+
+def llm_summary_stream(area, stats, mode="analysis", client=None, timeout=None):
+    """
+    Generator version of llm_summary that yields the summary text in pieces
+    as OpenAI streams it. Cached prompts and the fallback path yield a
+    single chunk. The assembled text is stored in the summary cache.
+    """
+    prompt = _build_prompt(area, stats, mode=mode)
+    llm = client if client is not None else get_client()
+
+    key = summary_cache.key(MODEL, mode, prompt)
+    cached = summary_cache.get(key)
+    if cached is not None:
+        metrics.inc('llm_requests_total', outcome='cache_hit')
+        yield cached
+        return
+
+    if llm is None:
+        logger.warning("OpenAI client not available — using fallback summary.")
+        metrics.inc('llm_requests_total', outcome='fallback')
+        yield _fallback_summary(area, stats)
+        return
+
+    if not breaker.allow():
+        metrics.inc('llm_requests_total', outcome='circuit_open')
+        yield _fallback_summary(area, stats)
+        return
+
+    parts = []
+    started = time.perf_counter()
+    try:
+        # only opening the stream is retried; a stream that broke mid-way is not
+        stream = call_with_retries(
+            lambda remaining: llm.chat.completions.create(**_completion_args(prompt, remaining), stream=True),
+            time.monotonic() + (timeout or TIMEOUT), **RETRY,
+        )
+        for chunk in stream:
+            delta = _delta(chunk, first=not parts)
+            if delta:
+                parts.append(delta)
+                yield delta
+
+    except GeneratorExit:
+        # closed mid-stream: nothing to report, but a half-open trial must not stay taken
+        breaker.release()
+        raise
+    except Exception as e:
+        logger.warning(f"OpenAI stream failed for area={area}: {e}")
+        breaker.record_failure()
+        metrics.inc('llm_requests_total', outcome='error')
+        if not parts:
+            yield _fallback_summary(area, stats)
+        return
 
-        return response.choices[0].message.content.strip()
+    breaker.record_success()
+    summary = "".join(parts).strip()
+    if summary:
+        summary_cache.set(key, summary, model=MODEL, mode=mode)
+    metrics.observe('analyze_stage_seconds', time.perf_counter() - started, stage='llm')
+    metrics.inc('llm_requests_total', outcome='ok')
+    logger.info(
+        "llm_summary_stream area=%s mode=%s prompt_chars=%d latency=%.3fs",
+        area, mode, len(prompt), time.perf_counter() - started,
+    )
+
+
+def _delta(chunk, first=False):
+    if not chunk.choices:
+        return None
+    delta = chunk.choices[0].delta.content
+    # leading whitespace is dropped, like the .strip() in llm_summary
+    if delta and first:
+        delta = delta.lstrip()
+    return delta
+
+
+def llm_summaries(jobs, client=None, timeout=None):
+    """
+    Run several llm_summary calls concurrently on the shared pool.
+    ``jobs`` is a list of (area, stats, mode) tuples; summaries come back in
+    the same order. ``timeout`` bounds the whole batch: calls that error or
+    have not finished by then fall back to _fallback_summary on their own
+    without affecting the others.
+    """
+    timeout = timeout or TIMEOUT
+    # each job runs in a copy of the caller's context so its spans reach the request
+    futures = [
+        _executor.submit(contextvars.copy_context().run, llm_summary, area, stats, mode, client, timeout)
+        for area, stats, mode in jobs
+    ]
+    wait(futures, timeout=timeout)
+
+    summaries = []
+    for (area, stats, mode), future in zip(jobs, futures):
+        try:
+            if not future.done():
+                future.cancel()
+                raise TimeoutError(f"not done after {timeout}s")
+            summaries.append(future.result())
+        except Exception as e:
+            logger.warning(f"Summary for area={area} did not finish: {e!r}")
+            summaries.append(_fallback_summary(area, stats))
+    return summaries
+
+
+# -----------------------------
+# Async variants (ASGI views)
+# -----------------------------
+_cache_get = sync_to_async(summary_cache.get, thread_sensitive=False)
+_cache_set = sync_to_async(summary_cache.set, thread_sensitive=False)
+_abuild_prompt = sync_to_async(_build_prompt, thread_sensitive=False)
+
+
+async def allm_summary(area, stats, mode="analysis", client=None, timeout=None):
+    """
+    Coroutine version of llm_summary for the ASGI views.
+    The request awaits the shared AsyncOpenAI client instead of holding a
+    thread, so one process can keep hundreds of summaries in flight
+    (bounded by LLM_ASYNC_MAX_CONCURRENCY). Prompt building and the SQLite
+    cache run in the default thread pool.
+    """
+    prompt = await _abuild_prompt(area, stats, mode=mode)
+    llm = client if client is not None else _async_client()
+
+    key = summary_cache.key(MODEL, mode, prompt)
+    cached = await _cache_get(key)
+    if cached is not None:
+        metrics.inc('llm_requests_total', outcome='cache_hit')
+        return cached
+
+    if llm is None:
+        logger.warning("OpenAI client not available — using fallback summary.")
+        metrics.inc('llm_requests_total', outcome='fallback')
+        return _fallback_summary(area, stats)
+
+    if not breaker.allow():
+        metrics.inc('llm_requests_total', outcome='circuit_open')
+        return _fallback_summary(area, stats)
+
+    prompt_tokens = estimate_tokens(prompt)
+    started = time.perf_counter()
+    try:
+        summary, shared = await _flights.ado(key, lambda: _acomplete(llm, key, prompt, mode, timeout))
+        metrics.inc('llm_requests_total', outcome='coalesced' if shared else 'ok')
+        logger.info(
+            "allm_summary area=%s mode=%s prompt_chars=%d prompt_tokens~%d latency=%.3fs",
+            area, mode, len(prompt), prompt_tokens, time.perf_counter() - started,
+        )
+        return summary
 
     except Exception as e:
-        logger.warning(f"OpenAI request failed for area={area}: {e}")
+        logger.warning(
+            f"OpenAI request failed for area={area} (prompt_tokens~{prompt_tokens}, "
+            f"after {time.perf_counter() - started:.3f}s): {e}"
+        )
+        metrics.inc('llm_requests_total', outcome='error')
         return _fallback_summary(area, stats)
 
 
+async def _acomplete(llm, key, prompt, mode, timeout=None):
+    """Async version of _complete; each attempt holds one of the in-flight slots."""
+    async def attempt(remaining):
+        async with _slots():
+            return await llm.chat.completions.create(**_completion_args(prompt, remaining))
+
+    try:
+        with metrics.span('llm'):
+            response = await acall_with_retries(attempt, time.monotonic() + (timeout or TIMEOUT), **RETRY)
+    except Exception:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+
+    summary = response.choices[0].message.content.strip()
+    await _cache_set(key, summary, model=MODEL, mode=mode)
+    _record_usage(response)
+    return summary
+
+
+async def allm_summary_stream(area, stats, mode="analysis", client=None, timeout=None):
+    """Async generator version of llm_summary_stream."""
+    prompt = await _abuild_prompt(area, stats, mode=mode)
+    llm = client if client is not None else _async_client()
+
+    key = summary_cache.key(MODEL, mode, prompt)
+    cached = await _cache_get(key)
+    if cached is not None:
+        metrics.inc('llm_requests_total', outcome='cache_hit')
+        yield cached
+        return
+
+    if llm is None:
+        logger.warning("OpenAI client not available — using fallback summary.")
+        metrics.inc('llm_requests_total', outcome='fallback')
+        yield _fallback_summary(area, stats)
+        return
+
+    if not breaker.allow():
+        metrics.inc('llm_requests_total', outcome='circuit_open')
+        yield _fallback_summary(area, stats)
+        return
+
+    parts = []
+    started = time.perf_counter()
+    try:
+        async with _slots():
+            stream = await acall_with_retries(
+                lambda remaining: llm.chat.completions.create(**_completion_args(prompt, remaining), stream=True),
+                time.monotonic() + (timeout or TIMEOUT), **RETRY,
+            )
+            async for chunk in stream:
+                delta = _delta(chunk, first=not parts)
+                if delta:
+                    parts.append(delta)
+                    yield delta
+
+    except (GeneratorExit, asyncio.CancelledError):
+        # closed or cancelled mid-stream: nothing to report, but a half-open
+        # trial must not stay taken
+        breaker.release()
+        raise
+    except Exception as e:
+        logger.warning(f"OpenAI stream failed for area={area}: {e}")
+        breaker.record_failure()
+        metrics.inc('llm_requests_total', outcome='error')
+        if not parts:
+            yield _fallback_summary(area, stats)
+        return
+
+    breaker.record_success()
+    summary = "".join(parts).strip()
+    if summary:
+        await _cache_set(key, summary, model=MODEL, mode=mode)
+    metrics.observe('analyze_stage_seconds', time.perf_counter() - started, stage='llm')
+    metrics.inc('llm_requests_total', outcome='ok')
+
+
+async def allm_summaries(jobs, client=None, timeout=None):
+    """
+    Await several allm_summary calls at once; same contract as llm_summaries.
+    A call that overruns ``timeout`` falls back on its own.
+    """
+    timeout = timeout or TIMEOUT
+
+    async def one(area, stats, mode):
+        try:
+            return await asyncio.wait_for(allm_summary(area, stats, mode, client, timeout), timeout)
+        except Exception as e:
+            logger.warning(f"Summary for area={area} did not finish: {e!r}")
+            return _fallback_summary(area, stats)
+
+    return list(await asyncio.gather(*(one(area, stats, mode) for area, stats, mode in jobs)))
+
+
+@metrics.register_collector
+def _gateway_metrics():
+    return [
+        ('llm_circuit_open', 'gauge', {}, int(breaker.state != 'closed')),
+        ('llm_inflight_coalesced_keys', 'gauge', {}, len(_flights)),
+    ]
+
+
 # -----------------------------
 # Fallback Summary (Safe)
 # -----------------------------
+class FallbackSummary(str):
+    """Summary text built from the stats because the LLM was unavailable."""
+
+
+def is_fallback(summary):
+    """True for a summary that did not come from the LLM (or the summary cache)."""
+    return isinstance(summary, FallbackSummary)
+
+
 def _fallback_summary(area, stats):
     """
     Generate a simple deterministic summary if OpenAI fails.
@@ -121,6 +574,9 @@ def _fallback_summary(area, stats):
             # look for common containers
             for key in ("price_history", "chart", "price_growth_chart", "full_table", "table"):
                 val = stats.get(key)
+                if hasattr(val, "records"):
+                    # JSONFrame tables from the views
+                    val = val.records()
                 if isinstance(val, list):
                     for rec in val:
                         collect_from_record(rec)
@@ -129,9 +585,11 @@ def _fallback_summary(area, stats):
             if not prices:
                 # try to extract charts from nested structures
                 for v in stats.values():
-                    if isinstance(v, dict) and 'chart' in v and isinstance(v['chart'], list):
-                        for rec in v['chart']:
-                            collect_from_record(rec)
+                    # area_a/area_b dicts, or the 'areas' list of an N-area compare
+                    for side in (v if isinstance(v, list) else [v]):
+                        if isinstance(side, dict) and 'chart' in side and isinstance(side['chart'], list):
+                            for rec in side['chart']:
+                                collect_from_record(rec)
 
         # Build summary sentences
         sentences = []
@@ -181,7 +639,7 @@ def _fallback_summary(area, stats):
             if len(yrs) >= 1:
                 sentences.append(f"Data covers years {yrs[0]}–{yrs[-1]}.")
 
-        return ' '.join(sentences)
+        return FallbackSummary(' '.join(sentences))
 
     except Exception:
-        return f"Summary unavailable for {area} due to a temporary issue."
+        return FallbackSummary(f"Summary unavailable for {area} due to a temporary issue.")
@@ -0,0 +1,188 @@
+"""Precomputation of area summaries into the summary cache.
+
+``precompute`` walks every Area of a dataset and asks for the same
+analysis and growth summaries the views would, so interactive requests
+find them cached. It runs from ``manage.py precompute_summaries`` and,
+with PRECOMPUTE_SUMMARIES on, in a background thread after the dataset
+is loaded or reloaded.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+
+from . import openai_utils
+from .dataset import on_reload, on_update
+from .snapshot import snapshot_root
+from .summary_cache import summary_cache
+from .views import area_payload, summary_job
+
+logger = logging.getLogger(__name__)
+
+GROWTH_YEARS = getattr(settings, 'PRECOMPUTE_GROWTH_YEARS', (3, 5))
+
+# One background run at a time per process
+_background = threading.Lock()
+
+
+class RateLimiter:
+    """Spaces calls at least ``1 / rate`` seconds apart across threads; rate <= 0 is unlimited."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def summary_specs(dataset, growth_years=GROWTH_YEARS, areas=None):
+    """(area, mode, years) for every Area (or just ``areas``): one analysis plus one growth per window."""
+    modes = [('analysis', None)] + [('growth', str(n)) for n in growth_years]
+    if areas is None:
+        areas = dataset.frame['Area'].dropna().astype(str).unique()
+    areas = sorted(areas)
+    return [(area, mode, years) for area in areas for mode, years in modes]
+
+
+def precompute(dataset, concurrency=4, rate=0, growth_years=GROWTH_YEARS, progress=None, client=None,
+               areas=None):
+    """Fill the summary cache for every area of ``dataset`` (or ``areas``); returns a report dict.
+
+    Summaries already cached are skipped. Upstream calls are spread over
+    ``concurrency`` threads and limited to ``rate`` per second. Once the
+    circuit breaker opens the remaining jobs are given up rather than
+    pushed at a degraded upstream. ``progress(done, total, report)`` is
+    called after every job.
+    """
+    if client is None and openai_utils.get_client() is None:
+        raise RuntimeError("OpenAI client not available; check OPENAI_API_KEY")
+    if not summary_cache.path:
+        raise RuntimeError("Summary cache is disabled (SUMMARY_CACHE_PATH)")
+
+    specs = summary_specs(dataset, growth_years, areas)
+    limiter = RateLimiter(rate)
+    report = {'areas': len({area for area, _, _ in specs}), 'jobs': len(specs),
+              'computed': 0, 'cached': 0, 'failed': 0, 'skipped': 0}
+
+    def run(spec):
+        area, mode, years = spec
+        payload = area_payload(dataset, area, mode, years, cached=False)
+        if payload is None:
+            return 'skipped'
+        label, stats, mode = summary_job(area, payload, mode, years)
+        key = openai_utils.summary_key(label, stats, mode)
+        if key in summary_cache:
+            return 'cached'
+        if openai_utils.breaker.state == 'open':
+            return 'failed'
+        limiter.wait()
+        openai_utils.llm_summary(label, stats, mode, client=client)
+        # a fallback summary is not cached, so this tells success from failure
+        return 'computed' if key in summary_cache else 'failed'
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='precompute') as pool:
+        futures = [pool.submit(run, spec) for spec in specs]
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                outcome = future.result()
+            except Exception as e:
+                logger.warning(f"Precomputing a summary failed: {e}")
+                outcome = 'failed'
+            report[outcome] += 1
+            if progress is not None:
+                progress(done, len(specs), report)
+
+    elapsed = time.perf_counter() - started
+    report['seconds'] = round(elapsed, 3)
+    report['per_second'] = round(report['computed'] / elapsed, 2) if elapsed else None
+    return report
+
+
+# -----------------------------
+# Background runs
+# -----------------------------
+def schedule(dataset, areas=None):
+    """Precompute ``dataset`` (or only ``areas``) in a daemon thread when PRECOMPUTE_SUMMARIES is on.
+
+    Returns the thread, or None when nothing was started.
+    """
+    if dataset is None or not getattr(settings, 'PRECOMPUTE_SUMMARIES', False):
+        return None
+    if openai_utils.get_client() is None or not summary_cache.path:
+        logger.warning("Summary precompute skipped: no OpenAI client or summary cache.")
+        return None
+    thread = threading.Thread(target=_run, args=(dataset, areas), daemon=True, name='precompute-summaries')
+    thread.start()
+    return thread
+
+
+def _log_progress(done, total, report):
+    if done % 50 == 0 or done == total:
+        logger.info("Precomputed %d/%d summaries (%d new, %d cached, %d failed)",
+                    done, total, report['computed'], report['cached'], report['failed'])
+
+
+def _run(dataset, areas=None):
+    with _background:
+        try:
+            report = precompute(
+                dataset,
+                concurrency=getattr(settings, 'PRECOMPUTE_CONCURRENCY', 4),
+                rate=getattr(settings, 'PRECOMPUTE_RATE', 2.0),
+                progress=_log_progress,
+                areas=areas,
+            )
+        except Exception as e:
+            logger.warning(f"Summary precompute for dataset {dataset.version[:12]} failed: {e}")
+            return
+    logger.info("Summary precompute for dataset %s done: %s", dataset.version[:12], report)
+
+
+def _claim(dataset):
+    """True in the one process that precomputes ``dataset``'s version.
+
+    Every worker reloads a newly published version; the first to create
+    its marker under the snapshot root runs the precompute. Without a
+    snapshot root each process is on its own and always claims it.
+    """
+    root = snapshot_root()
+    if root is None:
+        return True
+    markers = root / '.precompute'
+    try:
+        markers.mkdir(parents=True, exist_ok=True)
+        os.close(os.open(markers / dataset.version, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    except OSError as e:
+        logger.warning(f"Could not claim the summary precompute for {dataset.version[:12]}: {e}")
+    return True
+
+
+@on_reload
+def _precompute_reloaded(old, new):
+    if getattr(settings, 'PRECOMPUTE_SUMMARIES', False) and _claim(new):
+        schedule(new)
+
+
+@on_update
+def _precompute_updated(dataset, names):
+    if getattr(settings, 'PRECOMPUTE_SUMMARIES', False):
+        # the workers that reload this version leave it to this one
+        _claim(dataset)
+    # the summaries of untouched areas are still cached under unchanged stats
+    index = dataset.area_index
+    schedule(dataset, [index.labels[index.ids[name]] for name in names if name in index.ids])
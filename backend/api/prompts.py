@@ -0,0 +1,225 @@
+"""Compaction of the stats handed to the LLM.
+
+The views pass whole charts and raw tables; the model only needs the
+per-year trend. ``compact_stats`` reduces each series to one small record
+per year plus min/max/change aggregates, and ``fit_to_budget`` trims the
+oldest years (then aggregates) until the serialized data fits the token
+budget.
+"""
+import json
+import math
+
+try:  # optional: exact token counts when tiktoken is installed
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+
+def estimate_tokens(text):
+    """Token count of ``text``; roughly 4 characters per token without tiktoken."""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def _num(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) or math.isinf(value) else value
+
+
+def _round(value, digits=1):
+    return None if value is None else round(value, digits)
+
+
+def _pct(new, old):
+    if new is None or old is None or not old:
+        return None
+    return round((new - old) / abs(old) * 100, 1)
+
+
+def _year(record):
+    value = record.get('Year', record.get('year'))
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _extremes(points, field):
+    values = [(p[field], p['year']) for p in points if p.get(field) is not None]
+    if not values:
+        return None
+    lo = min(values)
+    hi = max(values)
+    first, last = values[0][0], values[-1][0]
+    return {
+        'min': _round(lo[0]), 'min_year': lo[1],
+        'max': _round(hi[0]), 'max_year': hi[1],
+        'change_pct': _pct(last, first),
+    }
+
+
+def summarize_series(records):
+    """One record per year (mean price/demand, YoY %) plus overall aggregates."""
+    by_year = {}
+    for r in records or []:
+        if not isinstance(r, dict):
+            continue
+        y = _year(r)
+        if y is None:
+            continue
+        bucket = by_year.setdefault(y, {'price': [], 'demand': []})
+        for field in ('price', 'demand'):
+            v = _num(r.get(field))
+            if v is not None:
+                bucket[field].append(v)
+
+    points = []
+    prev = None
+    for y in sorted(by_year):
+        point = {'year': y}
+        for field in ('price', 'demand'):
+            vals = by_year[y][field]
+            point[field] = sum(vals) / len(vals) if vals else None
+        if prev is not None:
+            point['price_yoy_pct'] = _pct(point['price'], prev['price'])
+        prev = point
+        points.append(point)
+
+    summary = {'per_year': [
+        {k: (_round(v) if isinstance(v, float) else v) for k, v in p.items() if v is not None}
+        for p in points
+    ]}
+    for field in ('price', 'demand'):
+        extremes = _extremes(points, field)
+        if extremes:
+            summary[field] = extremes
+    return summary
+
+
+def compact_stats(stats):
+    """Reduce the stats dict built by the views to a compact per-year summary."""
+    if not isinstance(stats, dict):
+        return stats
+
+    if 'area_a' in stats or 'area_b' in stats:
+        out = {}
+        for key in ('area_a', 'area_b'):
+            side = stats.get(key) or {}
+            out[key] = {'name': side.get('name'), **summarize_series(side.get('chart'))}
+        out['difference'] = summarize_series(stats.get('difference_chart'))
+        return out
+
+    if isinstance(stats.get('areas'), list):
+        out = {'areas': [
+            {'name': side.get('name'), **summarize_series(side.get('chart'))}
+            for side in stats['areas'] if isinstance(side, dict)
+        ]}
+        out['difference_vs_first'] = summarize_series(stats.get('difference_chart'))
+        return out
+
+    chart = stats.get('price_history') or stats.get('price_growth_chart') or stats.get('chart')
+    table = stats.get('full_table') or stats.get('table')
+    if chart is None and table is None:
+        return stats
+
+    if hasattr(table, 'frame'):
+        # JSONFrame: read the columns instead of materializing records
+        frame = table.frame
+        out = summarize_series(chart if chart is not None else table.records())
+        if 'Area' in frame.columns:
+            out['areas'] = sorted(frame['Area'].dropna().astype(str).unique())
+        out['rows'] = len(frame)
+        if stats.get('years'):
+            out['years_requested'] = stats['years']
+        return out
+
+    out = summarize_series(chart if chart is not None else table)
+    if isinstance(table, list):
+        areas = sorted({str(r.get('Area')) for r in table if isinstance(r, dict) and r.get('Area') is not None})
+        if areas:
+            out['areas'] = areas
+        out['rows'] = len(table)
+    if stats.get('years'):
+        out['years_requested'] = stats['years']
+    return out
+
+
+def _per_year_lists(data):
+    lists = []
+    if isinstance(data, dict):
+        if isinstance(data.get('per_year'), list):
+            lists.append(data['per_year'])
+        for value in data.values():
+            if isinstance(value, dict):
+                lists.extend(_per_year_lists(value))
+            elif isinstance(value, list):
+                for item in value:
+                    lists.extend(_per_year_lists(item))
+    return lists
+
+
+# Years kept per series before any aggregate is dropped
+MIN_YEARS = 3
+# Aggregates given up, in this order, when dropping years is not enough
+DROP_ORDER = ('areas', 'rows', 'years_requested', 'demand', 'difference', 'difference_vs_first', 'price')
+
+
+def _drop_key(data, key):
+    """Remove aggregate ``key`` from every summary in ``data``.
+
+    Per-year records and lists of records (the compared areas) are kept.
+    """
+    dropped = False
+    if isinstance(data, dict):
+        value = data.get(key)
+        if key in data and not (isinstance(value, list) and any(isinstance(v, dict) for v in value)):
+            del data[key]
+            dropped = True
+        values = [v for k, v in data.items() if k != 'per_year']
+    elif isinstance(data, list):
+        values = data
+    else:
+        return False
+    for value in list(values):
+        dropped = _drop_key(value, key) or dropped
+    return dropped
+
+
+def fit_to_budget(data, budget):
+    """Serialize ``data`` compactly, dropping the oldest years until it fits.
+
+    Down to MIN_YEARS per series; then aggregates are dropped (see
+    DROP_ORDER), then the remaining years. Returns (text, tokens). The text
+    is always valid JSON, but can still exceed the budget once nothing is
+    left to drop.
+    """
+    def dump():
+        text = json.dumps(data, separators=(',', ':'), default=str)
+        return text, estimate_tokens(text)
+
+    text, tokens = dump()
+    if not budget or tokens <= budget:
+        return text, tokens
+
+    def trim_years(keep):
+        nonlocal text, tokens
+        lists = _per_year_lists(data)
+        while tokens > budget and any(len(per_year) > keep for per_year in lists):
+            for per_year in lists:
+                if len(per_year) > keep:
+                    per_year.pop(0)
+            text, tokens = dump()
+
+    trim_years(MIN_YEARS)
+    for key in DROP_ORDER:
+        if tokens <= budget:
+            break
+        if _drop_key(data, key):
+            text, tokens = dump()
+    trim_years(0)
+    return text, tokens
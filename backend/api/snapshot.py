@@ -0,0 +1,252 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds are only serialized within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+# -----------------------------
+# Columnar snapshots
+# -----------------------------
+# A snapshot is a directory named after the workbook's content hash holding
+# one .npy file per column of the normalized frame plus meta.json. Numeric
+# columns are memory-mapped on load and shared through the page cache by
+# every process that opens the snapshot; nullable integer columns (left by
+# upserted rows without a value) add a null mask. String columns are stored as
+# fixed-width text and turned into object arrays on load, a private copy
+# per process (pandas string operations need Python objects). Either way
+# re-opening a workbook costs a few file reads instead of an openpyxl parse.
+# Snapshots, and the area vectors and cube stored inside them, are written
+# with ``publish_dir``, so readers never see a half-written directory.
+
+def snapshot_root():
+    root = getattr(settings, 'DATASET_SNAPSHOT_DIR', None)
+    return Path(root) if root else None
+
+
+def snapshot_path(digest, root=None):
+    root = Path(root) if root else snapshot_root()
+    return root / digest if root else None
+
+
+def _encode_column(column):
+    """Return (kind, array, null_mask) for one column."""
+    if isinstance(column.array, pd.arrays.IntegerArray):
+        # nullable integers: the numbers (0 where missing) plus the null mask
+        return 'nullable', column.to_numpy(dtype=column.dtype.numpy_dtype, na_value=0), column.isna().to_numpy()
+    values = column.to_numpy()
+    if values.dtype.kind in 'biufcmM':
+        return 'numeric', values, None
+    nulls = pd.isna(values)
+    present = values[~nulls]
+    if all(isinstance(v, str) for v in present):
+        filled = np.where(nulls, '', values).astype(str)
+        return 'string', filled, nulls
+    # mixed types: keep the objects as they are (not memory-mappable)
+    return 'object', values.astype(object), None
+
+
+def publish_dir(target, write):
+    """Create directory ``target`` by calling ``write(tmp)`` to fill a temporary one; returns ``target``.
+
+    The temporary directory is renamed into place, so readers see either
+    no ``target`` or a complete one. Published directories are never
+    replaced: when another process got there first, its copy is kept.
+    """
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=f'.{target.name[:12]}-', dir=target.parent))
+    try:
+        write(tmp)
+        try:
+            os.replace(tmp, target)
+        except OSError:
+            # already published (renaming onto a non-empty directory fails)
+            shutil.rmtree(tmp, ignore_errors=True)
+        return target
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def write_snapshot(frame, digest, root=None):
+    """Write ``frame`` as the snapshot for ``digest``; returns its directory."""
+    target = snapshot_path(digest, root)
+    if target is None:
+        return None
+
+    def write(tmp):
+        columns = []
+        for i, name in enumerate(frame.columns):
+            kind, values, nulls = _encode_column(frame[name])
+            np.save(tmp / f'{i}.npy', values, allow_pickle=(kind == 'object'))
+            if nulls is not None:
+                np.save(tmp / f'{i}.null.npy', nulls)
+            columns.append({'name': str(name), 'kind': kind, 'dtype': str(frame[name].dtype)})
+        meta = {'format': FORMAT_VERSION, 'digest': digest, 'rows': len(frame), 'columns': columns}
+        (tmp / 'meta.json').write_text(json.dumps(meta))
+
+    return publish_dir(target, write)
+
+
+def read_snapshot(digest, root=None):
+    """Open the snapshot for ``digest`` as a DataFrame, or return None if absent."""
+    path = snapshot_path(digest, root)
+    if path is None or not (path / 'meta.json').exists():
+        return None
+    try:
+        meta = json.loads((path / 'meta.json').read_text())
+        if meta.get('format') != FORMAT_VERSION:
+            return None
+        data = {}
+        for i, col in enumerate(meta['columns']):
+            if col['kind'] == 'object':
+                values = np.load(path / f'{i}.npy', allow_pickle=True)
+            else:
+                # plain ndarray view over the mapping: no copy, no memmap subclass
+                values = np.asarray(np.load(path / f'{i}.npy', mmap_mode='r'))
+            if col['kind'] == 'string':
+                nulls = np.load(path / f'{i}.null.npy')
+                # copied into this process: only numeric columns stay mapped
+                values = values.astype(object)
+                values[nulls] = np.nan
+            elif col['kind'] == 'nullable':
+                values = pd.arrays.IntegerArray(values, np.load(path / f'{i}.null.npy'))
+            data[col['name']] = values
+        return pd.DataFrame(data, copy=False)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable snapshot {path}: {e}")
+        return None
+
+
+# -----------------------------
+# Published versions
+# -----------------------------
+# CURRENT, under the snapshot root, maps each workbook path to the snapshot
+# built from it, along with the workbook's mtime and size at that time. It is
+# rewritten under a temporary name and renamed into place, so a swap to a
+# new version is atomic. Worker processes read it instead of hashing and
+# parsing the workbook themselves: the first process to see a changed
+# workbook builds its snapshot under ``build_lock`` and publishes it, and
+# the others attach to that snapshot. Snapshots are never modified once
+# published, so workers still serving the previous version are unaffected.
+# Every upsert writes a full snapshot of its version, so the upserted
+# versions a workbook no longer points at are deleted a few publishes later
+# (see ``publish``); the workbook's own snapshot is kept.
+
+CURRENT = 'CURRENT'
+
+_current = (None, {})
+_build_lock = threading.Lock()
+
+
+def read_current(root=None):
+    """The published {workbook path: {'version', 'mtime', 'size'[, 'base', 'superseded']}} map.
+
+    Re-read only when the CURRENT file changed, so checking it costs a stat.
+    """
+    global _current
+    root = Path(root) if root else snapshot_root()
+    if root is None:
+        return {}
+    try:
+        st = (root / CURRENT).stat()
+    except OSError:
+        return {}
+    stamp = (str(root), st.st_ino, st.st_mtime_ns, st.st_size)
+    cached_stamp, published = _current
+    if stamp != cached_stamp:
+        try:
+            published = json.loads((root / CURRENT).read_text())
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable {root / CURRENT}: {e}")
+            published = {}
+        _current = (stamp, published)
+    return published
+
+
+def published_entry(source, mtime, size, root=None):
+    """The CURRENT entry of workbook ``source`` as of (``mtime``, ``size``), or None."""
+    entry = read_current(root).get(str(Path(source).resolve()))
+    if entry and (entry.get('mtime'), entry.get('size')) == (mtime, size):
+        return entry
+    return None
+
+
+def published_version(source, mtime, size, root=None):
+    """The snapshot published for workbook ``source`` as of (``mtime``, ``size``), or None."""
+    entry = published_entry(source, mtime, size, root)
+    return entry.get('version') if entry else None
+
+
+def publish(source, digest, mtime, size, root=None, upserted=False):
+    """Point workbook ``source`` at snapshot ``digest``; call under ``build_lock``.
+
+    ``upserted`` marks ``digest`` as an upsert of the version published now;
+    the entry then keeps the workbook's own digest as ``base``. Upserted
+    versions that stop being published are listed as ``superseded`` for the
+    next DATASET_SNAPSHOT_KEEP publishes (workers may still be switching
+    away from them) and then deleted.
+    """
+    root = Path(root) if root else snapshot_root()
+    if root is None:
+        return
+    published = dict(read_current(root))
+    key = str(Path(source).resolve())
+    previous = published.get(key) or {}
+    entry = {'version': digest, 'mtime': mtime, 'size': size}
+    if upserted and (previous.get('mtime'), previous.get('size')) == (mtime, size):
+        entry['base'] = previous.get('base', previous['version'])
+    superseded = previous.get('superseded', []) + ([previous['version']] if 'base' in previous else [])
+    superseded = [version for version in superseded if version not in (digest, entry.get('base'))]
+    split = max(len(superseded) - getattr(settings, 'DATASET_SNAPSHOT_KEEP', 2), 0)
+    dropped, superseded = superseded[:split], superseded[split:]
+    if superseded:
+        entry['superseded'] = superseded
+    published[key] = entry
+
+    root.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f'.{CURRENT}-', dir=root)
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(published, fh)
+        os.replace(tmp, root / CURRENT)
+    except Exception:
+        os.unlink(tmp)
+        raise
+    for version in dropped:
+        # columns already mapped by a worker stay readable after the unlink
+        shutil.rmtree(root / version, ignore_errors=True)
+
+
+@contextmanager
+def build_lock(root=None):
+    """Serialize snapshot builds and publishes across threads and processes."""
+    root = Path(root) if root else snapshot_root()
+    with _build_lock:
+        if root is None or fcntl is None:
+            yield
+            return
+        root.mkdir(parents=True, exist_ok=True)
+        with open(root / '.build.lock', 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
@@ -0,0 +1,160 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .dataset import Dataset, load_frame
+from .snapshot import read_current, read_snapshot, snapshot_path, snapshot_root, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+_DATASET_ID = re.compile(r'^[0-9a-f]{64}$')
+
+
+def is_dataset_id(value):
+    return bool(value) and bool(_DATASET_ID.match(value))
+
+
+def frame_bytes(frame):
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+def _dir_bytes(path):
+    return sum(entry.stat().st_size for entry in path.rglob('*') if entry.is_file())
+
+
+class DatasetStore:
+    """Uploaded datasets addressed by the sha256 of the workbook bytes.
+
+    Parsed datasets (with their area index) stay in memory until the store
+    exceeds ``max_bytes``; the least recently used ones are then dropped
+    from memory and only kept as on-disk snapshots, from which ``get``
+    reloads them on the next request.
+
+    The snapshots themselves are bounded by ``max_disk_bytes``: past it the
+    least recently used ones that are not in this worker's memory are
+    deleted, and their ids have to be uploaded again.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_disk_bytes=2 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._datasets = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def ingest(self, uploaded_file):
+        """Parse and register an upload; returns (dataset, created).
+
+        Uploading bytes the store already knows is a no-op.
+        """
+        data = uploaded_file.read()
+        digest = hashlib.sha256(data).hexdigest()
+        dataset = self.get(digest)
+        if dataset is not None:
+            return dataset, False
+        dataset = Dataset(load_frame(io.BytesIO(data), digest), digest)
+        self._put(dataset)
+        self._trim_disk()
+        return dataset, True
+
+    def get(self, dataset_id):
+        """Return the dataset for ``dataset_id`` from memory or its spilled snapshot."""
+        if not is_dataset_id(dataset_id):
+            return None
+        with self._lock:
+            dataset = self._datasets.get(dataset_id)
+            if dataset is not None:
+                self._datasets.move_to_end(dataset_id)
+                return dataset
+        frame = read_snapshot(dataset_id)
+        if frame is None:
+            return None
+        try:
+            # recently used: trimmed last
+            os.utime(snapshot_path(dataset_id))
+        except OSError:
+            pass
+        dataset = Dataset(frame, dataset_id)
+        self._put(dataset)
+        return dataset
+
+    def moved(self, old_id, dataset):
+        """Re-register ``dataset`` after an upsert gave it a new id.
+
+        ``old_id`` keeps addressing the data as it was, reloaded from its
+        snapshot when next requested.
+        """
+        with self._lock:
+            if self._datasets.get(old_id) is dataset:
+                del self._datasets[old_id]
+                self._sizes.pop(old_id, None)
+        self._put(dataset)
+        self._trim_disk()
+
+    def _put(self, dataset):
+        size = frame_bytes(dataset.frame)
+        with self._lock:
+            self._datasets[dataset.version] = dataset
+            self._sizes[dataset.version] = size
+            self._datasets.move_to_end(dataset.version)
+            while len(self._datasets) > 1 and sum(self._sizes.values()) > self.max_bytes:
+                version, evicted = self._datasets.popitem(last=False)
+                self._sizes.pop(version, None)
+                self._spill(evicted)
+
+    def _spill(self, dataset):
+        path = snapshot_path(dataset.version)
+        if path is None:
+            logger.warning(f"Dropping dataset {dataset.version[:12]}: no DATASET_SNAPSHOT_DIR to spill to")
+            return
+        if not (path / 'meta.json').exists():
+            try:
+                write_snapshot(dataset.frame, dataset.version)
+            except Exception as e:
+                logger.warning(f"Could not spill dataset {dataset.version[:12]}: {e}")
+
+    def _trim_disk(self):
+        """Delete the least recently used upload snapshots while they exceed ``max_disk_bytes``.
+
+        Snapshots are shared by every worker, so all of them count, but only
+        those this worker does not hold in memory are deleted. Published
+        workbook versions (everything in CURRENT) are not uploads and are left alone.
+        """
+        root = snapshot_root()
+        if root is None or not root.is_dir():
+            return
+        published = set()
+        for entry in read_current(root).values():
+            published.update([entry.get('version'), entry.get('base'), *entry.get('superseded', ())])
+        snapshots = []
+        for path in root.iterdir():
+            if is_dataset_id(path.name) and path.name not in published:
+                try:
+                    snapshots.append((path.stat().st_mtime, path, _dir_bytes(path)))
+                except OSError:
+                    continue  # deleted meanwhile
+        total = sum(size for _, _, size in snapshots)
+        for _, path, size in sorted(snapshots):
+            if total <= self.max_disk_bytes:
+                break
+            if path.name in self._datasets:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logger.info("Deleted upload snapshot %s (%d bytes) to stay under the disk limit", path.name[:12], size)
+
+    def __contains__(self, dataset_id):
+        return dataset_id in self._datasets
+
+
+upload_store = DatasetStore(
+    max_bytes=getattr(settings, 'DATASET_STORE_MAX_BYTES', 256 * 1024 * 1024),
+    max_disk_bytes=getattr(settings, 'DATASET_STORE_MAX_DISK_BYTES', 2 * 1024 ** 3),
+)
@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Expired and surplus entries are swept every EVICT_EVERY writes, or on the
+# next write once the table holds more than max_entries
+EVICT_EVERY = 100
+
+
+class SummaryCache:
+    """Content-addressed store for LLM summaries in a local SQLite file.
+
+    Entries are keyed on a hash of (model, mode, prompt), expire after
+    ``ttl`` seconds and are evicted least-recently-used once more than
+    ``max_entries`` are stored. Storage errors are logged and treated as
+    misses so a broken cache never fails a request.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=5000):
+        self.path = str(path) if path else None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        # rows as of the last sweep plus writes since (other processes write too)
+        self._entries = None
+        self._writes = 0
+        self._local = threading.local()
+        self._schema_ready = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model, mode, prompt):
+        h = hashlib.sha256()
+        for part in (model, mode, prompt):
+            h.update(str(part).encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        if not self._schema_ready:
+            with self._lock:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS summaries ("
+                    " key TEXT PRIMARY KEY, model TEXT, mode TEXT, summary TEXT,"
+                    " created_at REAL, accessed_at REAL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS summaries_accessed ON summaries (accessed_at)")
+                conn.execute("CREATE INDEX IF NOT EXISTS summaries_created ON summaries (created_at)")
+                self._schema_ready = True
+        return conn
+
+    def get(self, key):
+        """Return the cached summary for ``key`` or None."""
+        if not self.path:
+            return None
+        try:
+            conn = self._connect()
+            row = conn.execute("SELECT summary, created_at FROM summaries WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            conn.execute("UPDATE summaries SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Summary cache read failed: {e}")
+            self.misses += 1
+            return None
+
+    def __contains__(self, key):
+        """Whether ``key`` has a live entry; unlike get() it counts no hit or miss."""
+        if not self.path:
+            return False
+        try:
+            row = self._connect().execute("SELECT created_at FROM summaries WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Summary cache read failed: {e}")
+            return False
+        return row is not None and not (self.ttl and time.time() - row[0] > self.ttl)
+
+    def set(self, key, summary, model='', mode=''):
+        if not self.path:
+            return
+        try:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, model, mode, summary, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, mode, summary, now, now),
+            )
+            self.stores += 1
+            self._writes += 1
+            if self._entries is not None:
+                self._entries += 1
+            if self._entries is None or self._writes >= EVICT_EVERY or \
+                    (self.max_entries and self._entries > self.max_entries):
+                self._evict(conn, now)
+        except sqlite3.Error as e:
+            logger.warning(f"Summary cache write failed: {e}")
+
+    def _evict(self, conn, now):
+        removed = 0
+        if self.ttl:
+            removed += conn.execute("DELETE FROM summaries WHERE created_at < ?", (now - self.ttl,)).rowcount
+        entries = conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        if self.max_entries and entries > self.max_entries:
+            dropped = conn.execute(
+                "DELETE FROM summaries WHERE key IN ("
+                " SELECT key FROM summaries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+            removed += dropped
+            entries -= dropped
+        self.evictions += max(removed, 0)
+        self._entries, self._writes = entries, 0
+
+    def clear(self):
+        if not self.path:
+            return
+        try:
+            self._connect().execute("DELETE FROM summaries")
+            self._entries = 0
+        except sqlite3.Error as e:
+            logger.warning(f"Summary cache clear failed: {e}")
+
+    def stats(self):
+        entries = 0
+        if self.path:
+            try:
+                entries = self._connect().execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+            except sqlite3.Error:
+                pass
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'entries': entries,
+        }
+
+
+summary_cache = SummaryCache(
+    getattr(settings, 'SUMMARY_CACHE_PATH', None),
+    ttl=getattr(settings, 'SUMMARY_CACHE_TTL', 7 * 24 * 3600),
+    max_entries=getattr(settings, 'SUMMARY_CACHE_MAX_ENTRIES', 5000),
+)
+
+
+@metrics.register_collector
+def _summary_cache_metrics():
+    counters = {
+        'hits': summary_cache.hits,
+        'misses': summary_cache.misses,
+        'stores': summary_cache.stores,
+        'evictions': summary_cache.evictions,
+    }
+    return [(f'summary_cache_{name}_total', 'counter', {}, value) for name, value in counters.items()]
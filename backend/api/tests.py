@@ -0,0 +1,520 @@
+import asyncio
+import difflib
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
+
+import openai
+import pandas as pd
+from django.core.management import CommandError, call_command
+from django.test import Client, SimpleTestCase, override_settings
+
+from . import openai_utils
+from .dataset import Dataset, SAMPLE_PATH, StaleDataset, get_dataset
+from .fake_openai import FakeOpenAIServer
+from .llm_gateway import CircuitBreaker
+from .prompts import compact_stats, fit_to_budget
+from .snapshot import publish, published_version, read_current, read_snapshot, snapshot_path, write_snapshot
+from .store import DatasetStore
+from .summary_cache import SummaryCache
+
+
+class UpsertTests(SimpleTestCase):
+    def setUp(self):
+        sample = get_dataset(SAMPLE_PATH)
+        # upserts write snapshots: keep them out of the real snapshot directory
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings = override_settings(DATASET_SNAPSHOT_DIR=root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.dataset = Dataset(sample.frame.copy(), sample.version)
+
+    def value(self, area, year, column):
+        frame = self.dataset.frame
+        return frame.loc[(frame['Area'] == area) & (frame['Year'] == year), column].iloc[0]
+
+    def test_rows_only_write_the_columns_they_carry(self):
+        demand = self.value('Aundh', 2023, 'Demand')
+        rate = self.value('Wakad', 2023, 'flat - weighted average rate')
+        report = self.dataset.upsert([
+            {'Area': 'Aundh', 'Year': 2023, 'flat - weighted average rate': 1.0},
+            {'Area': 'Wakad', 'Year': 2023, 'Demand': 5},
+        ])
+        self.assertEqual(report['updated'], 2)
+        self.assertEqual(self.value('Aundh', 2023, 'Demand'), demand)
+        self.assertEqual(self.value('Aundh', 2023, 'flat - weighted average rate'), 1.0)
+        self.assertEqual(self.value('Wakad', 2023, 'flat - weighted average rate'), rate)
+        self.assertEqual(self.value('Wakad', 2023, 'Demand'), 5)
+
+    def test_repeated_rows_merge_the_columns_they_carry(self):
+        self.dataset.upsert([
+            {'Area': 'Aundh', 'Year': 2023, 'Demand': 1},
+            {'Area': 'Aundh', 'Year': 2023, 'flat - weighted average rate': 2.0},
+        ])
+        self.assertEqual(self.value('Aundh', 2023, 'Demand'), 1)
+        self.assertEqual(self.value('Aundh', 2023, 'flat - weighted average rate'), 2.0)
+
+    def test_numeric_columns_reject_text(self):
+        dtype = self.dataset.frame['Demand'].dtype
+        with self.assertRaises(ValueError):
+            self.dataset.upsert([{'Area': 'Aundh', 'Year': 2023, 'Demand': 'abc'}])
+        self.assertEqual(self.dataset.frame['Demand'].dtype, dtype)
+
+    def test_column_given_under_two_names(self):
+        with self.assertRaises(ValueError):
+            self.dataset.upsert([{'final location': 'Aundh', 'Area': 'Aundh', 'Year': 2023}])
+
+    def test_dataframe_rows(self):
+        self.dataset.upsert(pd.DataFrame([{'Area': 'Newarea', 'Year': 2024, 'Demand': 3}]))
+        self.assertEqual(self.value('Newarea', 2024, 'Demand'), 3)
+
+    def test_appended_rows_keep_integer_columns(self):
+        self.dataset.upsert([{'Area': 'Baner', 'Year': 2024, 'flat - weighted average rate': 7000}])
+        frame = self.dataset.frame
+        self.assertEqual(frame['Year'].dtype, 'int64')
+        # left out by the new row: nullable, the existing values stay integers
+        self.assertEqual(frame['flat_sold - igr'].dtype, 'Int64')
+        self.assertIs(frame['flat_sold - igr'].iloc[-1], pd.NA)
+        self.assertEqual(read_snapshot(self.dataset.version)['flat_sold - igr'].dtype, 'Int64')
+
+    def test_upsert_gives_a_new_version_and_keeps_the_old_snapshot(self):
+        old = self.dataset.version
+        write_snapshot(self.dataset.frame, old)
+        demand = self.value('Aundh', 2023, 'Demand')
+        self.dataset.upsert([{'Area': 'Aundh', 'Year': 2023, 'Demand': 1}])
+        self.assertNotEqual(self.dataset.version, old)
+        self.assertEqual(self.dataset.origin, old)
+        before, after = read_snapshot(old), read_snapshot(self.dataset.version)
+        self.assertEqual(before.loc[(before['Area'] == 'Aundh') & (before['Year'] == 2023), 'Demand'].iloc[0], demand)
+        self.assertEqual(after.loc[(after['Area'] == 'Aundh') & (after['Year'] == 2023), 'Demand'].iloc[0], 1)
+
+    def test_concurrent_upserts_chain_their_versions(self):
+        a, b = [{'Area': 'Aundh', 'Year': 2023, 'Demand': 1}], [{'Area': 'Wakad', 'Year': 2023, 'Demand': 2}]
+        expected = set()
+        for first, second in [(a, b), (b, a)]:
+            dataset = Dataset(self.dataset.frame, self.dataset.version)
+            dataset.upsert(first)
+            dataset.upsert(second)
+            expected.add(dataset.version)
+
+        def slow_write(frame, version):
+            time.sleep(0.05)
+            return write_snapshot(frame, version)
+
+        with mock.patch('api.dataset.write_snapshot', slow_write):
+            threads = [threading.Thread(target=self.dataset.upsert, args=(rows,)) for rows in (a, b)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertIn(self.dataset.version, expected)
+
+    def test_workbook_upserts_are_published(self):
+        st = SAMPLE_PATH.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+        dataset = Dataset(self.dataset.frame, self.dataset.version, SAMPLE_PATH, *stamp)
+        publish(SAMPLE_PATH, dataset.version, *stamp)
+        dataset.upsert([{'Area': 'Aundh', 'Year': 2023, 'Demand': 1}])
+        self.assertEqual(published_version(SAMPLE_PATH, *stamp), dataset.version)
+
+        stale = Dataset(self.dataset.frame, self.dataset.version, SAMPLE_PATH, *stamp)
+        with self.assertRaises(StaleDataset):
+            stale.upsert([{'Area': 'Aundh', 'Year': 2023, 'Demand': 2}])
+
+    def test_missing_upserted_snapshot_is_not_rebuilt_from_the_workbook(self):
+        st = SAMPLE_PATH.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+        base = self.dataset.version
+        write_snapshot(self.dataset.frame, base)
+        publish(SAMPLE_PATH, base, *stamp)
+        dataset = Dataset(self.dataset.frame, base, SAMPLE_PATH, *stamp)
+        dataset.upsert([{'Area': 'Aundh', 'Year': 2023, 'Demand': 1}])
+        shutil.rmtree(snapshot_path(dataset.version))
+
+        with mock.patch.dict('api.dataset._datasets', clear=True), self.assertLogs('api.dataset', 'ERROR'):
+            reloaded = get_dataset(SAMPLE_PATH)
+        self.assertEqual(reloaded.version, base)
+        self.assertEqual(published_version(SAMPLE_PATH, *stamp), base)
+        self.assertIsNone(read_snapshot(dataset.version))
+
+    def test_build_snapshot_keeps_published_upserts(self):
+        st = SAMPLE_PATH.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+        base = self.dataset.version
+        write_snapshot(self.dataset.frame, base)
+        publish(SAMPLE_PATH, base, *stamp)
+        dataset = Dataset(self.dataset.frame, base, SAMPLE_PATH, *stamp)
+        dataset.upsert([{'Area': 'Aundh', 'Year': 2023, 'Demand': 1}])
+
+        with self.assertRaises(CommandError):
+            call_command('build_snapshot', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(published_version(SAMPLE_PATH, *stamp), dataset.version)
+        call_command('build_snapshot', '--force', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(published_version(SAMPLE_PATH, *stamp), base)
+
+    @override_settings(DATASET_SNAPSHOT_KEEP=1)
+    def test_superseded_upserts_are_deleted(self):
+        st = SAMPLE_PATH.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+        base = self.dataset.version
+        write_snapshot(self.dataset.frame, base)
+        publish(SAMPLE_PATH, base, *stamp)
+        dataset = Dataset(self.dataset.frame, base, SAMPLE_PATH, *stamp)
+        versions = []
+        for demand in range(3):
+            dataset.upsert([{'Area': 'Aundh', 'Year': 2023, 'Demand': demand}])
+            versions.append(dataset.version)
+        self.assertIsNotNone(read_snapshot(base))
+        self.assertIsNone(read_snapshot(versions[0]))
+        self.assertIsNotNone(read_snapshot(versions[1]))
+        self.assertEqual(read_current()[str(SAMPLE_PATH.resolve())]['base'], base)
+
+
+class UploadDiskTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings = override_settings(DATASET_SNAPSHOT_DIR=root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.frame = get_dataset(SAMPLE_PATH).frame
+
+    def test_least_recently_used_snapshots_are_deleted(self):
+        ids = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(4)]
+        for i, dataset_id in enumerate(ids):
+            os.utime(write_snapshot(self.frame, dataset_id), (i, i))
+        size = sum(f.stat().st_size for f in snapshot_path(ids[0]).rglob('*'))
+        store = DatasetStore(max_disk_bytes=2 * size)
+        store.get(ids[0])  # in memory, and the most recently used
+        store._trim_disk()
+        self.assertEqual([read_snapshot(i) is not None for i in ids], [True, False, False, True])
+
+
+class RowsAuthTests(SimpleTestCase):
+    body = json.dumps({'rows': [{'Area': 'Aundh', 'Year': 2023, 'Demand': 1}]})
+
+    def post(self, **headers):
+        return Client().post('/api/rows/', self.body, content_type='application/json', headers=headers)
+
+    def test_disabled_by_default(self):
+        with mock.patch('api.dataset.Dataset.upsert') as upsert:
+            self.assertEqual(self.post().status_code, 404)
+        upsert.assert_not_called()
+
+    @override_settings(ROWS_API_ENABLED=True, ROWS_API_TOKEN='')
+    def test_sample_needs_a_token(self):
+        self.assertEqual(self.post().status_code, 403)
+
+    @override_settings(ROWS_API_ENABLED=True, ROWS_API_TOKEN='secret')
+    def test_token_is_checked(self):
+        self.assertEqual(self.post(Authorization='Bearer wrong').status_code, 403)
+        with mock.patch('api.dataset.Dataset.upsert', return_value={'updated': 1, 'inserted': 0}) as upsert:
+            self.assertEqual(self.post(Authorization='Bearer secret').status_code, 200)
+        upsert.assert_called_once()
+
+
+def _scan_area_df(df, area_query):
+    """The matcher AreaIndex replaced: a scan of the cleaned names per query."""
+    q = str(area_query).strip().lower()
+    working = df.copy()
+    working['Area_clean'] = working['Area'].astype(str).str.lower().str.replace(r'[^a-z0-9\s]', '', regex=True).str.strip()
+    for mask in (working['Area_clean'] == q, working['Area_clean'].str.contains(q, na=False),
+                 working['Area_clean'].str.startswith(q, na=False)):
+        if mask.any():
+            return working[mask]
+    choices = working['Area_clean'].dropna().unique().tolist()
+    matches = difflib.get_close_matches(q, choices, n=1, cutoff=0.7)
+    if matches:
+        return working[working['Area_clean'] == matches[0]]
+    best, best_score = None, 0.0
+    for choice in choices:
+        score = difflib.SequenceMatcher(None, q, choice).ratio()
+        if score > best_score:
+            best, best_score = choice, score
+    if best_score >= 0.6 and best:
+        return working[working['Area_clean'] == best]
+    return df.iloc[0:0]
+
+
+class AreaMatchTests(SimpleTestCase):
+    def test_same_rows_as_the_scan(self):
+        dataset = get_dataset(SAMPLE_PATH)
+        index, rng = dataset.area_index, random.Random(3)
+
+        def typo(name):
+            chars, i, edit = list(name), rng.randrange(len(name)), rng.randrange(3)
+            if edit == 0:
+                del chars[i]
+            elif edit == 1:
+                chars.insert(i, rng.choice('abcdekw'))
+            else:
+                chars[i] = rng.choice('aeiouvw')
+            return ''.join(chars)
+
+        queries = ['', 'a', 'pune', 'budruk', 'xyzzy']
+        for name in index.names:
+            queries += [name, name.upper(), f' {name.title()} ', name[:3], name[1:5], name[:-1]]
+            queries += [typo(name) for _ in range(10)]
+        for query in queries:
+            expected = list(_scan_area_df(dataset.frame, query).index)
+            self.assertEqual(list(index.rows(index.match(query))), expected, query)
+
+    def test_typos_resolve(self):
+        index = get_dataset(SAMPLE_PATH).area_index
+        for query, name in [('wakda', 'wakad'), ('awkad', 'wakad'), ('auhd', 'aundh'), ('akudri', 'akurdi'),
+                            ('ambegoan', 'ambegaon budruk'), ('vakad', 'wakad')]:
+            self.assertEqual(index.match(query), [name], query)
+        self.assertEqual(index.match('xyzzy'), [])
+
+
+class SummaryCacheTests(SimpleTestCase):
+    def cache(self, **kwargs):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        return SummaryCache(os.path.join(root.name, 'summaries.sqlite3'), **kwargs)
+
+    def test_hit_and_miss(self):
+        cache = self.cache()
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 'Prices rose.')
+        self.assertEqual(cache.get('a'), 'Prices rose.')
+        self.assertEqual((cache.hits, cache.misses, cache.stores), (1, 1, 1))
+
+    def test_entries_expire(self):
+        cache = self.cache(ttl=60)
+        with mock.patch('api.summary_cache.time.time', return_value=1000.0):
+            cache.set('a', 'Prices rose.')
+        with mock.patch('api.summary_cache.time.time', return_value=1059.0):
+            self.assertEqual(cache.get('a'), 'Prices rose.')
+        with mock.patch('api.summary_cache.time.time', return_value=1061.0):
+            self.assertIsNone(cache.get('a'))
+            self.assertNotIn('a', cache)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = self.cache(ttl=0, max_entries=3)
+        for i, key in enumerate('abc'):
+            with mock.patch('api.summary_cache.time.time', return_value=1000.0 + i):
+                cache.set(key, key)
+        with mock.patch('api.summary_cache.time.time', return_value=1010.0):
+            cache.get('a')
+        for i, key in enumerate('de'):
+            with mock.patch('api.summary_cache.time.time', return_value=1020.0 + i):
+                cache.set(key, key)
+        self.assertEqual([key for key in 'abcde' if key in cache], ['a', 'd', 'e'])
+        self.assertEqual(cache.stats()['entries'], 3)
+        self.assertEqual(cache.evictions, 2)
+
+    def test_stand_in_client_answers_are_cached(self):
+        cache = self.cache()
+        calls = []
+
+        def create(**kwargs):
+            calls.append(kwargs)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=' Prices rose. '))])
+
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        stats = {'price_history': [{'Year': 2020, 'price': 1.0}]}
+        with mock.patch.object(openai_utils, 'summary_cache', cache), \
+                mock.patch.object(openai_utils, 'breaker', CircuitBreaker()):
+            for _ in range(2):
+                self.assertEqual(openai_utils.llm_summary('Wakad', stats, client=client), 'Prices rose.')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.hits, 1)
+
+
+class FakeUpstreamTests(SimpleTestCase):
+    """llm_summary and allm_summary against FakeOpenAIServer, through the real openai clients."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeOpenAIServer(latency=0)
+        cls.url = cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests, self.server.latency, self.server.error_rate = 0, 0, 0.0
+        self.breaker = CircuitBreaker(failures=2, reset_after=0.2)
+
+        async def no_entry(*args, **kwargs):
+            return None
+
+        for patcher in [
+            mock.patch.object(openai_utils, 'breaker', self.breaker),
+            mock.patch.object(openai_utils, 'summary_cache', SummaryCache(None)),
+            mock.patch.object(openai_utils, '_cache_get', no_entry),
+            mock.patch.object(openai_utils, '_cache_set', no_entry),
+            mock.patch.dict(openai_utils.RETRY, retries=2, backoff=0, backoff_cap=0),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = openai.OpenAI(api_key='test', base_url=self.url, max_retries=0)
+        self.addCleanup(self.client.close)
+
+    def summary(self, area='Wakad'):
+        return openai_utils.llm_summary(area, {'price_history': [{'Year': 2020, 'price': 1.0}]}, client=self.client)
+
+    def test_failed_calls_are_tried_three_times(self):
+        self.server.error_rate = 1.0
+        self.assertTrue(openai_utils.is_fallback(self.summary()))
+        self.assertEqual(self.server.requests, 3)
+
+    def test_breaker_opens_and_recovers(self):
+        self.server.error_rate = 1.0
+        self.summary()
+        self.summary()
+        self.assertEqual((self.breaker.state, self.server.requests), ('open', 6))
+        # open: answered without an upstream request
+        self.assertTrue(openai_utils.is_fallback(self.summary()))
+        self.assertEqual(self.server.requests, 6)
+
+        self.server.error_rate = 0.0
+        time.sleep(0.25)
+        self.assertFalse(openai_utils.is_fallback(self.summary()))
+        self.assertEqual((self.breaker.state, self.server.requests), ('closed', 7))
+
+    def test_concurrent_calls_share_one_request(self):
+        self.server.latency = 0.3
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            summaries = list(pool.map(lambda _: self.summary('Aundh'), range(8)))
+        self.assertEqual(len(set(summaries)), 1)
+        self.assertFalse(openai_utils.is_fallback(summaries[0]))
+        self.assertEqual(self.server.requests, 1)
+
+    def test_batch_timeout_bounds_the_whole_batch(self):
+        self.server.latency = 0.4
+        stats = {'price_history': [{'Year': 2020, 'price': 1.0}]}
+        jobs = [(f'Area {i}', stats, 'analysis') for i in range(8)]
+        self.summary()  # the client's first request is slower
+        # leaving the pool waits for the jobs still running, so they end with the test
+        with ThreadPoolExecutor(max_workers=4) as pool, mock.patch.object(openai_utils, '_executor', pool):
+            started = time.monotonic()
+            summaries = openai_utils.llm_summaries(jobs, client=self.client, timeout=0.6)
+            elapsed = time.monotonic() - started
+        # the second half of the jobs is still running when the batch deadline passes
+        self.assertLess(elapsed, 0.75)
+        self.assertEqual([openai_utils.is_fallback(summary) for summary in summaries], [False] * 4 + [True] * 4)
+
+    def test_concurrent_async_calls_share_one_request(self):
+        self.server.latency = 0.3
+        stats = {'price_history': [{'Year': 2020, 'price': 1.0}]}
+
+        async def summaries():
+            async with openai.AsyncOpenAI(api_key='test', base_url=self.url, max_retries=0) as client:
+                return await asyncio.gather(*[
+                    openai_utils.allm_summary('Akurdi', stats, client=client) for _ in range(5)
+                ])
+
+        summaries = asyncio.run(summaries())
+        self.assertEqual(len(set(summaries)), 1)
+        self.assertFalse(openai_utils.is_fallback(summaries[0]))
+        self.assertEqual(self.server.requests, 1)
+
+
+def _chunks(*texts):
+    return [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=t))]) for t in texts]
+
+
+class StreamBreakerTests(SimpleTestCase):
+    stats = {'price_history': [{'Year': 2020, 'price': 1.0}]}
+
+    def setUp(self):
+        # a breaker that is half-open right after its first failure
+        self.breaker = CircuitBreaker(failures=1, reset_after=0)
+        self.breaker.record_failure()
+        patcher = mock.patch.object(openai_utils, 'breaker', self.breaker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_closed_stream_releases_the_trial(self):
+        create = lambda **kwargs: iter(_chunks('Prices ', 'rose.'))
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        stream = openai_utils.llm_summary_stream(f'Closed {time.time()}', self.stats, client=client)
+        self.assertEqual(next(stream), 'Prices ')
+        stream.close()
+        self.assertTrue(self.breaker.allow())
+
+    def test_cancelled_async_stream_releases_the_trial(self):
+        async def chunks():
+            for chunk in _chunks('Prices ', 'rose.'):
+                yield chunk
+
+        async def create(**kwargs):
+            return chunks()
+
+        async def consume():
+            client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+            stream = openai_utils.allm_summary_stream(f'Cancelled {time.time()}', self.stats, client=client)
+            self.assertEqual(await stream.__anext__(), 'Prices ')
+            await stream.aclose()
+
+        asyncio.run(consume())
+        self.assertTrue(self.breaker.allow())
+
+
+class StreamErrorTests(SimpleTestCase):
+    def test_done_after_an_error_is_marked(self):
+        def failing(**kwargs):
+            yield 'Prices '
+            raise RuntimeError('upstream went away')
+
+        with mock.patch('api.views.llm_summary_stream', failing):
+            response = Client().get('/api/analyze/', {'area': 'Wakad', 'stream': '1'})
+            events = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([event['event'] for event in events], ['data', 'summary', 'error', 'done'])
+        self.assertEqual(events[-1], {'event': 'done', 'summary': 'Prices ', 'error': True})
+
+
+class AnalyzeETagTests(SimpleTestCase):
+    def test_fallback_summaries_are_not_tagged(self):
+        fallback = openai_utils._fallback_summary('Wakad', {})
+        with mock.patch('api.views.llm_summary', return_value=fallback):
+            response = Client().get('/api/analyze/', {'area': 'Wakad'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+        with mock.patch('api.views.llm_summary', return_value='Prices rose.'):
+            response = Client().get('/api/analyze/', {'area': 'Wakad'})
+        self.assertTrue(response.has_header('ETag'))
+
+
+class RankTests(SimpleTestCase):
+    def test_failures_are_json(self):
+        with mock.patch('api.views._load_data', side_effect=OSError('disk gone')):
+            response = Client().get('/api/rank/', {'by': 'price_cagr'})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {'status': 'error', 'message': 'disk gone'})
+
+
+class PromptBudgetTests(SimpleTestCase):
+    def stats(self):
+        chart = [{'Year': year, 'price': 1000 + year, 'demand': year} for year in range(1990, 2025)]
+        table = [{'Area': f'Area {i}', 'Year': 2020} for i in range(200)]
+        return compact_stats({'price_history': chart, 'full_table': table})
+
+    def test_old_years_go_first(self):
+        text, tokens = fit_to_budget(self.stats(), 300)
+        data = json.loads(text)
+        self.assertLessEqual(tokens, 300)
+        self.assertEqual(data['per_year'][-1]['year'], 2024)
+
+    def test_aggregates_go_when_years_are_not_enough(self):
+        text, tokens = fit_to_budget(self.stats(), 40)
+        data = json.loads(text)
+        self.assertLessEqual(tokens, 40)
+        self.assertNotIn('areas', data)
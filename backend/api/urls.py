@@ -1,7 +1,13 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
-    path('analyze/', views.analyze, name='analyze'),
+    path('analyze/', views.analyze_async if settings.ASYNC_SERVING else views.analyze, name='analyze'),
+    path('batch/', views.batch_async if settings.ASYNC_SERVING else views.batch, name='batch'),
+    path('datasets/', views.upload_dataset, name='datasets'),
+    path('rank/', views.rank_areas, name='rank'),
+    path('rows/', views.upsert_rows, name='rows'),
     path('health/', views.health, name='health'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
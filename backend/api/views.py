@@ -1,352 +1,930 @@
+import hmac
 import json
-import difflib
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
+import numpy as np
 import pandas as pd
-from pathlib import Path
-from .openai_utils import llm_summary  # <-- import your helper function
+from .aggregates import compare_areas, compute_price, growth_chart, growth_summary
+from .cache import LRUCache
+from .cube import InvalidMetric
+from . import http_cache, metrics
+from .encoding import ORIENTS, FrameJSONResponse, JSONFrame, dumps
+from .dataset import SAMPLE_PATH, StaleDataset, get_dataset, on_reload, on_update
+from .openai_utils import (
+    allm_summaries, allm_summary_stream, is_fallback, llm_summaries, llm_summary, llm_summary_stream, summary_key,
+)  # <-- import your helper function
+from .store import upload_store
+
+def _load_data(uploaded_file=None, dataset_id=None):
+    """Load Excel file as a Dataset.
+
+    Uploads are registered in the upload store under their content hash and
+    can be reused with ``dataset_id``; the bundled sample comes from the
+    process-wide dataset registry and is only re-read when the file changes.
+    Returns None for an unknown ``dataset_id``.
+    """
+    if uploaded_file:
+        dataset, _ = upload_store.ingest(uploaded_file)
+        return dataset
+    if dataset_id:
+        return upload_store.get(dataset_id)
+    return get_dataset(SAMPLE_PATH)
 
-BASE = Path(__file__).resolve().parent.parent
-SAMPLE_PATH = BASE / 'sample_data' / 'Sample_data.xlsx'
 
-PRICE_COLUMNS = [
-    'flat - weighted average rate',
-    'office - weighted average rate',
-    'others - weighted average rate',
-    'shop - weighted average rate'
-]
+def _ensure_price(df_area):
+    """Compute a 'price' column robustly even if some expected columns are missing.
+    Returns the dataframe with a 'price' column (may contain NaN).
+    """
+    with metrics.span('price'):
+        return compute_price(df_area)
 
-def _load_data(uploaded_file=None):
-    """Load Excel file"""
-    if uploaded_file:
-        df = pd.read_excel(uploaded_file)
+
+def _area_rows(df, index, names):
+    """Rows of the cleaned area ``names``, with the cleaned name in 'Area_clean'."""
+    positions = index.rows(names)
+    if not len(positions):
+        return df.iloc[0:0]
+
+    matched = df.iloc[positions].copy()
+    matched['Area_clean'] = index.clean[positions]
+    return matched
+
+
+def _match_names(dataset, area):
+    """Cleaned area names ``area`` resolves to in ``dataset`` (empty if none)."""
+    if 'Area' not in dataset.frame.columns:
+        return []
+    with metrics.span('match'):
+        return dataset.area_index.match(area)
+
+
+# Ready-made chart/table payloads keyed by (dataset origin, matched area
+# names, their revision, mode, years): an upsert only retires the payloads
+# of the areas it touched, although it gives the dataset a new version.
+_payload_cache = LRUCache(maxsize=getattr(settings, 'ANALYZE_CACHE_SIZE', 256))
+
+
+def _payload_key(dataset, names, mode, years):
+    return (dataset.origin, tuple(names), dataset.area_revision(names), mode, years)
+
+
+def _analyze_etag(request, dataset):
+    """Strong ETag of a GET analyze response, or None for uploads.
+
+    Made of the dataset version (which every upsert changes) and the
+    normalized query, so it changes with the data behind the response and
+    is the same on every worker. Summaries are the one part of a response
+    it does not cover, so responses with a fallback summary (or a streamed
+    one) go out untagged.
+    """
+    if request.method != 'GET':
+        return None
+    query = sorted((key, value.strip()) for key, values in request.GET.lists() for value in values)
+    return http_cache.etag('analyze', dataset.version, query, getattr(settings, 'OPENAI_MODEL', None))
+
+
+@on_reload
+def _drop_stale_payloads(old, new):
+    _payload_cache.invalidate(lambda key: key[0] == old.origin)
+
+
+@on_update
+def _drop_updated_payloads(dataset, names):
+    names = set(names)
+    _payload_cache.invalidate(lambda key: key[0] == dataset.origin and not names.isdisjoint(key[1]))
+
+
+def _analysis_payload(df_area, priced=False, yearly=None):
+    """Per-year chart and full table for one matched area.
+
+    ``priced`` frames already carry the 'price' column (batch requests price
+    their shared frame once). ``yearly`` is the per-year mean frame when it
+    was sliced from the dataset's cube; it is aggregated here otherwise.
+    """
+    # Compute price and demand defensively
+    df_area = df_area.copy() if priced else _ensure_price(df_area)
+    # demand may be missing; coerce if present
+    if 'Demand' in df_area.columns:
+        df_area.loc[:, 'demand'] = df_area['Demand']
     else:
-        df = pd.read_excel(SAMPLE_PATH)
+        df_area.loc[:, 'demand'] = pd.NA
 
-    df.rename(columns={
-        "final location": "Area",
-        "year": "Year",
-        "total sold - igr": "Demand"
-    }, inplace=True)
+    with metrics.span('groupby'):
+        if yearly is None:
+            yearly = df_area.groupby('Year').agg({'price': 'mean', 'demand': 'mean'})
+        chart = yearly.reset_index().to_dict(orient='records')
 
-    # Normalize area and year columns to avoid mismatches
-    if 'Area' in df.columns:
-        df['Area'] = df['Area'].astype(str).str.strip()
+    # encoded straight from the columns when the response is written
+    table = JSONFrame(df_area)
+    return {'chart': chart, 'table': table, 'yearly': yearly}
 
-    if 'Year' in df.columns:
-        # try to coerce to int where possible
-        df['Year'] = pd.to_numeric(df['Year'], errors='coerce')
 
-    return df
+def _growth_payload(df_area, years, priced=False):
+    """Price chart and table restricted to the last ``years`` years of data."""
+    if not priced:
+        df_area = _ensure_price(df_area)
+    try:
+        n = int(years)
+        max_year = df_area["Year"].max()
+        df_area = df_area[df_area["Year"] >= max_year - n + 1].copy()
+    except:
+        pass
 
+    with metrics.span('groupby'):
+        price_chart = growth_chart(df_area)
+        yearly = df_area.groupby('Year')['price'].mean()
+        growth = growth_summary(yearly.index.to_numpy(), yearly.to_numpy())
 
-def _ensure_price(df_area):
-    """Compute a 'price' column robustly even if some expected columns are missing.
-    Returns the dataframe with a 'price' column (may contain NaN).
+    table = JSONFrame(df_area[["Area", "Year", "price"]])
+    return {'chart': price_chart, 'table': table, 'growth': growth}
+
+
+def area_payload(dataset, area, mode, years=None, cached=True):
+    """Return the chart/table payload for ``area`` or None when nothing matches.
+
+    Payloads only depend on the dataset contents, so they are cached per
+    dataset version and shared between requests; do not mutate them.
+    Bulk jobs pass ``cached=False`` to build one without touching the
+    cache, where they would evict the payloads requests use.
     """
-    df_area = df_area.copy()
+    names = _match_names(dataset, area)
+    if not names:
+        return None
+    if not cached:
+        return _area_rows_payload(dataset, names, mode, years)
+    # the key (and its revision) is read before the frame, so a payload is
+    # never cached under a newer revision than the rows it was built from
+    key = _payload_key(dataset, names, mode, years)
+    payload = _payload_cache.get(key)
+    if payload is not None:
+        return payload
+
+    payload = _area_rows_payload(dataset, names, mode, years)
+    _payload_cache.set(key, payload)
+    return payload
+
+
+def _area_rows_payload(dataset, names, mode, years=None):
+    df_area = _area_rows(dataset.frame, dataset.area_index, names)
+    return _build_payload(df_area, mode, years, yearly=_cube_yearly(dataset, names, mode))
+
+
+def _cube_yearly(dataset, names, mode):
+    """The analysis chart's per-year means, sliced from the dataset's cube."""
+    if mode == 'growth':
+        return None
+    cube = dataset.cube
+    return cube.yearly(names) if cube is not None else None
+
+
+def _build_payload(df_area, mode, years=None, priced=False, yearly=None):
+    if mode == 'growth':
+        payload = _growth_payload(df_area, years, priced)
+    else:
+        payload = _analysis_payload(df_area, priced, yearly)
+    # the canonical name when the query resolved to exactly one area
+    names = df_area['Area'].unique()
+    payload['area'] = str(names[0]) if len(names) == 1 else None
+    return payload
 
-    # Preferred price columns defined at module top
-    available = [c for c in PRICE_COLUMNS if c in df_area.columns]
-    if available:
+
+def _area_payloads(dataset, specs):
+    """``area_payload`` for many (area, mode, years) specs at once.
+
+    Returns {spec: payload or None}. Each distinct area is matched once and
+    the rows of every matched area are priced together in one shared frame,
+    which the individual payloads are then cut from.
+    """
+    payloads = {}
+    pending = []
+    matched = {}
+    for spec in dict.fromkeys(specs):
+        area, mode, years = spec
+        query = str(area).strip().lower()
+        if query not in matched:
+            matched[query] = tuple(_match_names(dataset, area))
+        names = matched[query]
+        if not names:
+            payloads[spec] = None
+            continue
+        key = _payload_key(dataset, names, mode, years)
+        payload = _payload_cache.get(key)
+        if payload is not None:
+            payloads[spec] = payload
+        else:
+            pending.append((spec, names, key))
+    if not pending:
+        return payloads
+
+    frame = dataset.frame
+    index = dataset.area_index
+    positions = {}
+    for _, names, _ in pending:
+        if names not in positions:
+            positions[names] = index.rows(names)
+    union = np.unique(np.concatenate(list(positions.values())))
+    shared = frame.iloc[union].copy()
+    shared['Area_clean'] = index.clean[union]
+    shared = _ensure_price(shared)
+
+    for spec, names, key in pending:
+        df_area = shared.iloc[np.searchsorted(union, positions[names])]
+        payloads[spec] = _build_payload(df_area, spec[1], spec[2], priced=True,
+                                        yearly=_cube_yearly(dataset, names, spec[1]))
+        _payload_cache.set(key, payloads[spec])
+    return payloads
+
+
+def summary_job(area, payload, mode='analysis', years=None):
+    """The (area, stats, mode) summary job for an area payload.
+
+    Views and the precompute job build their summaries here, and a query
+    that resolved to a single area is summarized under its canonical name,
+    so equal questions map to the same summary cache entry.
+    """
+    label = payload.get('area') or area
+    if mode == 'growth':
+        return label, {
+            "price_growth_chart": payload['chart'],
+            "table": payload['table'],
+            "years": years
+        }, 'growth'
+    return label, {
+        "price_history": payload['chart'],
+        "full_table": payload['table']
+    }, 'analysis'
+
+
+class InvalidQuery(ValueError):
+    """A malformed query parameter, answered with a 400."""
+
+
+def _table_params(params):
+    """Parse the table paging/projection parameters; None means the full table.
+
+    ``limit``/``offset`` select a window of rows, ``columns`` is a
+    comma-separated projection and ``sort`` a comma-separated list of
+    columns, each optionally prefixed with '-' for descending order.
+    """
+    if not any(k in params for k in ('limit', 'offset', 'columns', 'sort')):
+        return None
+    try:
+        limit = int(params['limit']) if params.get('limit') else None
+        offset = int(params.get('offset') or 0)
+    except ValueError:
+        raise InvalidQuery('limit and offset must be integers')
+    if offset < 0 or (limit is not None and limit < 0):
+        raise InvalidQuery('limit and offset must not be negative')
+    return {
+        'limit': limit,
+        'offset': offset,
+        'columns': [c.strip() for c in params.get('columns', '').split(',') if c.strip()],
+        'sort': [c.strip() for c in params.get('sort', '').split(',') if c.strip()],
+    }
+
+
+def _table_view(table, params):
+    """Apply sort, offset/limit and column projection to a JSONFrame table.
+
+    Returns (table, page). Rows are ordered and sliced on their positions
+    first, so only the selected rows and columns are ever copied.
+    """
+    if params is None:
+        return table, None
+
+    frame = table.frame
+    columns = params['columns'] or list(frame.columns)
+    sort_keys = [c.lstrip('-') for c in params['sort']]
+    unknown = [c for c in columns + sort_keys if c not in frame.columns]
+    if unknown:
+        raise InvalidQuery(f"Unknown column(s): {', '.join(dict.fromkeys(unknown))}")
+
+    total = len(frame)
+    if sort_keys:
+        ascending = [not c.startswith('-') for c in params['sort']]
+        order = (
+            frame[sort_keys].reset_index(drop=True)
+            .sort_values(sort_keys, ascending=ascending, kind='stable', na_position='last')
+            .index.to_numpy()
+        )
+    else:
+        order = np.arange(total)
+
+    offset, limit = params['offset'], params['limit']
+    stop = total if limit is None else min(total, offset + limit)
+    window = order[offset:stop]
+    view = frame.iloc[window, frame.columns.get_indexer(columns)]
+    page = {
+        'offset': offset,
+        'limit': limit,
+        'total': total,
+        'next_offset': stop if stop < total else None
+    }
+    return JSONFrame(view), page
+
+
+def _wants_stream(request):
+    return request.GET.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def _ndjson(event, orient='records'):
+    return dumps(event, orient=orient) + '\n'
+
+
+def _stream_analysis(area, chart, table, stats, mode, orient='records', page=None, asynchronous=False):
+    """Stream the chart/table immediately, then the summary as it is generated.
+
+    Emits newline-delimited JSON events: one ``data`` event with the chart
+    and table, any number of ``summary`` events carrying text deltas, and a
+    final ``done`` event with the complete summary. When the summary fails
+    an ``error`` event comes first and ``done`` carries ``"error": true``
+    with whatever text had arrived. With ``asynchronous``
+    the body is an async iterator fed by the async OpenAI client.
+    """
+    data = {'event': 'data', 'status': 'ok', 'chart': chart, 'table': table}
+    if page:
+        data['page'] = page
+    # serialized up front so the async body does no pandas work on the event loop
+    head = _ndjson(data, orient)
+
+    def events():
+        yield head
+        parts = []
         try:
-            df_area.loc[:, 'price'] = df_area[available].mean(axis=1)
-            return df_area
-        except Exception:
-            # fall through to try alternatives
-            pass
-
-    # Fallback: try any numeric column that looks like a price
-    numeric_cols = df_area.select_dtypes(include=['number']).columns.tolist()
-    # Exclude Year and Demand
-    numeric_cols = [c for c in numeric_cols if c not in ('Year', 'Demand')]
-
-    if numeric_cols:
+            for delta in llm_summary_stream(area=area, stats=stats, mode=mode):
+                parts.append(delta)
+                yield _ndjson({'event': 'summary', 'delta': delta})
+        except Exception as e:
+            yield _ndjson({'event': 'error', 'message': str(e)})
+            yield _ndjson({'event': 'done', 'summary': ''.join(parts), 'error': True})
+            return
+        yield _ndjson({'event': 'done', 'summary': ''.join(parts)})
+
+    async def aevents():
+        yield head
+        parts = []
         try:
-            df_area.loc[:, 'price'] = df_area[numeric_cols].iloc[:, 0]
-            return df_area
-        except Exception:
-            pass
+            async for delta in allm_summary_stream(area=area, stats=stats, mode=mode):
+                parts.append(delta)
+                yield _ndjson({'event': 'summary', 'delta': delta})
+        except Exception as e:
+            yield _ndjson({'event': 'error', 'message': str(e)})
+            yield _ndjson({'event': 'done', 'summary': ''.join(parts), 'error': True})
+            return
+        yield _ndjson({'event': 'done', 'summary': ''.join(parts)})
+
+    body = aevents() if asynchronous else events()
+    response = StreamingHttpResponse(body, content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _advance(steps, value=None):
+    """Run a steps generator to its next summary request; returns (done, jobs or result)."""
+    try:
+        return False, steps.send(value)
+    except StopIteration as done:
+        return True, done.value
 
-    # Last resort: create price as NaN column so downstream code doesn't KeyError
-    df_area.loc[:, 'price'] = pd.NA
-    return df_area
 
+def _summarize(jobs):
+    if len(jobs) == 1:
+        return [llm_summary(*jobs[0])]
+    return llm_summaries(jobs)
 
-def _find_area_df(df, area_query):
-    """Return a dataframe filtered to rows that match the area_query.
-    Matching is case-insensitive and uses substring containment so that
-    'Wakad' matches 'Wakad Pune' or 'Wakad (Pune)'. Returns an empty
-    dataframe if no match is found.
-    """
-    if 'Area' not in df.columns:
-        return df.iloc[0:0]
 
-    q = str(area_query).strip().lower()
-
-    # Work on a cleaned column so matching is more forgiving (remove punctuation)
-    working = df.copy()
-    working['Area_clean'] = working['Area'].astype(str).str.lower().str.replace(r'[^a-z0-9\s]', '', regex=True).str.strip()
-
-    # direct exact match first (cleaned)
-    mask_exact = working['Area_clean'] == q
-    if mask_exact.any():
-        return working[mask_exact].copy()
-
-    # then contains
-    mask_contains = working['Area_clean'].str.contains(q, na=False)
-    if mask_contains.any():
-        return working[mask_contains].copy()
-
-    # then startswith
-    mask_starts = working['Area_clean'].str.startswith(q, na=False)
-    if mask_starts.any():
-        return working[mask_starts].copy()
-
-    # fuzzy matching: try close matches among unique cleaned area names
-    choices = working['Area_clean'].dropna().unique().tolist()
-    # use difflib to find close matches (cutoff can be tuned)
-    matches = difflib.get_close_matches(q, choices, n=1, cutoff=0.7)
-    if matches:
-        matched = matches[0]
-        return working[working['Area_clean'] == matched].copy()
-
-    # final attempt: pick the best sequence-similarity score if reasonably close
-    best = None
-    best_score = 0.0
-    for choice in choices:
-        score = difflib.SequenceMatcher(None, q, choice).ratio()
-        if score > best_score:
-            best_score = score
-            best = choice
-
-    if best_score >= 0.6 and best:
-        return working[working['Area_clean'] == best].copy()
-
-    # no match found
-    return df.iloc[0:0]
+def _drive(steps):
+    """Answer a steps generator's summary requests synchronously; returns its response."""
+    done, value = _advance(steps)
+    while not done:
+        done, value = _advance(steps, _summarize(value))
+    return value
+
+
+_advance_async = sync_to_async(_advance, thread_sensitive=False)
+
+
+async def _adrive(steps):
+    """Async ``_drive``: data steps run in the thread pool, summaries are awaited."""
+    done, value = await _advance_async(steps)
+    while not done:
+        done, value = await _advance_async(steps, await allm_summaries(value))
+    return value
+
 
 @csrf_exempt
 def analyze(request):
+    return _drive(_analyze_steps(request))
+
+
+async def analyze_async(request):
+    """ASGI version of ``analyze``.
+
+    The pandas work and serialization run in the thread pool; summaries are
+    awaited on the shared async OpenAI client, so no thread is held for the
+    round-trip.
+    """
+    return await _adrive(_analyze_steps(request, asynchronous=True))
+
+
+# csrf_exempt only learned to wrap coroutines in Django 5.0
+analyze_async.csrf_exempt = True
+
+
+def _area_result(area, payload, mode, years, table_params):
+    """Response body for one area; yields its single summary job."""
+    label, stats, mode = summary_job(area, payload, mode, years)
+    table, page = _table_view(payload['table'], table_params)
+
+    summary, = yield [(label, stats, mode)]
+
+    response = {
+        'status': 'ok',
+        'summary': summary,
+        'chart': payload['chart'],
+        'table': table
+    }
+    if mode == 'growth':
+        response['growth'] = payload['growth']
+    if page:
+        response['page'] = page
+    return response
+
+
+def _compare_result(dataset, areas, payloads, table_params):
+    """Response body comparing ``areas`` given their analysis payloads.
+
+    Yields one round of summary jobs: every matched area plus, when all of
+    them matched, the point-wise difference.
+    """
+    result = {}
+    yearlies = {}
+    jobs = []
+    summarized = []
+
+    for area in areas:
+        payload = payloads[area]
+
+        if payload is None:
+            result[area] = {'error': 'No data for area', 'suggestions': dataset.area_index.suggest(area)}
+            continue
+
+        chart = payload['chart']
+        table = payload['table']
+        yearlies[area] = payload['yearly']
+
+        # ✅ Use OpenAI summary (requested concurrently below)
+        jobs.append(summary_job(area, payload))
+        summarized.append(area)
+
+        result[area] = {
+            'summary': None,
+            'chart': chart,
+            'table': table
+        }
+        result[area]['table'], page = _table_view(table, table_params)
+        if page:
+            result[area]['page'] = page
+
+    # If two or more areas were requested, compute point-wise differences
+    compare_diff = None
+    if len(areas) >= 2 and all(a in result and 'error' not in result[a] for a in areas):
+        diff = compare_areas(areas, [yearlies[a] for a in areas])
+        diff_chart = diff['chart']
+        diff_table = diff['table']
+
+        # Use LLM to create a short point-wise comparative summary (falls back if LLM not available)
+        if len(areas) == 2:
+            a1, a2 = areas
+            label = f"{a1} vs {a2}"
+            stats = {
+                'area_a': {'name': a1, 'chart': result[a1]['chart'] or []},
+                'area_b': {'name': a2, 'chart': result[a2]['chart'] or []},
+            }
+        else:
+            label = " vs ".join(areas)
+            stats = {'areas': [{'name': a, 'chart': result[a]['chart'] or []} for a in areas]}
+        stats.update({
+            'difference_chart': diff_chart,
+            'difference_table': diff_table
+        })
+        jobs.append((label, stats, 'compare'))
+
+        compare_diff = {
+            'summary': None,
+            'chart': diff_chart,
+            'table': diff_table,
+            'areas': list(areas),
+            'growth': diff['growth']
+        }
+
+    # One concurrent round of summaries for every area plus the difference
+    summaries = list((yield jobs))
+    if compare_diff is not None:
+        compare_diff['summary'] = summaries.pop()
+    for area, summary in zip(summarized, summaries):
+        result[area]['summary'] = summary
+
+    return {'status': 'ok', 'compare': result, 'compare_diff': compare_diff}
+
+
+def _analyze_steps(request, asynchronous=False):
+    """The analyze view as a generator shared by the sync and async entry points.
+
+    It yields a list of (area, stats, mode) summary jobs whenever it needs
+    LLM summaries, expects the summaries (in job order) to be sent back, and
+    returns the response.
+    """
     try:
         # Load file
-        if request.method == 'POST' and request.FILES.get('file'):
-            df = _load_data(request.FILES['file'])
-        else:
-            df = _load_data()
-
-        q = request.GET.get('area')
-        compare = request.GET.get('compare')
-        years = request.GET.get('years')
-
-        # ======================================================
-        #  COMPARE MULTIPLE AREAS
-        # ======================================================
-        if compare:
-            areas = [a.strip() for a in compare.split(',') if a.strip()]
-            result = {}
-
-            for area in areas:
-                df_area = _find_area_df(df, area)
-
-                if df_area.empty:
-                    result[area] = {'error': 'No data for area'}
-                    continue
-
-                # Compute price defensively
-                df_area = _ensure_price(df_area)
-                # demand may be missing; coerce if present
-                if 'Demand' in df_area.columns:
-                    df_area.loc[:, 'demand'] = df_area['Demand']
-                else:
-                    df_area.loc[:, 'demand'] = pd.NA
-                df_area = df_area.where(pd.notnull(df_area), None)
-
-                chart = (
-                    df_area.groupby('Year')
-                    .agg({'price': 'mean', 'demand': 'mean'})
-                    .reset_index()
-                    .to_dict(orient='records')
-                )
-
-                table = df_area.to_dict(orient='records')
-
-                # ✅ Use OpenAI summary
-                summary = llm_summary(
-                    area=area,
-                    stats={
-                        "price_history": chart,
-                        "full_table": table
-                    },
-                    mode="analysis"
-                )
-
-                result[area] = {
-                    'summary': summary,
-                    'chart': chart,
-                    'table': table
-                }
-
-            # If exactly two areas were requested, compute point-wise differences
-            compare_diff = None
-            if len(areas) == 2 and all(a in result and 'error' not in result[a] for a in areas):
-                a1, a2 = areas[0], areas[1]
-                c1 = result[a1]['chart'] or []
-                c2 = result[a2]['chart'] or []
-
-                # Normalize year keys and build maps
-                def to_map(c):
-                    m = {}
-                    for r in c:
-                        # accept Year or year
-                        y = r.get('Year') if 'Year' in r else r.get('year')
-                        try:
-                            y = int(y)
-                        except Exception:
-                            continue
-                        m[y] = {
-                            'price': float(r.get('price', 0) or 0),
-                            'demand': float(r.get('demand', 0) or 0)
-                        }
-                    return m
-
-                m1 = to_map(c1)
-                m2 = to_map(c2)
-
-                years = sorted(set(list(m1.keys()) + list(m2.keys())))
-
-                diff_chart = []
-                diff_table = []
-                for y in years:
-                    p1 = m1.get(y, {}).get('price', 0)
-                    p2 = m2.get(y, {}).get('price', 0)
-                    d1 = m1.get(y, {}).get('demand', 0)
-                    d2 = m2.get(y, {}).get('demand', 0)
-                    pdiff = p1 - p2
-                    ddiff = d1 - d2
-
-                    diff_chart.append({'year': y, 'price': pdiff, 'demand': ddiff})
-                    diff_table.append({
-                        'Year': y,
-                        f'price_{a1}': p1,
-                        f'price_{a2}': p2,
-                        'price_diff': pdiff,
-                        f'demand_{a1}': d1,
-                        f'demand_{a2}': d2,
-                        'demand_diff': ddiff
-                    })
-
-                # Use LLM to create a short point-wise comparative summary (falls back if LLM not available)
-                compare_summary = llm_summary(
-                    area=f"{a1} vs {a2}",
-                    stats={
-                        'area_a': {'name': a1, 'chart': c1},
-                        'area_b': {'name': a2, 'chart': c2},
-                        'difference_chart': diff_chart,
-                        'difference_table': diff_table
-                    },
-                    mode='compare'
-                )
-
-                compare_diff = {
-                    'summary': compare_summary,
-                    'chart': diff_chart,
-                    'table': diff_table,
-                    'areas': [a1, a2]
-                }
-
-            return JsonResponse({'status': 'ok', 'compare': result, 'compare_diff': compare_diff})
-
-        # ======================================================
-        #  SINGLE AREA ANALYSIS
-        # ======================================================
-        if q:
-            df_area = _find_area_df(df, q)
-
-            if df_area.empty:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': 'No data for area'
-                }, status=404)
-
-            # Compute price and demand defensively
-            df_area = _ensure_price(df_area)
-            if 'Demand' in df_area.columns:
-                df_area.loc[:, 'demand'] = df_area['Demand']
+        with metrics.span('load'):
+            if request.method == 'POST' and request.FILES.get('file'):
+                dataset = _load_data(request.FILES['file'])
             else:
-                df_area.loc[:, 'demand'] = pd.NA
-
-            # ==================================================
-            #   PRICE GROWTH MODE (years=N)
-            # ==================================================
-            if years:
-                try:
-                    n = int(years)
-                    max_year = df_area["Year"].max()
-                    df_area = df_area[df_area["Year"] >= max_year - n + 1].copy()
-                except:
-                    pass
-
-                price_chart = [
-                    {"year": int(r["Year"]), "price": float(r["price"])}
-                    for _, r in df_area.iterrows()
-                ]
-
-                table = df_area[["Area", "Year", "price"]].to_dict(orient="records")
-
-                # ✅ OpenAI summary for growth
-                summary = llm_summary(
-                    area=q,
-                    stats={
-                        "price_growth_chart": price_chart,
-                        "table": table,
-                        "years": years
-                    },
-                    mode="growth"
-                )
-
-                return JsonResponse({
-                    "status": "ok",
-                    "summary": summary,
-                    "chart": price_chart,
-                    "table": table
-                })
-
-            # ==================================================
-            #   NORMAL FULL ANALYSIS MODE
-            # ==================================================
-            df_area = df_area.where(pd.notnull(df_area), None)
-
-            chart = (
-                df_area.groupby('Year')
-                .agg({'price': 'mean', 'demand': 'mean'})
-                .reset_index()
-                .to_dict(orient='records')
-            )
-
-            table = df_area.to_dict(orient='records')
-
-            summary = llm_summary(
-                area=q,
-                stats={
-                    "price_history": chart,
-                    "full_table": table
-                },
-                mode="analysis"
-            )
+                dataset = _load_data(dataset_id=request.GET.get('dataset'))
+
+        if dataset is None:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Unknown dataset; upload it again via /api/datasets/'
+            }, status=404)
+
+        orient = request.GET.get('orient', 'records')
+        if orient not in ORIENTS:
+            return JsonResponse({
+                'status': 'error',
+                'message': f"orient must be one of {', '.join(ORIENTS)}"
+            }, status=400)
+        table_params = _table_params(request.GET)
+
+        tag = _analyze_etag(request, dataset)
+        if tag is not None:
+            response = http_cache.lookup(request, tag)
+            if response is not None:
+                return response
+
+        response, fallback = yield from _noting_fallbacks(
+            _analyze_response(request, dataset, orient, table_params, asynchronous)
+        )
+        if fallback or isinstance(response, StreamingHttpResponse):
+            # a fallback summary is not what the tag promises: the next
+            # request should get the LLM's (a stream's is not known yet)
+            return response
+        return http_cache.finish(response, tag)
+
+    except InvalidQuery as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
 
+def _noting_fallbacks(steps):
+    """Delegate to a steps generator; returns (its response, whether a fallback summary was sent in)."""
+    fallback = False
+    summaries = None
+    while True:
+        try:
+            jobs = steps.send(summaries)
+        except StopIteration as done:
+            return done.value, fallback
+        summaries = yield jobs
+        fallback = fallback or any(is_fallback(summary) for summary in summaries)
+
+
+def _analyze_response(request, dataset, orient, table_params, asynchronous=False):
+    """The analyze response for validated parameters; yields summary jobs like ``_analyze_steps``."""
+    q = request.GET.get('area')
+    compare = request.GET.get('compare')
+    years = request.GET.get('years')
+
+    # ======================================================
+    #  COMPARE MULTIPLE AREAS
+    # ======================================================
+    if compare:
+        areas = [a.strip() for a in compare.split(',') if a.strip()]
+        payloads = {area: area_payload(dataset, area, 'analysis') for area in areas}
+        response = yield from _compare_result(dataset, areas, payloads, table_params)
+        return FrameJSONResponse(response, orient=orient)
+
+    # ======================================================
+    #  SINGLE AREA ANALYSIS (growth mode with years=N)
+    # ======================================================
+    if q:
+        mode = 'growth' if years else 'analysis'
+        payload = area_payload(dataset, q, mode, years)
+
+        if payload is None:
             return JsonResponse({
-                'status': 'ok',
-                'summary': summary,
-                'chart': chart,
-                'table': table
-            })
+                'status': 'error',
+                'message': 'No data for area',
+                'suggestions': dataset.area_index.suggest(q)
+            }, status=404)
+
+        if _wants_stream(request):
+            label, stats, mode = summary_job(q, payload, mode, years)
+            table, page = _table_view(payload['table'], table_params)
+            return _stream_analysis(label, payload['chart'], table, stats, mode, orient, page, asynchronous)
 
-        return JsonResponse({'status': 'ok', 'message': 'Please provide ?area= or ?compare='})
+        response = yield from _area_result(q, payload, mode, years, table_params)
+        return FrameJSONResponse(response, orient=orient)
+
+    return JsonResponse({'status': 'ok', 'message': 'Please provide ?area= or ?compare='})
+
+
+# -----------------------------
+# Batch analysis
+# -----------------------------
+def _batch_queries(request):
+    """Parse a batch body: a list of queries or {"queries": [...], "dataset", "orient"}."""
+    try:
+        body = json.loads(request.body or b'null')
+    except ValueError:
+        raise InvalidQuery('Body must be JSON')
+    options = {}
+    if isinstance(body, dict):
+        options, body = body, body.get('queries')
+    if not isinstance(body, list) or not all(isinstance(q, dict) for q in body):
+        raise InvalidQuery('Expected a list of query objects')
+    limit = getattr(settings, 'BATCH_MAX_QUERIES', 50)
+    if len(body) > limit:
+        raise InvalidQuery(f'At most {limit} queries per batch')
+    return body, options
+
+
+def _batch_query(dataset, query, payloads):
+    """Plan one batch query: returns (payload specs, generator factory).
+
+    Queries take the analyze parameters: ``area``, ``compare`` (a list or a
+    comma-separated string), ``years`` and the table parameters.
+    """
+    params = {
+        k: ','.join(map(str, v)) if isinstance(v, list) else str(v)
+        for k, v in query.items() if v is not None and k not in ('id', 'compare')
+    }
+    table_params = _table_params(params)
+    compare = query.get('compare')
+    if isinstance(compare, str):
+        compare = compare.split(',')
+    if compare:
+        areas = [str(a).strip() for a in compare if str(a).strip()]
+        specs = [(area, 'analysis', None) for area in areas]
+        return specs, lambda: _compare_result(
+            dataset, areas, {area: payloads[spec] for area, spec in zip(areas, specs)}, table_params)
+
+    area = params.get('area')
+    if not area:
+        raise InvalidQuery('Each query needs an area or compare')
+    years = params.get('years')
+    mode = 'growth' if years else 'analysis'
+    spec = (area, mode, years)
+
+    def result():
+        if payloads[spec] is None:
+            return {'status': 'error', 'message': 'No data for area',
+                    'suggestions': dataset.area_index.suggest(area)}
+        return (yield from _area_result(area, payloads[spec], mode, years, table_params))
+    return [spec], result
+
+
+def _batch_steps(request):
+    """The batch view as a steps generator (see ``_analyze_steps``).
+
+    The data stages run once for the whole batch: every area is matched
+    once and the matched rows are priced together, and equal summary jobs
+    across queries are requested once, in a single concurrent round.
+    """
+    try:
+        if request.method != 'POST':
+            return JsonResponse({'status': 'error', 'message': 'POST a JSON list of queries'}, status=405)
+        queries, options = _batch_queries(request)
+        orient = options.get('orient', 'records')
+        if orient not in ORIENTS:
+            raise InvalidQuery(f"orient must be one of {', '.join(ORIENTS)}")
+
+        with metrics.span('load'):
+            dataset = _load_data(dataset_id=options.get('dataset'))
+        if dataset is None:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Unknown dataset; upload it again via /api/datasets/'
+            }, status=404)
+
+        payloads = {}
+        planned = []
+        for query in queries:
+            try:
+                planned.append(_batch_query(dataset, query, payloads))
+            except InvalidQuery as e:
+                planned.append(e)
+        payloads.update(_area_payloads(dataset, [
+            spec for plan in planned if not isinstance(plan, Exception) for spec in plan[0]
+        ]))
+
+        # Run every query up to its summary round and merge the rounds
+        results = [None] * len(queries)
+        pending = []
+        jobs = {}
+        for i, plan in enumerate(planned):
+            if isinstance(plan, Exception):
+                results[i] = {'status': 'error', 'message': str(plan)}
+                continue
+            steps = plan[1]()
+            try:
+                done, value = _advance(steps)
+            except InvalidQuery as e:
+                done, value = True, {'status': 'error', 'message': str(e)}
+            if done:
+                results[i] = value
+                continue
+            keys = [summary_key(*job) for job in value]
+            for key, job in zip(keys, value):
+                jobs.setdefault(key, job)
+            pending.append((i, steps, keys))
+
+        if jobs:
+            summaries = dict(zip(jobs, (yield list(jobs.values()))))
+            for i, steps, keys in pending:
+                _, results[i] = _advance(steps, [summaries[key] for key in keys])
+
+        for query, result in zip(queries, results):
+            if 'id' in query:
+                result['id'] = query['id']
+        return FrameJSONResponse({'status': 'ok', 'results': results}, orient=orient)
+
+    except InvalidQuery as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
 
+@csrf_exempt
+def batch(request):
+    """POST many analyze queries at once; returns their results in order."""
+    return _drive(_batch_steps(request))
+
+
+async def batch_async(request):
+    """ASGI version of ``batch``."""
+    return await _adrive(_batch_steps(request))
+
+
+batch_async.csrf_exempt = True
+
+
+@csrf_exempt
+def upload_dataset(request):
+    """Ingest a workbook once and return its dataset ID for ``analyze?dataset=``."""
+    if request.method != 'POST' or not request.FILES.get('file'):
+        return JsonResponse({'status': 'error', 'message': "POST an Excel file in the 'file' field"}, status=400)
+    try:
+        dataset, created = upload_store.ingest(request.FILES['file'])
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    return JsonResponse({
+        'status': 'ok',
+        'dataset': dataset.version,
+        'created': created,
+        'rows': len(dataset.frame),
+        'columns': [str(c) for c in dataset.frame.columns]
+    }, status=201 if created else 200)
+
+
+def _rows_denied(request, dataset_id):
+    """The error response for a row upsert this request may not make, else None.
+
+    Upserts change what every client sees (and, for the sample, what later
+    workers load), so they are off unless ROWS_API_ENABLED. With
+    ROWS_API_TOKEN set every upsert needs it as a bearer token; without one
+    only uploaded datasets can be updated.
+    """
+    if not getattr(settings, 'ROWS_API_ENABLED', False):
+        return JsonResponse({'status': 'error', 'message': 'Row updates are disabled'}, status=404)
+    token = getattr(settings, 'ROWS_API_TOKEN', '')
+    if token:
+        scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(given.strip().encode(), token.encode()):
+            return JsonResponse({'status': 'error', 'message': 'Missing or wrong bearer token'}, status=403)
+    elif not dataset_id:
+        return JsonResponse({'status': 'error', 'message': 'Updating the sample needs ROWS_API_TOKEN'}, status=403)
+    return None
+
+
+@csrf_exempt
+def upsert_rows(request):
+    """Insert or update Area/Year rows of a dataset.
+
+    POST {"dataset": ID (default: the sample), "rows": [{"Area": ..., "Year": ..., ...}]}.
+    The updated data gets a new dataset ID, returned as "dataset"; the old
+    ID keeps addressing the data as it was. Only the touched areas are
+    re-aggregated (and re-summarized by the precompute job); cached results
+    for the other areas stay valid. See _rows_denied for who may call it.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'POST {"rows": [...]}'}, status=405)
+    try:
+        body = json.loads(request.body or b'null')
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Body must be JSON'}, status=400)
+    if not isinstance(body, dict) or not isinstance(body.get('rows'), list) \
+            or not all(isinstance(row, dict) for row in body['rows']):
+        return JsonResponse({'status': 'error', 'message': 'Expected {"rows": [...]}'}, status=400)
+    denied = _rows_denied(request, body.get('dataset'))
+    if denied is not None:
+        return denied
+
+    for attempt in range(3):
+        dataset = _load_data(dataset_id=body.get('dataset'))
+        if dataset is None:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Unknown dataset; upload it again via /api/datasets/'
+            }, status=404)
+        previous = dataset.version
+        try:
+            report = dataset.upsert(body['rows'])
+            break
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+        except StaleDataset:
+            # another worker published a newer version of the sample: update that one
+            continue
+    else:
+        return JsonResponse({'status': 'error', 'message': 'Dataset is being updated; try again'}, status=409)
+    if dataset.path is None:
+        upload_store.moved(previous, dataset)
+
+    return JsonResponse({'status': 'ok', 'dataset': dataset.version, 'rows': len(dataset.frame), **report})
+
+
+def rank_areas(request):
+    """Rank every area of a dataset on one metric of its Area x Year cube.
+
+    ``by`` is ``<measure>_<stat>`` (measures: price, demand and the rate
+    columns flat/office/others/shop; stats: latest, first, mean, change,
+    cagr), over the last ``years`` years. ``min_<metric>``/``max_<metric>``
+    filter the areas, e.g. the cheapest areas with rising demand:
+    ``?by=price_latest&order=asc&min_demand_change=0``.
+    """
+    params = request.GET
+    try:
+        order = params.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            raise InvalidQuery('order must be asc or desc')
+        try:
+            years = int(params['years']) if params.get('years') else None
+            limit = int(params.get('limit') or 10)
+            filters = [
+                (key[4:], key[:3], float(value))
+                for key, value in params.items() if key.startswith(('min_', 'max_'))
+            ]
+        except ValueError:
+            raise InvalidQuery('years and limit must be integers, min_/max_ bounds numbers')
+        if (years is not None and years < 1) or limit < 1:
+            raise InvalidQuery('years and limit must be positive')
+
+        with metrics.span('load'):
+            dataset = _load_data(dataset_id=params.get('dataset'))
+        if dataset is None:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Unknown dataset; upload it again via /api/datasets/'
+            }, status=404)
+        cube = dataset.cube
+        if cube is None:
+            raise InvalidQuery('The dataset has no Area and Year columns')
+
+        by = params.get('by', 'price_cagr')
+        with metrics.span('rank'):
+            ranking = cube.rank(by, years, ascending=(order == 'asc'), limit=limit, filters=filters)
+    except (InvalidQuery, InvalidMetric) as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+    return JsonResponse({'status': 'ok', 'by': by, 'order': order, **ranking})
+
+
 def health(request):
-    return JsonResponse({'status': 'ok'})
+    tag = http_cache.etag('health')
+    response = http_cache.lookup(request, tag, cached=False)
+    return response or http_cache.finish(JsonResponse({'status': 'ok'}), tag, cached=False)
+
+
+def metrics_view(request):
+    """Per-worker stage timings, LLM usage and cache counters in Prometheus text format."""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@metrics.register_collector
+def _payload_cache_metrics():
+    return [
+        ('analyze_payload_cache_hits_total', 'counter', {}, _payload_cache.hits),
+        ('analyze_payload_cache_misses_total', 'counter', {}, _payload_cache.misses),
+        ('analyze_payload_cache_entries', 'gauge', {}, len(_payload_cache)),
+    ]
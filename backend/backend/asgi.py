@@ -0,0 +1,15 @@
+import os
+from django.core.asgi import get_asgi_application
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+os.environ.setdefault('ASYNC_SERVING', 'True')
+application = get_asgi_application()
+
+# Parse the sample workbook before this worker accepts traffic, start
+# loading the OpenAI SDK in the background, then (with PRECOMPUTE_SUMMARIES)
+# fill the summary cache in the background
+from api.dataset import warm_up  # noqa: E402
+from api.openai_utils import prewarm  # noqa: E402
+from api.precompute import schedule  # noqa: E402
+dataset = warm_up()
+prewarm()
+schedule(dataset)
@@ -23,15 +23,24 @@ INSTALLED_APPS = [
 # MIDDLEWARE
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'api.middleware.MetricsMiddleware',
     'django.middleware.common.CommonMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",  # ← required for Railway
 ]
 
+# Set by backend/asgi.py: serve analyze from its async view
+ASYNC_SERVING = os.getenv("ASYNC_SERVING", "False") == "True"
+if ASYNC_SERVING:
+    # WhiteNoise's middleware is sync-only and would run every request on one
+    # thread under ASGI; the API serves no static files.
+    MIDDLEWARE.remove("whitenoise.middleware.WhiteNoiseMiddleware")
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = []
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
 
 # DATABASE (SQLite is fine for Railway free tier)
 DATABASES = {
@@ -51,3 +60,82 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 # ENVIRONMENT VARIABLES
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+# ANALYZE CACHES
+ANALYZE_CACHE_SIZE = int(os.getenv("ANALYZE_CACHE_SIZE", "256"))  # cached chart/table payloads per worker
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "50"))  # queries accepted per /api/batch/ request
+
+# HTTP CACHING
+HTTP_CACHE_CONTROL = os.getenv("HTTP_CACHE_CONTROL", "public, no-cache")  # Cache-Control of analyze/health responses
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "")  # whole analyze responses in Django's cache: '', 'locmem' or 'file'
+RESPONSE_CACHE_TIMEOUT = int(os.getenv("RESPONSE_CACHE_TIMEOUT", "300"))  # seconds
+
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+if RESPONSE_CACHE == 'file':
+    # shared by every worker process on the host
+    CACHES['responses'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv("RESPONSE_CACHE_DIR", str(BASE_DIR / '.response_cache')),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))},
+    }
+elif RESPONSE_CACHE:
+    CACHES['responses'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses',
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))},
+    }
+
+# METRICS
+SERVER_TIMING = os.getenv("SERVER_TIMING", "False") == "True"  # per-stage Server-Timing response header
+
+# LOGGING
+# api.* logs prompt sizes, dataset loads and precompute progress at INFO;
+# Django's default config would drop them
+API_LOG_LEVEL = os.getenv("API_LOG_LEVEL", "INFO")
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'api_console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'api': {'handlers': ['api_console'], 'level': API_LOG_LEVEL, 'propagate': False},
+    },
+}
+
+# LLM SUMMARIES
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))  # deadline per summary call, retries included
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))  # concurrent summary calls per worker
+LLM_ASYNC_MAX_CONCURRENCY = int(os.getenv("LLM_ASYNC_MAX_CONCURRENCY", "256"))  # in-flight summaries per ASGI process
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None  # point at a local fake server for testing
+LLM_POOL_CONNECTIONS = int(os.getenv("LLM_POOL_CONNECTIONS", "20"))  # keep-alive connections per sync client
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))  # seconds an idle connection is kept
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))  # retries on 429/5xx/connection errors
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.25"))  # seconds, doubled per attempt, jittered
+LLM_RETRY_BACKOFF_MAX = float(os.getenv("LLM_RETRY_BACKOFF_MAX", "4"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))  # consecutive failures that open the circuit
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))  # seconds before a trial call
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", "1500"))  # data section of the prompt, 0 = unlimited
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", str(BASE_DIR / 'summary_cache.sqlite3'))  # empty disables
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "5000"))
+PRECOMPUTE_SUMMARIES = os.getenv("PRECOMPUTE_SUMMARIES", "False") == "True"  # fill the cache after each dataset load
+PRECOMPUTE_CONCURRENCY = int(os.getenv("PRECOMPUTE_CONCURRENCY", "4"))
+PRECOMPUTE_RATE = float(os.getenv("PRECOMPUTE_RATE", "2"))  # upstream requests per second, 0 = unlimited
+PRECOMPUTE_GROWTH_YEARS = tuple(int(y) for y in os.getenv("PRECOMPUTE_GROWTH_YEARS", "3,5").split(",") if y.strip())
+
+# DATASETS
+# Parsed workbooks are cached here as columnar snapshots, numeric columns memory-mapped (empty disables)
+DATASET_SNAPSHOT_DIR = os.getenv("DATASET_SNAPSHOT_DIR", str(BASE_DIR / '.snapshots'))
+DATASET_SNAPSHOT_KEEP = int(os.getenv("DATASET_SNAPSHOT_KEEP", "2"))  # superseded upserted versions of the sample kept on disk
+DATASET_STORE_MAX_BYTES = int(os.getenv("DATASET_STORE_MAX_BYTES", str(256 * 1024 * 1024)))  # uploads kept in memory per worker
+DATASET_STORE_MAX_DISK_BYTES = int(os.getenv("DATASET_STORE_MAX_DISK_BYTES", str(2 * 1024 ** 3)))  # upload snapshots kept on disk
+ROWS_API_ENABLED = os.getenv("ROWS_API_ENABLED", "False") == "True"  # accept POST /api/rows/
+ROWS_API_TOKEN = os.getenv("ROWS_API_TOKEN", "")  # required as "Authorization: Bearer <token>"; none = uploads only
@@ -2,3 +2,17 @@ import os
 from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 application = get_wsgi_application()
+
+# Parse the sample workbook before this worker accepts traffic, start
+# loading the OpenAI SDK in the background, then (with PRECOMPUTE_SUMMARIES)
+# fill the summary cache in the background. Under gunicorn.conf.py this runs
+# once in the master (preload_app): the SDK is loaded before the fork too,
+# and the precompute is started in the first worker instead.
+from api.dataset import warm_up  # noqa: E402
+from api.openai_utils import prewarm  # noqa: E402
+from api.precompute import schedule  # noqa: E402
+preloading = os.environ.get('WSGI_PRELOAD') == 'True'
+dataset = warm_up()
+prewarm(background=not preloading)
+if not preloading:
+    schedule(dataset)
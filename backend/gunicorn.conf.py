@@ -0,0 +1,30 @@
+# gunicorn reads this file from the working directory (see the Procfile).
+# The worker count comes from WEB_CONCURRENCY, the port from PORT.
+import gc
+import os
+
+# Import the app once in the master: the sample dataset, its area index and
+# its cube are loaded before the workers are forked, so the workers start
+# warm and share that memory instead of each holding a copy. The numeric
+# columns, name vectors and cube are memory-mapped from the dataset's
+# snapshot, so they stay shared (through the page cache) for the workers'
+# lifetime. The string columns are Python objects: shared after the fork,
+# but reference counting gradually copies their pages into each worker.
+preload_app = True
+
+# backend/wsgi.py leaves the summary precompute to a worker (see post_fork):
+# the master must not hold LLM connections across forks
+os.environ['WSGI_PRELOAD'] = 'True'
+
+
+def pre_fork(server, worker):
+    # objects created while preloading are never collected: the collector
+    # would otherwise write to their pages in every worker and un-share them
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if worker.age == 1:
+        from api.dataset import get_dataset
+        from api.precompute import schedule
+        schedule(get_dataset())
@@ -99,6 +99,8 @@ export default function Chat() {
 
     // Build API URL. Support natural phrasings for compare, price growth, and analysis.
     let url = 'https://realestatechatbotopenai-production.up.railway.app/api/analyze/';
+    // Single-area answers are streamed: chart/table first, summary text as it arrives
+    let stream = false;
 
     // 1) Compare queries: "Compare A and B", "A vs B", "compare A and B demand trends"
     const compareRegex = /(?:^|\b)compare\b\s+(.+?)(?:\s+demand trends)?$/i;
@@ -126,6 +128,7 @@ export default function Chat() {
         const area = m[1].trim();
         const years = m[2] ? m[2] : '3';
         url += `?area=${encodeURIComponent(area)}&years=${encodeURIComponent(years)}`;
+        stream = true;
       } else {
         // 3) Analysis queries: "Give me analysis of X", "Analysis of X", "Analyze X"
         const analysisRegex = /(?:give me\s*)?(?:analysis of|analyse of|analyse|analyze)\s+(.+)$/i;
@@ -137,11 +140,18 @@ export default function Chat() {
           // Default: treat entire input as an area name
           url += `?area=${encodeURIComponent(userInput.trim())}`;
         }
+        stream = true;
       }
     }
 
     try {
-      const res = await fetch(url);
+      const res = await fetch(stream ? `${url}&stream=1` : url);
+
+      if (stream && res.body && (res.headers.get('content-type') || '').includes('ndjson')) {
+        await readSummaryStream(res);
+        return;
+      }
+
       const data = await res.json();
 
       // Create bot message
@@ -174,6 +184,44 @@ export default function Chat() {
     }
   };
 
+  // Consume the newline-delimited JSON events of a streamed analyze response.
+  const readSummaryStream = async (res) => {
+    const id = `bot-${Date.now()}`;
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    const updateBot = (fn) => setMessages(prev => prev.map(m => m.id === id ? fn(m) : m));
+
+    const handleEvent = (evt) => {
+      if (evt.event === 'data') {
+        const botMessage = { id, sender: 'bot', content: '', chart: evt.chart, table: evt.table };
+        if (evt.chart || evt.table) botMessage.askDownload = true;
+        setMessages(prev => [...prev, botMessage]);
+        setTyping(false);
+        scrollToBottom();
+      } else if (evt.event === 'summary') {
+        updateBot(m => ({ ...m, content: m.content + evt.delta }));
+      } else if (evt.event === 'done') {
+        // after an error the message already shows it; the partial summary would replace it
+        if (!evt.error) updateBot(m => ({ ...m, content: evt.summary + '\n' }));
+        scrollToBottom();
+      } else if (evt.event === 'error') {
+        updateBot(m => ({ ...m, content: m.content || evt.message }));
+      }
+    };
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split('\n');
+      buffer = lines.pop();
+      lines.filter(l => l.trim()).forEach(l => handleEvent(JSON.parse(l)));
+    }
+    if (buffer.trim()) handleEvent(JSON.parse(buffer));
+  };
+
   const renderSummary = (summary) => {
     return summary.split("\n").map((line, idx) => (
       <p key={idx} style={{ marginBottom: '0.5rem', lineHeight: '1.5' }}>{line}</p>